@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+
+'''
+Benchmarks of the hot paths of a simulation at a range of grid and
+population sizes. Run
+
+    python benchmarks.py results.json
+
+to time everything and write the results as JSON, and
+
+    python benchmarks.py results.json --baseline baseline.json
+
+to also compare against an earlier results file and flag every benchmark
+that got slower by more than the tolerance (the exit status is then 1).
+
+'''
+
+import numpy as np
+import environment
+import mosquito
+import lib_numericalMethods as nMeth
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+hostx = np.array([30.0,70.0])
+hosty = np.array([40.0,60.0])
+
+def makeEnviron(N,numHosts=2):
+    '''
+    An environment on an NxN grid with random velocities and CO2, and
+    numHosts hosts scattered over the domain.
+
+    '''
+    rng = np.random.RandomState(3987)
+    if numHosts == 2:
+        hx, hy = hostx, hosty
+    else:
+        hx, hy = 10 + 80*rng.rand(numHosts), 10 + 80*rng.rand(numHosts)
+    environ = environment.environment(hx,hy,numGridPoints=N,seed=1)
+    environ.randVel1 = environ.randVelMag*rng.randn(N,N)
+    environ.randVel2 = environ.randVelMag*rng.randn(N,N)
+    environ.CO2 = rng.rand(N,N)
+    return environ
+
+def randomPoints(environ,M,seed=2345):
+    rng = np.random.RandomState(seed)
+    L = environ.simsParams['domainLength']
+    h = environ.simsParams['h']
+    return h/2. + (L-h)*(0.001 + 0.998*rng.rand(M)), h/2. + (L-h)*(0.001 + 0.998*rng.rand(M))
+
+def benchInterp(gridSize,M):
+    environ = makeEnviron(gridSize)
+    x,y = randomPoints(environ,M)
+    h = environ.simsParams['h']
+    return lambda: nMeth.interpFromGrid(x,y,h,environ.randVel1,environ.randVel2,environ.CO2), None
+
+def benchExtrap(gridSize,M):
+    environ = makeEnviron(gridSize)
+    x,y = randomPoints(environ,M)
+    s = np.random.RandomState(1).rand(M)
+    return lambda: nMeth.extrapToGrid(x,y,s,environ.simsParams['h'],environ.xg.shape), None
+
+def benchUpwind(gridSize):
+    environ = makeEnviron(gridSize)
+    U = environ.constantU + environ.randVel1
+    V = environ.constantV + environ.randVel2
+    return lambda: nMeth.upwindScheme(U,V,environ), None
+
+def benchUpwindInPlace(gridSize):
+    environ = makeEnviron(gridSize)
+    U = environ.constantU + environ.randVel1
+    V = environ.constantV + environ.randVel2
+    out = np.empty(U.shape)
+    return lambda: nMeth.upwindSchemeInPlace(U,V,environ,out), None
+
+def benchForwardEuler(gridSize):
+    environ = makeEnviron(gridSize)
+    return lambda: nMeth.forwardEuler(0.0,environ.CO2,environ.simsParams['dt'],environ._updateCO2HeavisideRandVel), None
+
+def benchExplicitRK4(gridSize):
+    environ = makeEnviron(gridSize)
+    return lambda: nMeth.explicitRK4(0.0,environ.CO2,environ.simsParams['dt'],environ._updateCO2HeavisideRandVel), None
+
+def benchLowStorageRK(gridSize,method):
+    environ = makeEnviron(gridSize)
+    environ._switchRandVel(0)
+    registers = nMeth.makeRKRegisters(environ.CO2.shape)
+    y = environ.CO2.copy()
+    return lambda: getattr(nMeth,method)(0.0,y,environ.simsParams['dt'],environ._CO2RHS,registers), None
+
+def benchImplicitRK(gridSize):
+    environ = makeEnviron(gridSize)
+    U = environ.constantU + environ.randVel1
+    V = environ.constantV + environ.randVel2
+    system = nMeth.makeImplicitSystem(nMeth.upwindMatrix(U,V,environ),environ.simsParams['dt'],0.5)
+    return lambda: nMeth.implicitRK(environ.CO2,environ.hostSource.dense(),system), None
+
+def benchQuerySignal(gridSize,M):
+    environ = makeEnviron(gridSize)
+    x,y = randomPoints(environ,M)
+    def setup():
+        # the CO2 changes between decisions, so time its packing too
+        environ.plumeVersion += 1
+    return lambda: environ.querySignal(x,y), setup
+
+def benchResponseCurve(M):
+    mosqs = mosquito.klinotaxis(np.zeros(3),windKappa=1.0,windThresh=0.01)
+    val = 0.6*np.random.RandomState(7).rand(M)
+    return lambda: mosqs._responseCurve('wind',val), None
+
+def benchAtHost(gridSize,M,numHosts=300):
+    environ = makeEnviron(gridSize,numHosts)
+    x,y = randomPoints(environ,M)
+    mosqs = mosquito.mixedStrategies(environ,x,np.repeat(['upwind'],M))
+    mosqs.currentPosy = y
+    state = mosqs.state.copy()
+    def setup():
+        # _atHost retires the captured mosquitoes, so start each repeat afresh
+        mosqs.state[:] = state
+        mosqs.numActive = M
+        mosqs.results = mosquito.resultsWriter.captureBuffer()
+    return lambda: mosqs._atHost(environ,0.0), setup
+
+def benchmarkList(gridSizes,popSizes,interpGridSize=128):
+    '''
+    Returns a list of (name, size, unit, number of units, factory), where
+    factory() gives the function to time and a setup function (or None) to
+    call before every call of it.
+
+    '''
+    cases = []
+    for N in gridSizes:
+        for name,bench in [('upwindScheme',benchUpwind),('upwindSchemeInPlace',benchUpwindInPlace),('forwardEuler',benchForwardEuler),('explicitRK4',benchExplicitRK4),('implicitRK',benchImplicitRK)]:
+            cases.append((name,N,'grid cells',N*N,lambda bench=bench,N=N: bench(N)))
+        for name in ['sspRK2','sspRK3','lowStorageRK4']:
+            cases.append((name,N,'grid cells',N*N,lambda name=name,N=N: benchLowStorageRK(N,name)))
+    for M in popSizes:
+        for name,bench in [('interpFromGrid',benchInterp),('extrapToGrid',benchExtrap),('querySignal',benchQuerySignal),('_atHost',benchAtHost)]:
+            cases.append((name,M,'points',M,lambda bench=bench,M=M: bench(interpGridSize,M)))
+        cases.append(('_responseCurve',M,'points',M,lambda M=M: benchResponseCurve(M)))
+    return cases
+
+def timeCall(func,setup=None,minTime=0.2,maxRepeats=100):
+    '''
+    Returns the shortest of several timings of func() in seconds, repeating
+    until minTime has been spent (or maxRepeats calls have been made).
+
+    '''
+    best = np.inf
+    spent = 0.0
+    for _ in range(maxRepeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = min(best,elapsed)
+        spent += elapsed
+        if spent > minTime:
+            break
+    return best
+
+def peakMemory(func,setup=None):
+    '''
+    Returns the peak memory in bytes allocated during one call of func(), as
+    traced by tracemalloc (numpy reports its array allocations to it).
+
+    '''
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run(gridSizes=(64,128,256,512,1024),popSizes=(100,1000,10000,100000,1000000),minTime=0.2,verbose=True):
+    '''
+    Runs every benchmark and returns a dictionary that can be written as JSON:
+    a description of the machine and a list with, for each benchmark and
+    size, the best time per call, throughput and peak memory.
+
+    '''
+    results = []
+    for name,size,unit,count,factory in benchmarkList(gridSizes,popSizes):
+        func,setup = factory()
+        func()
+        seconds = timeCall(func,setup,minTime)
+        peak = peakMemory(func,setup)
+        results.append({'benchmark':name,'size':size,'seconds':seconds,'throughput':count/seconds,'unit':unit+'/s','peakMemoryMB':peak/2.**20})
+        if verbose:
+            print('{:20s} {:>8d}  {:.3e} s  {:.3e} {}/s  {:.1f} MB'.format(name,size,seconds,count/seconds,unit,peak/2.**20))
+    return {'python':platform.python_version(),'numpy':np.__version__,'machine':platform.machine(),'processor':platform.processor(),'results':results}
+
+def compare(results,baseline,tolerance=0.25):
+    '''
+    Compares two dictionaries returned by run. Returns a list of
+    (benchmark, size, baseline seconds, seconds) for every benchmark that is
+    more than tolerance (as a fraction) slower than in baseline.
+
+    '''
+    old = dict(((r['benchmark'],r['size']),r['seconds']) for r in baseline['results'])
+    regressions = []
+    for r in results['results']:
+        key = (r['benchmark'],r['size'])
+        if key in old and r['seconds'] > (1.0 + tolerance)*old[key]:
+            regressions.append((r['benchmark'],r['size'],old[key],r['seconds']))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the simulation hot paths.')
+    parser.add_argument('output',help='JSON file to write the results to')
+    parser.add_argument('--baseline',help='JSON results file to compare against')
+    parser.add_argument('--tolerance',type=float,default=0.25,help='slowdown (as a fraction) flagged as a regression')
+    parser.add_argument('--gridSizes',type=int,nargs='+',default=[64,128,256,512,1024])
+    parser.add_argument('--popSizes',type=int,nargs='+',default=[100,1000,10000,100000,1000000])
+    parser.add_argument('--minTime',type=float,default=0.2,help='seconds to spend timing each benchmark')
+    args = parser.parse_args()
+    results = run(args.gridSizes,args.popSizes,args.minTime)
+    with open(args.output,'w') as f:
+        json.dump(results,f,indent=1)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results,json.load(f),args.tolerance)
+        for name,size,before,after in regressions:
+            print('REGRESSION {} at size {}: {:.3e} s -> {:.3e} s ({:+.0f}%)'.format(name,size,before,after,100*(after/before-1)))
+        if regressions:
+            sys.exit(1)
+        print('No regressions beyond {:.0f}%.'.format(100*args.tolerance))
@@ -0,0 +1,87 @@
+import numpy as np
+import hashlib
+import os
+
+def runKey(environ,populations=()):
+    '''
+    Returns a hash of everything that makes a run: the numerical parameters
+    (including the seed), hosts, host emission, bulk wind and random 
+    velocity magnitude of environ (as environment.spinUpKey), and the class,
+    parameters and starting positions of every population. Checkpoints 
+    store it, so a run only resumes from a checkpoint of the same run.
+
+    '''
+    key = hashlib.sha1()
+    key.update(repr(sorted(environ.simsParams.items())).encode('utf-8'))
+    key.update(repr(environ.randVelMag).encode('utf-8'))
+    for arr in [environ.hostPositionx,environ.hostPositiony,environ.hostSourceStrength]:
+        key.update(np.ascontiguousarray(arr,dtype=float).tobytes())
+    if environ.windProvider is None:
+        for arr in [environ.constantU,environ.constantV]:
+            key.update(np.ascontiguousarray(arr,dtype=float).tobytes())
+    else:
+        # the provider's current fields move with time
+        key.update(environ.windProvider.fingerprint())
+    key.update(environ.hostSource.fingerprint(environ.simsParams['initialTime'],environ.simsParams['finalTime']))
+    for pop in populations:
+        key.update(type(pop).__name__.encode('utf-8'))
+        key.update(repr(sorted(pop.mosqParams.items())).encode('utf-8'))
+        key.update(np.ascontiguousarray(pop.initPosx,dtype=float).tobytes())
+        if hasattr(pop,'strategies'):
+            key.update(np.ascontiguousarray(pop.strategies,dtype=float).tobytes())
+    return key.hexdigest()
+
+def checkpointMatches(path,environ,populations=()):
+    '''
+    Returns whether the checkpoint file path was written by a run of environ
+    and populations (see runKey).
+
+    '''
+    with np.load(path) as f:
+        return 'key' in f.files and str(f['key']) == runKey(environ,populations)
+
+def saveCheckpoint(path,step,environ,populations=()):
+    '''
+    Writes everything needed to resume a run after time step number step
+    to the compressed .npz file path: the state of environ, of every
+    mosquito population in populations and of the global numpy random
+    generator the mosquitoes draw from, and the runKey. The file is written
+    next to path and renamed into place, so a run killed mid-write leaves 
+    the previous checkpoint intact.
+
+    '''
+    arrays = {'step':np.array(step),'key':np.array(runKey(environ,populations))}
+    for name,value in environ.checkpointState().items():
+        arrays['environ_'+name] = value
+    for k,pop in enumerate(populations):
+        for name,value in pop.checkpointState().items():
+            arrays['pop{}_{}'.format(k,name)] = value
+    kind,key,pos,hasGauss,cachedGaussian = np.random.get_state()
+    arrays['random_key'] = key
+    arrays['random_pos'] = np.array([pos,hasGauss])
+    arrays['random_cachedGaussian'] = np.array(cachedGaussian)
+    tmp = path + '.tmp'
+    with open(tmp,'wb') as f:
+        np.savez_compressed(f,**arrays)
+    os.replace(tmp,path)
+
+def loadCheckpoint(path,environ,populations=()):
+    '''
+    Restores environ, the populations (constructed with the same arguments
+    as in the checkpointed run) and the global numpy random generator from
+    a file written by saveCheckpoint. Returns the step number saved, so the
+    run resumes at step + 1. Raises ValueError if the checkpoint is from a
+    different run (see checkpointMatches).
+
+    '''
+    with np.load(path) as f:
+        arrays = dict((name,f[name]) for name in f.files)
+    if 'key' not in arrays or str(arrays['key']) != runKey(environ,populations):
+        raise ValueError('The checkpoint %s is from a run with different parameters, hosts or wind.' %path)
+    environ.restoreState(dict((name[len('environ_'):],value) for name,value in arrays.items() if name.startswith('environ_')))
+    for k,pop in enumerate(populations):
+        prefix = 'pop{}_'.format(k)
+        pop.restoreState(dict((name[len(prefix):],value) for name,value in arrays.items() if name.startswith(prefix)))
+    pos,hasGauss = arrays['random_pos']
+    np.random.set_state(('MT19937',arrays['random_key'],int(pos),int(hasGauss),float(arrays['random_cachedGaussian'])))
+    return int(arrays['step'])
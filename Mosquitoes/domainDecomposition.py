@@ -0,0 +1,368 @@
+import numpy as np
+import environment
+import lib_numericalMethods as nMeth
+import multiprocessing
+from multiprocessing import shared_memory
+import threading
+import time
+import weakref
+
+sharedFields = ['CO2a','CO2b','randVel1','randVel2']
+
+def stripRows(N,numProcesses):
+    '''
+    Splits the N rows (x index) of the grid into numProcesses contiguous
+    strips of nearly equal size. Returns the list of (r0,r1) row ranges.
+
+    '''
+    bounds = np.linspace(0,N,numProcesses+1).round().astype(int)
+    return [(bounds[k],bounds[k+1]) for k in range(numProcesses)]
+
+def _initStrip(strip,N):
+    '''
+    Allocates the padded work arrays of a strip of rows r0:r1 once, in the
+    worker: the velocities Upad and Vpad and the CO2 Cpad of
+    upwindFaceFluxes, with the ghost velocities at the domain edges and a
+    zero CO2 ring.
+
+    '''
+    r0, r1 = strip['r0'], strip['r1']
+    n, m = r1 - r0, N
+    strip['Upad'] = np.zeros((n+2,m))
+    if r0 == 0:
+        strip['Upad'][0,:] = strip['leftedge']
+    if r1 == N:
+        strip['Upad'][-1,:] = strip['rightedge']
+    strip['Vpad'] = np.zeros((n,m+2))
+    strip['Vpad'][:,0] = strip['bottomedge']
+    strip['Vpad'][:,-1] = strip['topedge']
+    strip['Cpad'] = np.zeros((n+2,m+2))
+    strip['work'] = None
+
+def _setStripVelocity(strip,randVel1,randVel2):
+    '''
+    Fills the velocities of the strip and its halo from the random velocity
+    fields and splits them at the cell edges (see makeFaceFluxWork). Only
+    needed when the fields change.
+
+    '''
+    N = randVel1.shape[0]
+    r0, r1 = strip['r0'], strip['r1']
+    lo, hi = max(r0-1,0), min(r1+1,N)
+    strip['Upad'][lo-r0+1:hi-r0+1,:] = strip['constantU'] + randVel1[lo:hi,:]
+    strip['Vpad'][:,1:-1] = strip['constantV'] + randVel2[r0:r1,:]
+    strip['work'] = nMeth.makeFaceFluxWork(strip['Upad'],strip['Vpad'])
+
+def _stepStrip(strip,C,Cnext,dt,h):
+    '''
+    One forward Euler step of rows r0:r1 of the grid, reading the row on
+    either side of the strip (the halo) from C and writing Cnext, in the
+    buffers of _initStrip. The arithmetic is that of environment._CO2RHS
+    with upwindSchemeInPlace, so the result is bit-identical to the single
+    process solve.
+
+    '''
+    N = C.shape[0]
+    r0, r1 = strip['r0'], strip['r1']
+    lo, hi = max(r0-1,0), min(r1+1,N)
+    # CO2 with halo rows from the neighbouring strips, zero outside the domain
+    Cpad = strip['Cpad']
+    Cpad[lo-r0+1:hi-r0+1,1:-1] = C[lo:hi,:]
+    Fx, Fy = nMeth.upwindFaceFluxesInPlace(Cpad,strip['work'])
+    flux = nMeth.faceFluxDivergence(Fx,Fy,h,strip['work'])
+    np.subtract(strip['source'],flux,out=flux)
+    flux *= dt
+    np.add(C[r0:r1,:],flux,out=Cnext[r0:r1,:])
+
+def _drawRows(arrays,randFields,ind,r0,r1,c0,c1,phaseBarrier,timeout):
+    '''
+    Writes rows r0:r1 of the random velocity fields of switch index ind into
+    the shared arrays, drawing only their rows of noise (see
+    randomFields.noiseRows). Correlated fields are filtered as in
+    randomFields.filterNoise with the transform split between the workers:
+    each transforms its rows, then (after phaseBarrier) its columns c0:c1
+    of the shared spectrum, then its rows again.
+
+    '''
+    names = ['randVel1','randVel2']
+    for component,name in enumerate(names):
+        noise = randFields.noiseRows(ind,component,r0,r1)
+        if randFields.amplitude is None:
+            noise *= randFields.randVelMag
+            arrays[name][r0:r1,:] = noise
+        else:
+            arrays['spectrum'][component,r0:r1,:] = np.fft.rfft(noise,axis=1)
+    if randFields.amplitude is None:
+        return
+    phaseBarrier.wait(timeout)
+    for component in range(len(names)):
+        columns = arrays['spectrum'][component,:,c0:c1]
+        spectrum = np.fft.fft(columns,axis=0)
+        spectrum *= randFields.amplitude[:,c0:c1]
+        columns[...] = np.fft.ifft(spectrum,axis=0)
+    phaseBarrier.wait(timeout)
+    for component,name in enumerate(names):
+        field = np.fft.irfft(arrays['spectrum'][component,r0:r1,:],n=randFields.shape[1],axis=1)
+        field *= randFields.randVelMag
+        arrays[name][r0:r1,:] = field
+
+def _worker(shmNames,shapes,r0,r1,c0,c1,strip,dt,h,randFields,control,seed,start,done,phaseBarrier,timeout):
+    blocks = dict((name,shared_memory.SharedMemory(name=shmNames[name])) for name in shmNames)
+    arrays = dict((name,np.ndarray(shapes[name],dtype=complex if name == 'spectrum' else float,buffer=blocks[name].buf)) for name in shmNames)
+    _initStrip(strip,shapes['CO2a'][0])
+    # version of the random velocity fields the strip velocities are for
+    velocityVersion = None
+    try:
+        # the main process must start the next step within timeout
+        while start.acquire(True,timeout):
+            if control[0] == 0:
+                break
+            if control[0] == 2:
+                randFields.seed = int(seed[0])
+                _drawRows(arrays,randFields,control[2],r0,r1,c0,c1,phaseBarrier,timeout)
+            else:
+                if control[3] != velocityVersion:
+                    _setStripVelocity(strip,arrays['randVel1'],arrays['randVel2'])
+                    velocityVersion = control[3]
+                C, Cnext = (arrays['CO2a'],arrays['CO2b']) if control[1] == 0 else (arrays['CO2b'],arrays['CO2a'])
+                _stepStrip(strip,C,Cnext,dt,h)
+            done.release()
+    except threading.BrokenBarrierError:
+        # another worker failed or timed out during a draw
+        pass
+    except BaseException:
+        # release the other workers drawing with this one before dying
+        phaseBarrier.abort()
+        raise
+    finally:
+        del arrays
+        for shm in blocks.values():
+            shm.close()
+
+
+class decomposedEnvironment(environment.environment):
+    '''
+    An environment whose CO2 solve is split into numProcesses strips of grid
+    rows, each advanced by its own worker process. CO2 (double buffered) and
+    the random velocity fields live in shared memory: every step each worker
+    reads its strip and one halo row from each neighbouring strip of the
+    current buffer and writes its strip of the next one, and semaphores
+    keep the workers in step. At a random velocity switch each worker draws
+    its own rows of the new fields (see _drawRows), and each worker holds
+    only its rows of the bulk velocity and host source. querySignal gathers
+    the CO2 straight from shared memory rather than repacking it.
+
+    The main process waits at most timeout seconds for the workers to
+    finish a step, and checks that they are all alive before starting one;
+    if a worker has died or hangs, the workers are stopped, the shared
+    memory is freed and RuntimeError is raised. The workers in turn wait at
+    most timeout seconds for the next step and exit after that, so that
+    they do not outlive a main process that has died; steps must therefore
+    follow each other within timeout (timeout=None waits forever).
+
+    Only fixed step forward Euler with a wind and host emission that do not
+    change in time is supported. Call close() when done to stop the
+    workers and free the shared memory, or use the environment in a with
+    statement; the workers and the shared memory are also freed when the
+    environment is garbage collected or the interpreter exits.
+
+    '''
+
+    # the CO2 changes every step and is read where it lies (see querySignal)
+    CO2RepackFraction = np.inf
+    # seconds between checks that the workers are alive while waiting
+    pollInterval = 0.05
+
+    def __init__(self,hostPositionx,hostPositiony,numProcesses=2,timeout=60.0,**kwargs):
+        environment.environment.__init__(self,hostPositionx,hostPositiony,**kwargs)
+        if self.simsParams['adaptiveTimeStep'] or self.simsParams['integrator'] != 'forwardEuler' or self.simsParams['steadyStateTol'] is not None:
+            raise ValueError('decomposedEnvironment only supports fixed step forward Euler.')
+        if self.windProvider is not None or self.hostSource.timeDependent:
+            raise ValueError('decomposedEnvironment needs a wind and host emission that do not change in time.')
+        self.timeout = timeout
+        N = self.simsParams['numGridPoints']
+        shapes = dict((name,(N,N)) for name in sharedFields)
+        if self.randFields.amplitude is not None:
+            shapes['spectrum'] = (2,N,N//2+1)
+        self.blocks = {}
+        self.workers = []
+        self._finalizer = weakref.finalize(self,_freeShared,self.workers,self.blocks)
+        self.shared = {}
+        for name,shape in shapes.items():
+            dtype = complex if name == 'spectrum' else float
+            self.blocks[name] = shared_memory.SharedMemory(create=True,size=int(np.prod(shape))*np.dtype(dtype).itemsize)
+            self.shared[name] = np.ndarray(shape,dtype=dtype,buffer=self.blocks[name].buf)
+            self.shared[name][...] = 0.0
+        self.currentBuffer = 0
+        self.CO2 = self.shared['CO2a']
+        self.randVel1, self.randVel2 = self.shared['randVel1'], self.shared['randVel2']
+        # control[0] is 1 to step, 2 to draw the random fields of switch
+        # index control[2] and 0 to stop; control[1] is the current CO2
+        # buffer and control[3] counts changes of the random velocity fields
+        self.control = multiprocessing.Array('i',[1,0,0,0],lock=False)
+        self.sharedSeed = multiprocessing.Array('Q',[self.randFields.seed],lock=False)
+        # one start semaphore per worker and a common done semaphore rather
+        # than barriers: a barrier that breaks waits, without a timeout, for
+        # every process waiting on it, which hangs on a stopped worker
+        self.starts = [multiprocessing.Semaphore(0) for _ in range(numProcesses)]
+        self.done = multiprocessing.Semaphore(0)
+        phaseBarrier = multiprocessing.Barrier(numProcesses)
+        self.strips = stripRows(N,numProcesses)
+        columns = stripRows(N//2+1,numProcesses)
+        for (r0,r1),(c0,c1),start in zip(self.strips,columns,self.starts):
+            lo, hi = max(r0-1,0), min(r1+1,N)
+            strip = {'r0':r0,'r1':r1,'constantU':self.constantU[lo:hi,:],'constantV':self.constantV[r0:r1,:],'source':self.hostSource.dense()[r0:r1,:],
+                     'leftedge':self.leftedge,'rightedge':self.rightedge,'bottomedge':self.bottomedge[r0:r1],'topedge':self.topedge[r0:r1]}
+            p = multiprocessing.Process(target=_worker,args=(dict((name,self.blocks[name].name) for name in shapes),shapes,r0,r1,c0,c1,strip,self.simsParams['dt'],self.simsParams['h'],self.randFields,self.control,self.sharedSeed,start,self.done,phaseBarrier,timeout))
+            p.daemon = True
+            p.start()
+            self.workers.append(p)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    def _runWorkers(self,command):
+        '''
+        Has every worker carry out command (see control) and waits for them
+        all to finish, checking every pollInterval seconds that they are
+        still alive.
+
+        '''
+        if not self.workers:
+            raise RuntimeError('The workers of this decomposedEnvironment have been stopped.')
+        self._checkWorkers()
+        self.control[0] = command
+        for start in self.starts:
+            start.release()
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        for _ in self.workers:
+            while not self.done.acquire(True,self.pollInterval):
+                self._checkWorkers(True,deadline is not None and time.time() > deadline)
+
+    def _checkWorkers(self,stepping=False,late=False):
+        # raises RuntimeError, with the workers stopped, if any worker has
+        # exited or they are late finishing a step; workers exit with 0 when
+        # they have waited timeout seconds for a step, which during a step
+        # means that another one hangs
+        if not late and all(p.is_alive() for p in self.workers):
+            return
+        crashed = [(k,p.exitcode) for k,p in enumerate(self.workers) if p.exitcode not in (None,0)]
+        hung = [k for k,p in enumerate(self.workers) if p.is_alive()]
+        self._release()
+        if crashed:
+            raise RuntimeError('decomposedEnvironment worker(s) {} stopped (exit codes {}).'.format([k for k,_ in crashed],[code for _,code in crashed]))
+        if stepping:
+            raise RuntimeError('decomposedEnvironment worker(s) {} did not finish within {} s.'.format(hung,self.timeout))
+        raise RuntimeError('The workers of this decomposedEnvironment exited after waiting more than {} s for a step.'.format(self.timeout))
+
+    def _setHeavisideRandVel(self,ind):
+        self.control[2] = ind
+        self._runWorkers(2)
+        self.control[3] += 1
+
+    def updateEnvironment(self,currentTime):
+        prof = self.profiler
+        if prof is not None:
+            token = prof.start()
+        self._updateRandVel(currentTime)
+        self.control[1] = self.currentBuffer
+        self._runWorkers(1)
+        self.currentBuffer = 1 - self.currentBuffer
+        self.CO2 = self.shared['CO2b'] if self.currentBuffer else self.shared['CO2a']
+        self.plumeVersion += 1
+        if prof is not None:
+            prof.stop('plumeStep',token,self.CO2.size)
+
+    def restoreState(self,state):
+        environment.environment.restoreState(self,state)
+        # put the restored arrays back into shared memory
+        self.shared['CO2a'][...], self.shared['randVel1'][...], self.shared['randVel2'][...] = self.CO2, self.randVel1, self.randVel2
+        self.currentBuffer = 0
+        self.CO2 = self.shared['CO2a']
+        self.randVel1, self.randVel2 = self.shared['randVel1'], self.shared['randVel2']
+        self.sharedSeed[0] = self.randFields.seed
+        self.control[3] += 1
+        self.packedKeys = [None,None]
+
+    def close(self):
+        '''
+        Stops the worker processes and frees the shared memory.
+
+        '''
+        if not self.workers:
+            return
+        if not all(p.is_alive() for p in self.workers):
+            self._release()
+            return
+        self.control[0] = 0
+        for start in self.starts:
+            start.release()
+        for p in self.workers:
+            p.join(self.timeout)
+        self._release()
+
+    def _release(self):
+        # keep private copies of the arrays, since the shared views die
+        # with the blocks, then stop any worker still running and free them
+        self.CO2, self.randVel1, self.randVel2 = self.CO2.copy(), self.randVel1.copy(), self.randVel2.copy()
+        self.shared = {}
+        self.packedArrays = None
+        self._finalizer()
+        self.workers = []
+        self.blocks = {}
+
+def _freeShared(workers,blocks):
+    '''
+    Kills the workers still running and frees the shared memory blocks of a
+    decomposedEnvironment. Run once, by close() or when the environment is
+    garbage collected.
+
+    '''
+    for p in workers:
+        if p.is_alive():
+            # a kill also ends a stopped process
+            p.kill()
+            p.join()
+    for shm in blocks.values():
+        try:
+            shm.close()
+        except BufferError:
+            # a view of the block is still held elsewhere; it stays mapped
+            # until that is dropped, but the name is freed below
+            pass
+        shm.unlink()
+
+def strongScaling(N=2048,processCounts=(1,2,4),numSteps=50,seed=1):
+    '''
+    Times numSteps of the decomposed solve on an N x N grid for each number
+    of processes in processCounts, and of the single process solve, and
+    prints steps per second, speedup over one worker and parallel efficiency.
+
+    '''
+    hostx, hosty = 10 + 80*np.random.RandomState(seed).rand(2,1000)
+    serial = environment.environment(hostx,hosty,numGridPoints=N,seed=seed)
+    dt = serial.simsParams['dt']
+    start = time.time()
+    for k in range(numSteps):
+        serial.updateEnvironment(k*dt)
+    print('{0}x{0} grid, single process: {1:.2f} steps/s'.format(N,numSteps/(time.time()-start)))
+    base = None
+    for numProcesses in processCounts:
+        environ = decomposedEnvironment(hostx,hosty,numProcesses,numGridPoints=N,seed=seed)
+        try:
+            environ.updateEnvironment(0.0)
+            start = time.time()
+            for k in range(1,numSteps+1):
+                environ.updateEnvironment(k*dt)
+            rate = numSteps/(time.time()-start)
+        finally:
+            environ.close()
+        base = rate if base is None else base
+        print('{} processes: {:.2f} steps/s, speedup {:.2f}, efficiency {:.0f}%'.format(numProcesses,rate,rate/base,100*rate/base/(numProcesses/float(processCounts[0]))))
+
+
+if __name__ == '__main__':
+    strongScaling()
@@ -1,5 +1,11 @@
 import numpy as np
 import lib_numericalMethods as nMeth
+import randomFields
+import spatialIndex
+import hostSources
+import hashlib
+import os
+import shutil
 
 def constantVel(x,y,xmag=0.0,ymag=0.2):
     '''
@@ -14,6 +20,21 @@ def constantSourceStrength(dimParams,numHosts):
     '''
     return np.array([(0.1/60)*(dimParams['mosquitoDecisionTime (s)']/dimParams['CO2Sat (units CO2/unit air or 10^6 ppm)'])]*numHosts)
 
+def breathingSourceStrength(breathsPerMinute=25.0,seed=None):
+    '''
+    Returns a hostSourceHandle for hosts that exhale in pulses, breathsPerMinute
+    times a minute, each with its own (random) phase. The emission of a host 
+    at time t is constantSourceStrength*(1 - cos(2 pi (t/period + phase))), 
+    which has the same mean as constantSourceStrength.
+
+    '''
+    def handle(dimParams,numHosts):
+        mean = constantSourceStrength(dimParams,numHosts)
+        period = 60.0/breathsPerMinute/dimParams['mosquitoDecisionTime (s)']
+        phase = np.random.RandomState(seed).rand(numHosts)
+        return lambda t: mean*(1.0 - np.cos(2*np.pi*(t/period + phase)))
+    return handle
+
 
 class environment(object):
     '''
@@ -31,13 +52,17 @@ class environment(object):
         # host positions and params 
         self.hostPositionx = hostPositionx #numpy array of x positions
         self.hostPositiony = hostPositiony #numpy array of y positions
-        self.hostSourceStrength = hostSourceHandle(numericalSims.dimensionalParams,len(hostPositionx)) 
-        # velocity parameters
-        self.velfunc = velocityFunctionHandle
-        self.randSeeds = map(int,203863455938475394857*np.random.rand(100000))
-        self.randVelMag = 0.375*0.2 #needs to be smaller than bulk flow
         # dimensional parameters to interpret results (code is nondimensional)
         self.dimensionalParams = {'mosquitoFlightSpeed (m/s)':1.0,'mosquitoDecisionTime (s)': 0.1,'CO2Sat (units CO2/unit air or 10^6 ppm)':4.e-3}
+        # hostSourceHandle returns the emission of every host, or a function
+        # of time returning it for hosts whose emission changes
+        hostStrength = hostSourceHandle(self.dimensionalParams,len(hostPositionx))
+        # velocity parameters; velocityFunctionHandle may also be a time 
+        # dependent wind provider such as windFields.griddedWind
+        self.velfunc = velocityFunctionHandle
+        self.windProvider = velocityFunctionHandle if getattr(velocityFunctionHandle,'timeDependent',False) else None
+        # randVelMag may be given as a keyword argument, e.g. 0 for no random wind
+        self.randVelMag = kwargs.pop('randVelMag',0.375*0.2) #needs to be smaller than bulk flow
         # numerical parameters for the simulation, may be overwritten with kwargs
         # dt must be 1.0/N where N is an integer, so that the mosquito decisions 
         # occurring every 1.0 happen at a time step boundary.
@@ -46,8 +71,28 @@ class environment(object):
         # single mosquito flight and so that (delta x)**2 accuracy is acceptable.
         # Note that choice for random velocity will be affected as well. Need correlation
         # in random velocity. 
-        self.simsParams = {'domainLength':100.0,'numGridPoints':128,'initialTime':0.0,'finalTime':5000.0,'dt':1.0/10,'randVelSwitch':20.0}
+        # If adaptiveTimeStep is True, each call to updateEnvironment advances 
+        # the CO2 by dt using as few forward Euler sub-steps as the CFL number 
+        # allows, so dt may be set to the mosquito decision interval (1.0).
+        # randVelCorrelationLength (in domain units) gives the random velocity
+        # spatial correlation with spectrum randVelSpectrum (see 
+        # randomFields.spectralAmplitude); None gives white noise in every cell.
+        # hostBucketSize is the bucket side of the spatial index used to find 
+        # mosquitoes at hosts; about the capture radius is best.
+        # seed fixes the sequence of random velocity fields; None gives a 
+        # different sequence every run.
+        # If steadyStateTol is not None, updateEnvironment stops solving for 
+        # the CO2 once the change per unit time, relative to the largest CO2,
+        # has stayed below steadyStateTol for steadyStateSteps steps in a row,
+        # and starts again when the random velocity fields change.
+        # integrator is 'forwardEuler', 'explicitRK4', the low-storage 
+        # 'sspRK2', 'sspRK3' or 'lowStorageRK4', which update the CO2 in place,
+        # or the implicit 'backwardEuler' or 'crankNicolson', which are stable
+        # for any dt and factorize their sparse system once per random velocity
+        # field. adaptiveTimeStep only applies to forwardEuler.
+        self.simsParams = {'domainLength':100.0,'numGridPoints':128,'initialTime':0.0,'finalTime':5000.0,'dt':1.0/10,'randVelSwitch':20.0,'adaptiveTimeStep':False,'CFL':0.9,'randVelCorrelationLength':None,'randVelSpectrum':'gaussian','hostBucketSize':5.0,'seed':None,'steadyStateTol':None,'steadyStateSteps':10,'integrator':'forwardEuler'}
         self.simsParams.update(kwargs)
+        self.hostIndex = spatialIndex.hostBuckets(self.hostPositionx,self.hostPositiony,self.simsParams['hostBucketSize'])
         h = self.simsParams['domainLength']/self.simsParams['numGridPoints']
         derivedQuantities = {'h':h}
         self.simsParams.update(derivedQuantities)
@@ -56,81 +101,358 @@ class environment(object):
         self.CO2 = np.zeros(self.xg.shape)
         self.randVel1 = np.zeros(self.xg.shape) 
         self.randVel2 = np.zeros(self.xg.shape)
-        # The following velocity arrays will have to be changed for 
-        # time dependent velocity
-        self.constantU, self.constantV = self.velfunc(self.xg,self.yg) 
-        self.leftedge = self.velfunc(self.xg[0,:]-h,self.yg[0,:])
-        self.rightedge = self.velfunc(self.xg[-1,:]+h,self.yg[-1,:])
-        self.bottomedge = self.velfunc(self.xg[:,0],self.yg[:,0]-h)
-        self.rightedge = self.velfunc(self.xg[:,-1],self.yg[:,-1]+h)
-        # The following array will have to change for space or time dependent 
-        # host breathing
-        self.constantSource = nMeth.extrapToGrid(self.hostPositionx,self.hostPositiony,self.hostSourceStrength,h,self.xg.shape) 
+        self.randFields = randomFields.randomVelocityFields(self.simsParams['seed'],self.xg.shape,self.randVelMag,h,self.simsParams['randVelCorrelationLength'],self.simsParams['randVelSpectrum'])
+        if self.windProvider is None:
+            self.constantU, self.constantV = self.velfunc(self.xg,self.yg) 
+            # Ghost cell velocities: x component to the left and right of the grid,
+            # y component below and above it.
+            self.leftedge = self.velfunc(self.xg[0,:]-h,self.yg[0,:])[0]
+            self.rightedge = self.velfunc(self.xg[-1,:]+h,self.yg[-1,:])[0]
+            self.bottomedge = self.velfunc(self.xg[:,0],self.yg[:,0]-h)[1]
+            self.topedge = self.velfunc(self.xg[:,-1],self.yg[:,-1]+h)[1]
+        else:
+            # the provider updates these arrays in place as time moves on 
+            # (see _setWind), so they are not constant here
+            if self.windProvider.shape != self.xg.shape or not np.isclose(self.windProvider.h,h):
+                raise ValueError('The wind provider grid does not match the environment grid.')
+            self.windProvider.setTime(self.simsParams['initialTime'])
+            self.constantU, self.constantV = self.windProvider.U, self.windProvider.V
+            self.leftedge, self.rightedge = self.windProvider.leftedge, self.windProvider.rightedge
+            self.bottomedge, self.topedge = self.windProvider.bottomedge, self.windProvider.topedge
+        # host CO2 source, kept only in the cells next to the hosts
+        self.hostSource = hostSources.hostSource(self.hostPositionx,self.hostPositiony,hostStrength,h,self.xg.shape,self.simsParams['initialTime'])
+        self.hostSourceStrength = self.hostSource.strength
+        # persistent work arrays for the in-place flux calculation
+        self.fluxBuffers = nMeth.makeUpwindBuffers(self.simsParams['numGridPoints'])
+        self.U = np.empty(self.xg.shape)
+        self.V = np.empty(self.xg.shape)
+        self.flux = np.empty(self.xg.shape)
+        self.rhs = np.empty(self.xg.shape)
+        # interleaved grid quantities and work arrays for querySignal; 
+        # packedKeys says what the wind and CO2 channels of gridFields hold,
+        # and plumeVersion counts the changes to the CO2
+        self.gridFields = np.empty(self.xg.shape+(3,))
+        self.queryBuffers = {}
+        self.packedKeys = [None,None]
+        self.packedArrays = None
+        self.plumeVersion = 0
+        # index of the random velocity field in use and sub-step count for the
+        # adaptive time stepping
+        self.randVelIndex = None
+        self.numSubSteps = 0
+        # steady state monitor: whether the CO2 is frozen, how many steps in a
+        # row it has barely changed and how many steps were skipped
+        self.steadyState = False
+        self.numQuietSteps = 0
+        self.numSkippedSteps = 0
+        # factorized implicit system and the random velocity field it is for
+        self.implicitSystem = None
+        self.implicitSystemIndex = None
+        # registers of the low-storage Runge-Kutta integrators
+        self.rkRegisters = None
+
+    # set to a profiling.phaseProfiler to time the phases of each step
+    profiler = None
 
     def _setHeavisideRandVel(self,ind):
         '''
         For use only with Euler method.
 
         '''
-        np.random.seed(self.randSeeds[ind])
-        self.randVel1 = self.randVelMag*np.random.randn(self.simsParams['numGridPoints'],self.simsParams['numGridPoints'])
-        self.randVel2 = self.randVelMag*np.random.randn(self.simsParams['numGridPoints'],self.simsParams['numGridPoints'])
+        self.randVel1, self.randVel2 = self.randFields.fields(ind)
         
-    def _setContinuousRandomVel(self,ind):
-        np.random.seed(self.randSeeds[ind])
-        self.randVel1n = self.randVelMag*np.random.randn(self.simsParams['numGridPoints'],self.simsParams['numGridPoints'])
-        self.randVel2n = self.randVelMag*np.random.randn(self.simsParams['numGridPoints'],self.simsParams['numGridPoints'])
-        np.random.seed(self.randSeeds[ind+1])
-        self.randVel1np1 = self.randVelMag*np.random.randn(self.simsParams['numGridPoints'],self.simsParams['numGridPoints'])
-        self.randVel2np1 = self.randVelMag*np.random.randn(self.simsParams['numGridPoints'],self.simsParams['numGridPoints'])
+    def _randVelSwitchIndex(self,t):
+        '''
+        Index of the random velocity field in force at time t: the fields
+        switch every randVelSwitch time units (t is nudged by a fraction of
+        dt so that round-off in the step times cannot delay a switch).
+
+        '''
+        return int(np.floor((t + 1.e-9*self.simsParams['dt'])/self.simsParams['randVelSwitch']))
+
+    def _updateRandVel(self,t):
+        '''
+        Switches to the random velocity field in force at time t if that is
+        a different field from the one in place, however t relates to dt.
+
+        '''
+        ind = self._randVelSwitchIndex(t)
+        if ind != self.randVelIndex:
+            self._switchRandVel(ind)
+
+    def _switchRandVel(self,ind):
+        prof = self.profiler
+        if prof is not None:
+            token = prof.start()
+        self._setHeavisideRandVel(ind)
+        self.randVelIndex = ind
+        if prof is not None:
+            prof.stop('randomFields',token,self.randVel1.size)
+
+    def _setWind(self,t):
+        '''
+        Moves a time dependent wind to time t. Returns whether the wind
+        changed.
+
+        '''
+        if self.windProvider is None:
+            return False
+        return self.windProvider.setTime(t)
+
+    def _windKey(self):
+        return None if self.windProvider is None else self.windProvider.frameKey
+
+    def _setContinuousRandVel(self,ind):
+        self.randVel1n, self.randVel2n = self.randFields.fields(ind)
+        self.randVel1np1, self.randVel2np1 = self.randFields.fields(ind+1)
 
     def _continuousRandVel(self,ratio):
         self.randVel1 = self.randVel1n + ratio * (self.randVel1np1 - self.randVel1n)
         self.randVel2 = self.randVel2n + ratio * (self.randVel2np1 - self.randVel2n)
 
-    def querySignal(self,x,y):
+    # the CO2 channel of gridFields is only refilled for queries of at least
+    # this many points per grid cell; smaller ones gather the CO2 separately
+    # (refilling was faster from about 0.1 to 0.2 points per cell on 256^2
+    # to 1024^2 grids)
+    CO2RepackFraction = 0.15
+
+    def _packGridFields(self,numPoints):
+        '''
+        Refills the channels of gridFields whose fields changed since the 
+        last query: the wind once per random velocity switch (or frame of a
+        time dependent wind), the CO2 once per step, and only for queries
+        of numPoints large enough that refilling costs less than gathering
+        the CO2 separately. Returns whether the CO2 channel is current.
+        Whatever changes the CO2 in place must increment plumeVersion 
+        (updateEnvironment does).
+
+        '''
+        # the packed arrays are kept alive, so their ids are not reused
+        windKey = (self.randVelIndex,self._windKey(),id(self.randVel1),id(self.randVel2))
+        if windKey != self.packedKeys[0]:
+            if self.windProvider is None:
+                self.gridFields[...,0] = self.randVel1
+                self.gridFields[...,1] = self.randVel2
+            else:
+                # a gridded wind is gathered together with the random wind
+                np.add(self.constantU,self.randVel1,out=self.gridFields[...,0])
+                np.add(self.constantV,self.randVel2,out=self.gridFields[...,1])
+            self.packedKeys[0] = windKey
+        CO2Key = (self.plumeVersion,id(self.CO2))
+        if CO2Key != self.packedKeys[1] and numPoints >= self.CO2RepackFraction*self.CO2.size:
+            self.gridFields[...,2] = self.CO2
+            self.packedKeys[1] = CO2Key
+        self.packedArrays = (self.randVel1,self.randVel2,self.CO2)
+        return CO2Key == self.packedKeys[1]
+
+    def querySignal(self,x,y,realization=None):
         '''
         This function returns three arrays: u,v,c for every (x,y) pair. 
         x and y are arrays of the same length denoting mosquito position in 2D.
+        realization is only used by ensembleEnvironment: an integer (or array 
+        of integers the length of x) picking the realization each mosquito 
+        flies in.
         
         '''       
-        # Get bulk flow wind and background CO2
-        u,v = self.velfunc(x,y)
-        c = np.zeros(x.shape)
+        prof = self.profiler
+        if prof is not None:
+            token = prof.start()
         # Get random velocities and CO2 inside domain
         # Assume domain is square with lower left corner at (0,0) and is cell-centered
         L = self.simsParams['domainLength']
         h = self.simsParams['h']
-        insideDom = [k for k in range(len(x)) if x[k] < (L-h/2.0) and x[k] > h/2.0 and y[k] < (L-h/2.0) and y[k] > h/2.0]
-        ur,vr,ci = nMeth.interpFromGrid(x[insideDom],y[insideDom],self.simsParams['h'],self.randVel1,self.randVel2,self.CO2)  
+        inside = (x < L-h/2.0) & (x > h/2.0) & (y < L-h/2.0) & (y > h/2.0)
+        insideDom = np.nonzero(inside)[0]
+        r = None if realization is None else np.broadcast_to(realization,x.shape)[insideDom]
+        c = np.zeros(x.shape)
+        if self.windProvider is None:
+            # Get bulk flow wind and background CO2
+            u,v = self.velfunc(x,y)
+        else:
+            # a gridded wind is gathered together with the random wind, so 
+            # only the positions outside the grid need the provider
+            u,v = np.zeros(x.shape), np.zeros(x.shape)
+            outsideDom = np.nonzero(~inside)[0]
+            u[outsideDom], v[outsideDom] = self.velfunc(x[outsideDom],y[outsideDom])
+        # interleave the grid quantities so each stencil node is one gather
+        fresh = None if self._packGridFields(len(insideDom)) else {2:self.CO2}
+        vals = nMeth.interpFromInterleavedGrid(x[insideDom],y[insideDom],h,self.gridFields,r,self.queryBuffers,fresh)
         # Add interpolated values to bulk values
-        u[insideDom] = u[insideDom] + ur
-        v[insideDom] = v[insideDom] + vr       
-        c[insideDom] = c[insideDom] + ci     
+        u[insideDom] += vals[:,0]
+        v[insideDom] += vals[:,1]
+        c[insideDom] += vals[:,2]
+        if prof is not None:
+            prof.stop('querySignal',token,len(x))
         return u,v,c
 
     def updateEnvironment(self,currentTime):
-        # Old method using forward Euler and random velocity fields that switch
-        # every N time steps.
-        self.CO2 = nMeth.forwardEuler(currentTime,self.CO2,self.simsParams['dt'],self._updateCO2HeavisideRandVel)
-        # New method using explicit 4th order Runge-Kutta with continuous in time 
-        # (although not everywhere differentiable in time) random velocity fields.
-        # self.CO2 = nMeth.explicitRK4(currentTime,self.CO2,self.simsParams['dt'],self._updateCO2ContinuousRandVel)
+        prof = self.profiler
+        if prof is not None:
+            token = prof.start()
+        monitor = self.simsParams['steadyStateTol'] is not None
+        skip = monitor and self._stillSteady(currentTime)
+        if monitor and not skip:
+            # the low-storage integrators update CO2 in place
+            previousCO2 = self.CO2.copy()
+        if skip:
+            self.numSkippedSteps += 1
+        elif self.simsParams['integrator'] != 'forwardEuler':
+            self._updateEnvironmentIntegrator(currentTime)
+        elif self.simsParams['adaptiveTimeStep']:
+            self._updateEnvironmentAdaptive(currentTime)
+        else:
+            # Old method using forward Euler and random velocity fields that switch
+            # every N time steps.
+            nMeth.forwardEulerInPlace(currentTime,self.CO2,self.simsParams['dt'],self._updateCO2HeavisideRandVel,self.rhs)
+            # New method using explicit 4th order Runge-Kutta with continuous in time 
+            # (although not everywhere differentiable in time) random velocity fields.
+            # self.CO2 = nMeth.explicitRK4(currentTime,self.CO2,self.simsParams['dt'],self._updateCO2ContinuousRandVel)
+        if not skip:
+            self.plumeVersion += 1
+        if monitor and not self.steadyState:
+            self._monitorSteadyState(previousCO2)
+        if prof is not None:
+            prof.stop('plumeStep',token,self.CO2.size)
 
-    def _updateCO2HeavisideRandVel(self,t,CO2):
+    def _monitorSteadyState(self,previousCO2):
+        '''
+        Freezes the CO2 once its change over a step has been small for 
+        steadyStateSteps steps in a row.
+
+        '''
+        change = np.max(np.abs(np.subtract(self.CO2,previousCO2,out=self.flux)))
+        scale = np.max(np.abs(self.CO2))
+        if change <= self.simsParams['steadyStateTol']*self.simsParams['dt']*scale:
+            self.numQuietSteps += 1
+        else:
+            self.numQuietSteps = 0
+        if self.numQuietSteps >= self.simsParams['steadyStateSteps']:
+            self.steadyState = True
+
+    def _stillSteady(self,currentTime):
+        '''
+        Returns whether the CO2 is frozen and nothing that forces it changes 
+        during the step from currentTime. A random velocity switch that brings
+        different fields, or a change in a time dependent wind or host 
+        emission, ends the steady state.
+
+        '''
+        if not self.steadyState:
+            return False
+        windChanged = self._setWind(currentTime)
+        if self.hostSource.setTime(currentTime) or windChanged:
+            self.steadyState = False
+            self.numQuietSteps = 0
+            return False
+        # same switching rule as the solver that would have run
+        ind = self._randVelSwitchIndex(currentTime)
+        if ind != self.randVelIndex:
+            # ensembles refill the same arrays, so compare against copies
+            randVel1, randVel2 = self.randVel1.copy(), self.randVel2.copy()
+            self._switchRandVel(ind)
+            if not (np.array_equal(randVel1,self.randVel1) and np.array_equal(randVel2,self.randVel2)):
+                self.steadyState = False
+                self.numQuietSteps = 0
+                return False
+        return True
+
+    def _updateCO2HeavisideRandVel(self,t,CO2,out=None):
         '''
         For use only with Euler method. To use with RK4, will need 
         to write an averaging function for the switch between random
         velocity fields.
 
         '''
-        ind,rem = divmod(t,self.simsParams['randVelSwitch'])
-        if rem < self.simsParams['dt']/10.:
-            self._setHeavisideRandVel(ind)
-        U = self.constantU + self.randVel1
-        V = self.constantV + self.randVel2   
-        flux = nMeth.upwindScheme(U,V,environ) 
-        return -flux + self.constantSource   
+        self._updateRandVel(t)
+        return self._CO2RHS(t,CO2,out)
+
+    def _CO2RHS(self,t,CO2,out=None):
+        '''
+        Right hand side of the CO2 equation with the random velocity fields
+        currently in place, written into out (by default self.rhs).
+
+        '''
+        self._setWind(t)
+        self.hostSource.setTime(t)
+        np.add(self.constantU,self.randVel1,out=self.U)
+        np.add(self.constantV,self.randVel2,out=self.V)
+        nMeth.upwindSchemeInPlace(self.U,self.V,self,self.flux,CO2)
+        rhs = np.negative(self.flux,out=self.rhs if out is None else out)
+        self.hostSource.inject(rhs)
+        return rhs
+
+    def _updateEnvironmentIntegrator(self,currentTime):
+        '''
+        Advances the CO2 by dt with simsParams['integrator']. The random 
+        velocity fields switch at the start of a step, as for forward Euler, 
+        and stay fixed through the step, so no stage sees the next field.
+
+        '''
+        integrator = self.simsParams['integrator']
+        dt = self.simsParams['dt']
+        self._updateRandVel(currentTime)
+        if integrator == 'explicitRK4':
+            self.CO2 = nMeth.explicitRK4(currentTime,self.CO2,dt,self._CO2RHS)
+        elif integrator in ['sspRK2','sspRK3','lowStorageRK4']:
+            if self.rkRegisters is None:
+                self.rkRegisters = nMeth.makeRKRegisters(self.CO2.shape)
+            getattr(nMeth,integrator)(currentTime,self.CO2,dt,self._CO2RHS,self.rkRegisters)
+        elif integrator in ['backwardEuler','crankNicolson']:
+            self._setWind(currentTime)
+            if self.implicitSystem is None or self.implicitSystemIndex != (self.randVelIndex,self._windKey()):
+                self._factorizeImplicitSystem()
+            # host emission where the theta method weighs the step
+            theta = 1.0 if integrator == 'backwardEuler' else 0.5
+            self.hostSource.setTime(currentTime + theta*dt)
+            self.CO2 = nMeth.implicitRK(self.CO2,self.hostSource.dense(),self.implicitSystem)
+        else:
+            raise ValueError('Unknown integrator {}'.format(integrator))
+
+    def _factorizeImplicitSystem(self):
+        if self.CO2.ndim != 2:
+            raise ValueError('Implicit integrators need a single realization.')
+        np.add(self.constantU,self.randVel1,out=self.U)
+        np.add(self.constantV,self.randVel2,out=self.V)
+        A = nMeth.upwindMatrix(self.U,self.V,self)
+        theta = 1.0 if self.simsParams['integrator'] == 'backwardEuler' else 0.5
+        self.implicitSystem = nMeth.makeImplicitSystem(A,self.simsParams['dt'],theta)
+        self.implicitSystemIndex = (self.randVelIndex,self._windKey())
+
+    def _maxStableTimeStep(self):
+        '''
+        Largest forward Euler time step allowed by the CFL condition 
+        dt*(max|u| + max|v|)/h <= CFL for the current velocity field.
+
+        '''
+        np.add(self.constantU,self.randVel1,out=self.U)
+        np.add(self.constantV,self.randVel2,out=self.V)
+        maxu = max(np.max(np.abs(self.U)),np.max(np.abs(self.leftedge)),np.max(np.abs(self.rightedge)))
+        maxv = max(np.max(np.abs(self.V)),np.max(np.abs(self.bottomedge)),np.max(np.abs(self.topedge)))
+        if maxu + maxv == 0:
+            return np.inf
+        return self.simsParams['CFL']*self.simsParams['h']/(maxu + maxv)
+
+    def _updateEnvironmentAdaptive(self,currentTime):
+        '''
+        Advances the CO2 from currentTime to currentTime + dt with forward 
+        Euler sub-steps that are as large as the CFL condition allows. Sub-steps
+        are cut short to land exactly on currentTime + dt and on every random
+        velocity switch, so the Heaviside random velocity is never averaged 
+        across a switch.
+
+        '''
+        switch = self.simsParams['randVelSwitch']
+        endTime = currentTime + self.simsParams['dt']
+        tol = 1.e-9*self.simsParams['dt']
+        t = currentTime
+        while endTime - t > tol:
+            self._updateRandVel(t)
+            ind = self.randVelIndex
+            self._setWind(t)
+            step = min(self._maxStableTimeStep(),endTime - t,(ind+1)*switch - t)
+            nMeth.forwardEulerInPlace(t,self.CO2,step,self._CO2RHS,self.rhs)
+            self.numSubSteps += 1
+            t += step
 
     def _updateCO2ContinuousRandVel(self,t,CO2,rkstep):
         '''
@@ -138,14 +460,269 @@ class environment(object):
 
         '''
         ind,rem = divmod(t,self.simsParams['randVelSwitch'])
+        ind = int(ind)
         if rkstep == 4 and rem < self.simsParams['dt']/10.:
             self._setContinuousRandVel(ind)
         if rkstep > 1:
             self._continuousRandVel(rem/self.simsParams['randVelSwitch'])
-        U = self.constantU + self.randVel1
-        V = self.constantV + self.randVel2
-        flux = nMeth.upwindScheme(U,V,environ) 
-        return -flux + self.constantSource   
+        self._setWind(t)
+        self.hostSource.setTime(t)
+        np.add(self.constantU,self.randVel1,out=self.U)
+        np.add(self.constantV,self.randVel2,out=self.V)
+        nMeth.upwindSchemeInPlace(self.U,self.V,self,self.flux,CO2)
+        np.negative(self.flux,out=self.rhs)
+        self.hostSource.inject(self.rhs)
+        return self.rhs
+
+    def checkpointState(self):
+        '''
+        Returns a dictionary of arrays holding everything that changes as the
+        environment is advanced, for checkpoints (see checkpoint.py).
+
+        '''
+        providers = self.randFields if isinstance(self.randFields,list) else [self.randFields]
+        state = {'CO2':self.CO2,'randVel1':self.randVel1,'randVel2':self.randVel2,
+                 'randVelIndex':np.array(-1 if self.randVelIndex is None else self.randVelIndex),
+                 'numSubSteps':np.array(self.numSubSteps),
+                 'steadyState':np.array([self.steadyState,self.numQuietSteps,self.numSkippedSteps]),
+                 'randFieldSeeds':np.array([p.seed for p in providers],dtype=np.uint64)}
+        for name in ['randVel1n','randVel2n','randVel1np1','randVel2np1']:
+            if hasattr(self,name):
+                state[name] = getattr(self,name)
+        return state
+
+    def restoreState(self,state):
+        '''
+        Puts the environment back in a state returned by checkpointState.
+
+        '''
+        for name in ['CO2','randVel1','randVel2','randVel1n','randVel2n','randVel1np1','randVel2np1']:
+            if name in state:
+                setattr(self,name,np.array(state[name]))
+        ind = int(state['randVelIndex'])
+        self.randVelIndex = None if ind < 0 else ind
+        self.numSubSteps = int(state['numSubSteps'])
+        self.steadyState, self.numQuietSteps, self.numSkippedSteps = [int(a) for a in state['steadyState']]
+        self.steadyState = bool(self.steadyState)
+        self.implicitSystem = None
+        self.packedKeys = [None,None]
+        providers = self.randFields if isinstance(self.randFields,list) else [self.randFields]
+        for p,seed in zip(providers,state['randFieldSeeds']):
+            p.reset(seed)
+
+
+def plumeArchiveKey(environ):
+    '''
+    Returns a hash of everything that determines the CO2 plume and the random
+    wind: numerical parameters (including the seed), host layout, host source
+    strength, bulk flow and random velocity magnitude.
+
+    '''
+    key = hashlib.sha1()
+    key.update(repr(sorted(environ.simsParams.items())).encode('utf-8'))
+    key.update(repr(environ.randVelMag).encode('utf-8'))
+    for arr in [environ.hostPositionx,environ.hostPositiony,environ.hostSourceStrength,environ.constantU,environ.constantV]:
+        key.update(np.ascontiguousarray(arr,dtype=float).tobytes())
+    if environ.windProvider is not None:
+        key.update(environ.windProvider.fingerprint())
+    key.update(environ.hostSource.fingerprint(environ.simsParams['initialTime'],environ.simsParams['finalTime']))
+    return key.hexdigest()
+
+def recordPlume(environ,archiveRoot,decisionInterval=1.0):
+    '''
+    Solves for the CO2 plume over the whole simulation and writes CO2, randVel1
+    and randVel2 at every mosquito decision time to memory-mapped .npy files in
+    a directory under archiveRoot named by plumeArchiveKey. The fields stored 
+    for decision time t are those seen by the mosquitoes at t in 
+    simulateMosquitoes, i.e. after updateEnvironment(t). If the archive already
+    exists nothing is solved. Returns the archive directory.
+
+    '''
+    if environ.simsParams['seed'] is None:
+        raise ValueError('Set the environment seed to record a reproducible plume.')
+    path = os.path.join(archiveRoot,plumeArchiveKey(environ))
+    if os.path.isdir(path):
+        return path
+    writePlume(environ,path,decisionInterval)
+    return path
+
+def writePlume(environ,path,decisionInterval=1.0):
+    '''
+    Solves for the CO2 plume as recordPlume does and writes the frames to the
+    directory path (which must not exist), whatever the parameters. Read 
+    them back with loadPlume.
+
+    '''
+    # write to a temporary directory and rename when done so that a killed 
+    # run never leaves a partial archive behind
+    tmppath = path + '.partial'
+    if os.path.isdir(tmppath):
+        shutil.rmtree(tmppath)
+    os.makedirs(tmppath)
+    dt = environ.simsParams['dt']
+    times = np.arange(environ.simsParams['initialTime'],environ.simsParams['finalTime'],decisionInterval)
+    shape = (len(times),) + environ.xg.shape
+    fields = {}
+    for name in ['CO2','randVel1','randVel2']:
+        fields[name] = np.lib.format.open_memmap(os.path.join(tmppath,name+'.npy'),mode='w+',dtype=float,shape=shape)
+    k = 0
+    for t in np.arange(environ.simsParams['initialTime'],environ.simsParams['finalTime'],dt):
+        environ.updateEnvironment(t)
+        if t%decisionInterval < dt/2.0 and k < len(times):
+            for name in fields:
+                fields[name][k] = getattr(environ,name)
+            k += 1
+    for name in fields:
+        fields[name].flush()
+    np.save(os.path.join(tmppath,'times.npy'),times)
+    del fields
+    os.rename(tmppath,path)
+
+def loadPlume(path):
+    '''
+    Returns the decision times and a dictionary of the memory-mapped (T,N,N)
+    CO2, randVel1 and randVel2 frames of the plume archive in the directory 
+    path.
+
+    '''
+    frames = {}
+    for name in ['CO2','randVel1','randVel2']:
+        frames[name] = np.load(os.path.join(path,name+'.npy'),mmap_mode='r')
+    return np.load(os.path.join(path,'times.npy')), frames
+
+
+def spinUpKey(environ,spinUpTime):
+    '''
+    Returns a hash of everything that determines the CO2 plume and the random
+    wind up to spinUpTime (as plumeArchiveKey, but not the final time).
+
+    '''
+    params = dict(environ.simsParams)
+    del params['finalTime']
+    key = hashlib.sha1()
+    key.update(repr((sorted(params.items()),float(spinUpTime))).encode('utf-8'))
+    key.update(repr(environ.randVelMag).encode('utf-8'))
+    for arr in [environ.hostPositionx,environ.hostPositiony,environ.hostSourceStrength,environ.constantU,environ.constantV]:
+        key.update(np.ascontiguousarray(arr,dtype=float).tobytes())
+    if environ.windProvider is not None:
+        key.update(environ.windProvider.fingerprint())
+    key.update(environ.hostSource.fingerprint(environ.simsParams['initialTime'],spinUpTime))
+    return key.hexdigest()
+
+def warmStart(environ,cacheRoot,spinUpTime):
+    '''
+    Brings a new environ to spinUpTime (e.g. the mosquito release time) by
+    loading a snapshot from cacheRoot, named by spinUpKey, or, if there is
+    none, by advancing it over every time step before spinUpTime and saving
+    the snapshot for later runs. Either way environ ends up exactly as if it
+    had been advanced. Returns the number of time steps taken, i.e. the 
+    index into np.arange(initialTime,finalTime,dt) of the next step.
+
+    '''
+    if environ.simsParams['seed'] is None:
+        raise ValueError('Set the environment seed to cache a reproducible spin-up.')
+    dt = environ.simsParams['dt']
+    times = np.arange(environ.simsParams['initialTime'],environ.simsParams['finalTime'],dt)
+    numSteps = int(np.searchsorted(times,spinUpTime - dt/2.0))
+    path = os.path.join(cacheRoot,spinUpKey(environ,spinUpTime)+'.npz')
+    if os.path.exists(path):
+        with np.load(path) as f:
+            environ.restoreState(dict((name,f[name]) for name in f.files))
+        return numSteps
+    for t in times[:numSteps]:
+        environ.updateEnvironment(t)
+    if not os.path.isdir(cacheRoot):
+        os.makedirs(cacheRoot)
+    # write next to the snapshot and rename, so a killed run leaves no partial file
+    tmp = path + '.tmp'
+    with open(tmp,'wb') as f:
+        np.savez_compressed(f,**environ.checkpointState())
+    os.replace(tmp,path)
+    return numSteps
+
+class replayEnvironment(environment):
+    '''
+    An environment that serves querySignal from a plume archive written by 
+    recordPlume instead of solving for the CO2. It takes the same arguments
+    as environment plus the archive root directory, and the archive matching
+    those arguments must already exist. The archived fields are memory-mapped,
+    so many mosquito runs can share one archive at almost no cost.
+
+    '''
+
+    def __init__(self,archiveRoot,hostPositionx,hostPositiony,**kwargs):
+        environment.__init__(self,hostPositionx,hostPositiony,**kwargs)
+        self.archivePath = os.path.join(archiveRoot,plumeArchiveKey(self))
+        if not os.path.isdir(self.archivePath):
+            raise IOError('No plume archive for these parameters at %s. Run recordPlume first.' %self.archivePath)
+        self.playFrames(*loadPlume(self.archivePath))
+
+    def playFrames(self,times,frames):
+        '''
+        Serve the fields in frames, a dictionary of (T,N,N) arrays keyed by 
+        'CO2', 'randVel1' and 'randVel2', at the T decision times in times.
+
+        '''
+        self.archiveTimes = times
+        self.archive = frames
+        self.archiveIndex = None
+
+    def updateEnvironment(self,currentTime):
+        # use the most recent archived decision time
+        k = np.searchsorted(self.archiveTimes,currentTime+self.simsParams['dt']/2.0,side='right') - 1
+        # the bulk wind is not archived, so keep a time dependent wind in step
+        self._setWind(currentTime)
+        if k != self.archiveIndex and k >= 0:
+            self.archiveIndex = k
+            self.CO2 = self.archive['CO2'][k]
+            self.randVel1 = self.archive['randVel1'][k]
+            self.randVel2 = self.archive['randVel2'][k]
+            self.plumeVersion += 1
+
+
+class ensembleEnvironment(environment):
+    '''
+    numRealizations independent realizations of the random wind (and so of 
+    the CO2 plume) over the same hosts and bulk flow. CO2, randVel1 and 
+    randVel2 are stacked arrays of shape (R,N,N), and all realizations are 
+    advanced by one vectorized flux calculation per time step. Realization r
+    sees the same random velocity fields as 
+    environment(...,seed=self.realizationSeeds[r]). Pass the realization of 
+    each mosquito to querySignal.
+
+    '''
+
+    def __init__(self,numRealizations,hostPositionx,hostPositiony,**kwargs):
+        environment.__init__(self,hostPositionx,hostPositiony,**kwargs)
+        self.numRealizations = numRealizations
+        N = self.simsParams['numGridPoints']
+        shape = (numRealizations,N,N)
+        self.realizationSeeds = np.random.SeedSequence(self.randFields.seed).generate_state(numRealizations,np.uint64)
+        self.randFields = [randomFields.randomVelocityFields(seed,(N,N),self.randVelMag,self.simsParams['h'],self.simsParams['randVelCorrelationLength'],self.simsParams['randVelSpectrum']) for seed in self.realizationSeeds]
+        self.CO2 = np.zeros(shape)
+        self.randVel1 = np.zeros(shape)
+        self.randVel2 = np.zeros(shape)
+        self.fluxBuffers = nMeth.makeUpwindBuffers(N,numRealizations)
+        self.U = np.empty(shape)
+        self.V = np.empty(shape)
+        self.flux = np.empty(shape)
+        self.rhs = np.empty(shape)
+        self.gridFields = np.empty(shape+(3,))
+
+    def _drawRandVel(self,ind,randVel1,randVel2):
+        for r in range(self.numRealizations):
+            randVel1[r], randVel2[r] = self.randFields[r].fields(ind)
+
+    def _setHeavisideRandVel(self,ind):
+        self._drawRandVel(ind,self.randVel1,self.randVel2)
+
+    def _setContinuousRandVel(self,ind):
+        shape = self.CO2.shape
+        self.randVel1n, self.randVel2n = np.empty(shape), np.empty(shape)
+        self.randVel1np1, self.randVel2np1 = np.empty(shape), np.empty(shape)
+        self._drawRandVel(ind,self.randVel1n,self.randVel2n)
+        self._drawRandVel(ind+1,self.randVel1np1,self.randVel2np1)
+
 
 if __name__ == '__main__':
     pass
\ No newline at end of file
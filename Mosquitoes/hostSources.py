@@ -0,0 +1,143 @@
+import numpy as np
+import lib_numericalMethods as nMeth
+import time
+
+class hostSource(object):
+    '''
+    This class holds the CO2 source of the hosts on a grid of the given
+    shape with spacing h, stored sparsely. As in extrapToGrid, each host
+    puts its emission on the four grid nodes around it; the stencil of
+    every host is found once, and only the cells touched by some host are
+    kept: cells holds their flat indices and rates the CO2 added to each
+    per unit time. Hosts sharing a cell add up.
+
+    strength is either an array with the emission of each host or, for
+    hosts whose emission changes in time (e.g. breathing, see
+    environment.breathingSourceStrength), a function of time returning that
+    array. setTime(t) then recomputes the rates with one bincount over the
+    stencils, so the cost per step grows with the number of hosts and not
+    with the grid. When the hosts touch many of the cells, a scattered add
+    costs more than adding a full grid, so inject adds the full grid (see
+    dense) instead, whenever more than denseFraction of the cells are
+    touched. Where the full grid becomes faster depends on the grid size
+    and the machine as much as on the fraction of cells touched (from about
+    2% of the cells on a 128x128 grid to 10% on a 512x512 one); the default
+    is at the upper end, since a full grid add wrongly chosen costs most on
+    the large grids. With denseFraction='auto' both are timed when the source
+    is built instead (see _denseIsFaster), which makes the choice depend on
+    the load of the machine at that moment. The two give the same numbers.
+
+    '''
+
+    def __init__(self,x,y,strength,h,shape,initialTime=0.0,denseFraction=0.1):
+        self.shape = shape
+        i,j,nodes = nMeth._getIndicesNodes(np.asarray(x,dtype=float),np.asarray(y,dtype=float),h)
+        # flat indices of (lowerleft, upperleft, lowerright, upperright) for every host
+        flat = np.array([i*shape[1]+j,i*shape[1]+j+1,(i+1)*shape[1]+j,(i+1)*shape[1]+j+1])
+        self.cells, self.entryCell = np.unique(flat.ravel(),return_inverse=True)
+        # (row, column) of the cells, for arrays that cannot be flattened in place
+        self.cellIndices = np.unravel_index(self.cells,shape)
+        self.weights = nodes.ravel()
+        self.entryHost = np.tile(np.arange(len(i)),4)
+        self.schedule = strength if callable(strength) else None
+        self.timeDependent = self.schedule is not None
+        self.time = None
+        self.strength = None
+        self._dense = None
+        self._denseStale = True
+        if self.timeDependent:
+            self.setTime(initialTime)
+        else:
+            self._setStrength(np.asarray(strength,dtype=float))
+        if denseFraction == 'auto':
+            self.useDense = self._denseIsFaster()
+        else:
+            self.useDense = len(self.cells) > denseFraction*shape[0]*shape[1]
+
+    def _denseIsFaster(self,minFraction=0.005,maxFraction=0.25,repeats=5,batch=4):
+        '''
+        Returns whether adding the full grid to an array of shape shape is
+        faster than the scattered add, timing the best of repeats batches of
+        batch adds each way. Below minFraction of the cells touched the
+        scattered add always wins and above maxFraction the full grid does,
+        so those are not timed.
+
+        '''
+        fraction = len(self.cells)/float(self.shape[0]*self.shape[1])
+        if fraction < minFraction or fraction > maxFraction:
+            return fraction > maxFraction
+        out = np.zeros(self.shape)
+        flat = out.reshape(-1)
+        dense = self.dense()
+        timings = [np.inf,np.inf]
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for _ in range(batch):
+                flat[self.cells] += self.rates
+            timings[0] = min(timings[0],time.perf_counter() - start)
+            start = time.perf_counter()
+            for _ in range(batch):
+                out += dense
+            timings[1] = min(timings[1],time.perf_counter() - start)
+        return timings[1] < timings[0]
+
+    def _setStrength(self,strength):
+        self.strength = strength
+        self.rates = np.bincount(self.entryCell,weights=self.weights*strength[self.entryHost],minlength=len(self.cells))
+        self._denseStale = True
+
+    def setTime(self,t):
+        '''
+        Sets the emission of time dependent hosts to that at time t. Returns
+        whether the rates changed.
+
+        '''
+        if self.schedule is None or t == self.time:
+            return False
+        self.time = t
+        # a copy, in case the schedule reuses its array
+        strength = np.array(self.schedule(t),dtype=float)
+        if self.strength is not None and np.array_equal(strength,self.strength):
+            return False
+        self._setStrength(strength)
+        return True
+
+    def inject(self,out):
+        '''
+        Adds the source to the grid array out (of shape shape, or stacked
+        realizations of shape (R,)+shape) in place, touching only the host
+        cells (unless useDense). out may have any strides.
+
+        '''
+        if self.useDense:
+            out += self.dense()
+        elif out.flags.c_contiguous:
+            # a view, since out is contiguous, so the add lands in out
+            flat = out.reshape(out.shape[:-2]+(-1,))
+            flat[...,self.cells] += self.rates
+        else:
+            out[(Ellipsis,)+self.cellIndices] += self.rates
+
+    def dense(self):
+        '''
+        Returns the source as a full grid array, for the solvers that need
+        one. It is refilled (only in the host cells) when the rates change.
+
+        '''
+        if self._dense is None:
+            self._dense = np.zeros(self.shape)
+        if self._denseStale:
+            self._dense.flat[self.cells] = self.rates
+            self._denseStale = False
+        return self._dense
+
+    def fingerprint(self,startTime,endTime,numSamples=64):
+        '''
+        Returns the emission of every host at numSamples times from
+        startTime to endTime (the strengths alone for constant hosts), for
+        hashing into the plume archive and spin-up keys.
+
+        '''
+        if self.schedule is None:
+            return np.ascontiguousarray(self.strength).tobytes()
+        return np.array([self.schedule(t) for t in np.linspace(startTime,endTime,numSamples)],dtype=float).tobytes()
@@ -13,17 +13,17 @@ def interpFromGridWithMaps(xy,h,randVel1,randVel2,CO2):
     # a cell-centered grid with lower left corner of the domain located at 
     # (0,0); i.e. lowest left-most grid point in the domain is (h/2, h/2).
     # Note that int always rounds toward zero.
-    ij = [(int(ind[0]),int(ind[1])) for ind in map(lambda (a,b): (a/h - 0.5, b/h - 0.5), xy)]
+    ij = [(int(ind[0]),int(ind[1])) for ind in map(lambda ab: (ab[0]/h - 0.5, ab[1]/h - 0.5), xy)]
 
     # find the remainders to do the interpolation
-    rxy = map(lambda ((a,b),(c,d)): (a/h - 0.5 - c, b/h -0.5 - d), zip(xy, ij))
+    rxy = list(map(lambda abcd: (abcd[0][0]/h - 0.5 - abcd[1][0], abcd[0][1]/h -0.5 - abcd[1][1]), zip(xy, ij)))
     
     # Find the proportion of the value at each node that contributes to the 
     # interpolation at (x,y). nodes = (lowerleft, upperleft, lowerright, upperright)
-    nodes = map(lambda (a,b): ( (1-a)*(1-b), (1-a)*b, a*(1-b), a*b ), rxy)
+    nodes = list(map(lambda ab: ( (1-ab[0])*(1-ab[1]), (1-ab[0])*ab[1], ab[0]*(1-ab[1]), ab[0]*ab[1] ), rxy))
 
     # get the values of the CO2 and random wind at the four closest nodes
-    Vij = map(lambda matinds: map(lambda m: (randVel1[m], randVel2[m], CO2[m]),matinds),[ij,[(p,k+1) for (p,k) in ij],[(p+1,k) for (p,k) in ij], [(p+1,k+1) for (p,k) in ij]])
+    Vij = list(map(lambda matinds: list(map(lambda m: (randVel1[m], randVel2[m], CO2[m]),matinds)),[ij,[(p,k+1) for (p,k) in ij],[(p+1,k) for (p,k) in ij], [(p+1,k+1) for (p,k) in ij]]))
 
     def interpolate(ind):
         return [nodes[k][0]*Vij[0][k][ind] + nodes[k][1]*Vij[1][k][ind] + nodes[k][2]*Vij[2][k][ind] + nodes[k][3]*Vij[3][k][ind] for k in range(len(xy))]
@@ -66,7 +66,7 @@ def interpFromGridSingleForLoop(xy,h,randVel1,randVel2,CO2):
         nodes = ((1-rxy[0])*(1-rxy[1]), (1-rxy[0])*rxy[1], rxy[0]*(1-rxy[1]), rxy[0]*rxy[1] )
 
         # get the values of the CO2 and random wind at the four closest nodes
-        Vij = map(lambda m: (randVel1[m], randVel2[m], CO2[m]),[ij,(ij[0],ij[1]+1),(ij[0]+1,ij[1]),(ij[0]+1,ij[1]+1)])
+        Vij = list(map(lambda m: (randVel1[m], randVel2[m], CO2[m]),[ij,(ij[0],ij[1]+1),(ij[0]+1,ij[1]),(ij[0]+1,ij[1]+1)]))
 
         # perform the interpolation
         ur.append(interpolate(0))
@@ -140,9 +140,9 @@ def interpFromGridNumpyArrays(x,y,h,randVel1,randVel2,CO2):
     i,j,nodes = getIndicesNodesNumpyArrays(x,y,h)
 
     # get the values of the CO2 and random wind at the four closest nodes
-    V1 = np.array([randVel1[[i,j]],randVel1[[i,j+1]],randVel1[[i+1,j]],randVel1[[i+1,j+1]]]) 
-    V2 = np.array([randVel2[[i,j]],randVel2[[i,j+1]],randVel2[[i+1,j]],randVel2[[i+1,j+1]]]) 
-    C = np.array([CO2[[i,j]],CO2[[i,j+1]],CO2[[i+1,j]],CO2[[i+1,j+1]]])
+    V1 = np.array([randVel1[i,j],randVel1[i,j+1],randVel1[i+1,j],randVel1[i+1,j+1]]) 
+    V2 = np.array([randVel2[i,j],randVel2[i,j+1],randVel2[i+1,j],randVel2[i+1,j+1]]) 
+    C = np.array([CO2[i,j],CO2[i,j+1],CO2[i+1,j],CO2[i+1,j+1]])
 
     # perform the interpolation
     ur = np.sum(nodes*V1,0)
@@ -166,7 +166,7 @@ def extrapToGrid(x,y,s,h,size):
  
     # calculate additional CO2 at each node
     sarray = np.zeros(size)
-    sarray[[i,i,i+1,i+1],[j,j+1,j,j+1]] = nodes*s 
+    np.add.at(sarray,([i,i,i+1,i+1],[j,j+1,j,j+1]),nodes*s)
  
     return sarray
 
@@ -30,27 +30,99 @@ def _getIndicesNodes(x,y,h):
     nodes = np.array([(1-rx)*(1-ry), (1-rx)*ry, rx*(1-ry), rx*ry])
     return i,j,nodes
 
-def interpFromGrid(x,y,h,randVel1,randVel2,CO2):
+def interpFromGrid(x,y,h,randVel1,randVel2,CO2,r=None):
     '''
     This function interpolates values located at grid nodes to the 
     locations (x,y). 
     x, y are numpy arrays of positions in the x and y directions. 
     h is (scalar) grid spacing.
     randVel* and CO2 are velocity and CO2 values on the grid (np.array).
+    r is None for 2D grid arrays, or an integer array the length of x giving
+    the realization (first index) to use at each (x,y) when the grid arrays
+    are stacked realizations of shape (R,N,N).
 
     '''
     # get indices and proportional values
-    i,j,nodes = _getIndicesNodesNumpyArrays(x,y,h)
+    i,j,nodes = _getIndicesNodes(x,y,h)
+    # indices of the four closest nodes (lowerleft, upperleft, lowerright, upperright)
+    corners = [(i,j),(i,j+1),(i+1,j),(i+1,j+1)]
+    if r is not None:
+        corners = [(r,)+ind for ind in corners]
     # get the values of the CO2 and random wind at the four closest nodes
-    V1 = np.array([randVel1[[i,j]],randVel1[[i,j+1]],randVel1[[i+1,j]],randVel1[[i+1,j+1]]]) 
-    V2 = np.array([randVel2[[i,j]],randVel2[[i,j+1]],randVel2[[i+1,j]],randVel2[[i+1,j+1]]]) 
-    C = np.array([CO2[[i,j]],CO2[[i,j+1]],CO2[[i+1,j]],CO2[[i+1,j+1]]])
+    V1 = np.array([randVel1[ind] for ind in corners]) 
+    V2 = np.array([randVel2[ind] for ind in corners]) 
+    C = np.array([CO2[ind] for ind in corners])
     # perform the interpolation
     ur = np.sum(nodes*V1,0)
     vr = np.sum(nodes*V2,0)
     c = np.sum(nodes*C,0)
     return ur,vr,c
 
+def interpFromInterleavedGrid(x,y,h,fields,r=None,work=None,fresh=None,clamp=False):
+    '''
+    Fused version of interpFromGrid. fields holds every grid quantity 
+    interleaved in one array of shape (N,N,F), or (R,N,N,F) for stacked 
+    realizations chosen by the integer array r. Flat indices of the four 
+    closest nodes are computed directly, so all the values needed at (x,y) 
+    are fetched with one gather of contiguous rows of length F. 
+    Unless clamp, all (x,y) must be strictly inside the outermost grid points.
+    work is an optional dictionary of buffers that are reused between calls 
+    (they are grown when needed). fresh optionally maps channels f of fields
+    that are out of date to grid arrays (shaped like fields[...,f]) to 
+    gather their values from instead, so one quantity can change without 
+    refilling its channel. With clamp, (x,y) may lie anywhere: the stencil 
+    is clamped to the outermost cells and its weights to [0,1], so points 
+    outside the grid get the value at the nearest point on its boundary. 
+    Returns an (M,F) array of interpolated values that lives in work and is
+    overwritten by the next call.
+
+    '''
+    N = fields.shape[-2]
+    F = fields.shape[-1]
+    M = len(x)
+    if work is None:
+        work = {}
+    if work.get('capacity',-1) < M or work['numFields'] != F:
+        capacity = max(M,2*work.get('capacity',0))
+        work.update({'capacity':capacity,'numFields':F,
+                     'idx':np.empty((capacity,4),dtype=np.intp),
+                     'nodes':np.empty((capacity,4)),
+                     'vals':np.empty((capacity,4,F)),
+                     'out':np.empty((capacity,F))})
+    idx, nodes = work['idx'][:M], work['nodes'][:M]
+    vals, out = work['vals'][:M], work['out'][:M]
+    # index of the closest node to the lower left and remainders
+    rx = x/h - 0.5
+    ry = y/h - 0.5
+    if clamp:
+        i = np.clip(np.floor(rx),0,N-2).astype(np.intp)
+        j = np.clip(np.floor(ry),0,N-2).astype(np.intp)
+    else:
+        i = rx.astype(np.intp)
+        j = ry.astype(np.intp)
+    rx -= i
+    ry -= j
+    if clamp:
+        np.clip(rx,0.0,1.0,out=rx)
+        np.clip(ry,0.0,1.0,out=ry)
+    # flat indices of (lowerleft, upperleft, lowerright, upperright)
+    flat = i*N + j
+    if r is not None:
+        flat += np.asarray(r,dtype=np.intp)*(N*N)
+    idx[:,0] = flat
+    np.add(flat,1,out=idx[:,1])
+    np.add(flat,N,out=idx[:,2])
+    np.add(flat,N+1,out=idx[:,3])
+    nodes[:,0] = (1-rx)*(1-ry)
+    nodes[:,1] = (1-rx)*ry
+    nodes[:,2] = rx*(1-ry)
+    nodes[:,3] = rx*ry
+    np.take(fields.reshape(-1,F),idx,axis=0,out=vals)
+    if fresh is not None:
+        for f,field in fresh.items():
+            vals[:,:,f] = np.ravel(field)[idx]
+    return np.einsum('mk,mkf->mf',nodes,vals,out=out)
+
 def extrapToGrid(x,y,s,h,size):
     '''
     This function extrapolates exhaled host CO2 to the closest 4 grid nodes. 
@@ -61,14 +133,63 @@ def extrapToGrid(x,y,s,h,size):
 
     '''
     # get indices and proportional values
-    i,j,nodes = _getIndicesNodesNumpyArrays(x,y,h)
-     # calculate additional CO2 at each node
-    sarray = np.zeros(size)
-    sarray[[i,i,i+1,i+1],[j,j+1,j,j+1]] = nodes*s 
-     return sarray
+    i,j,nodes = _getIndicesNodes(x,y,h)
+    # flat indices of (lowerleft, upperleft, lowerright, upperright)
+    flat = np.array([i*size[1]+j,i*size[1]+j+1,(i+1)*size[1]+j,(i+1)*size[1]+j+1])
+    # calculate additional CO2 at each node, adding up hosts that share one
+    sarray = np.bincount(flat.ravel(),weights=(nodes*s).ravel(),minlength=size[0]*size[1])
+    return sarray.reshape(size)
+
+def upwindMatrix(U,V,environ):
+    '''
+    Returns the sparse matrix A of the upwind flux, such that for a CO2 array
+    C on the grid upwindScheme gives (A @ C.ravel()).reshape(C.shape), with
+    the same ghost cells as upwindScheme (edge velocities from environ, no
+    CO2 coming in). Needs scipy.
+
+    '''
+    from scipy import sparse
+    N = U.shape[0]
+    h = environ.simsParams['h']
+    # velocities and upwind weights at the cell edges
+    uface = 0.5*(np.vstack([environ.leftedge,U]) + np.vstack([U,environ.rightedge]))
+    vface = 0.5*(np.hstack([environ.bottomedge[:,np.newaxis],V]) + np.hstack([V,environ.topedge[:,np.newaxis]]))
+    up, um = np.maximum(uface,0.0)/h, np.minimum(uface,0.0)/h
+    vp, vm = np.maximum(vface,0.0)/h, np.minimum(vface,0.0)/h
+    diag = up[1:,:] - um[:-1,:] + vp[:,1:] - vm[:,:-1]
+    # neighbours in y are one apart in the flattened grid, except across rows
+    north = np.zeros((N,N))
+    north[:,:-1] = vm[:,1:-1]
+    south = np.zeros((N,N))
+    south[:,1:] = -vp[:,1:-1]
+    return sparse.diags([diag.ravel(),um[1:-1,:].ravel(),-up[1:-1,:].ravel(),north.ravel()[:-1],south.ravel()[1:]],[0,N,-N,1,-1],format='csc')
 
-def implicitRK():
-    pass
+def makeImplicitSystem(A,dt,theta=1.0):
+    '''
+    Factorizes the theta method for dy/dt = S - A y with time step dt,
+    (I + theta*dt*A) y_{n+1} = (I - (1-theta)*dt*A) y_n + dt*S,
+    so that implicitRK can reuse it for every step while A is unchanged.
+    theta = 1 is backward Euler and theta = 0.5 is Crank-Nicolson. Needs scipy.
+
+    '''
+    from scipy import sparse
+    from scipy.sparse import linalg
+    I = sparse.identity(A.shape[0],format='csc')
+    system = {'lu':linalg.splu(sparse.csc_matrix(I + theta*dt*A)),'dt':dt,'theta':theta,'explicit':None}
+    if theta != 1.0:
+        system['explicit'] = sparse.csr_matrix(I - (1.0-theta)*dt*A)
+    return system
+
+def implicitRK(y,source,system):
+    '''
+    One step of the one-stage implicit Runge-Kutta (theta) method factorized
+    by makeImplicitSystem for dy/dt = source - A y. y and source are arrays 
+    on the grid; returns y at the next time step.
+
+    '''
+    rhs = y.ravel() if system['explicit'] is None else system['explicit'].dot(y.ravel())
+    rhs = rhs + system['dt']*source.ravel()
+    return system['lu'].solve(rhs).reshape(y.shape)
 
 def explicitRK4(t,y,dt,func):
     # 4th order Runge-Kutta solver for dy/dt = func(y,t)
@@ -83,13 +204,129 @@ def explicitRK4(t,y,dt,func):
 def forwardEuler(t,y,dt,func):
     return y + dt*func(t,y)
 
+def forwardEulerInPlace(t,y,dt,func,out):
+    '''
+    forwardEuler updating y in place: func(t,y,out) writes the right hand 
+    side into out (see sspRK2), which is then scaled by dt in place, so no
+    arrays are allocated. Returns y.
+
+    '''
+    k = func(t,y,out)
+    k *= dt
+    y += k
+    return y
+
+# Carpenter and Kennedy (1994) five stage, fourth order 2N-storage coefficients
+lowStorageRK4Coeffs = {'A':[0.0,-567301805773./1357537059087.,-2404267990393./2016746695238.,-3550918686646./2091501179385.,-1275806237668./842570457699.],
+                       'B':[1432997174477./9575080441755.,5161836677717./13612068292357.,1720146321549./2090206949498.,3134564353537./4481467310338.,2277821191437./14882151754819.],
+                       'C':[0.0,1432997174477./9575080441755.,2526269341429./6820363962896.,2006345519317./3224310063776.,2802321613138./2924317926251.]}
+
+def makeRKRegisters(shape):
+    '''
+    Preallocates the work registers of the low-storage Runge-Kutta methods 
+    sspRK2, sspRK3 and lowStorageRK4 for solutions of the given shape.
+
+    '''
+    return {'u':np.empty(shape),'k':np.empty(shape)}
+
+def sspRK2(t,y,dt,func,registers):
+    '''
+    Strong stability preserving RK2 (Heun) for dy/dt = func, updating y in
+    place using registers from makeRKRegisters. func(t,y,out) writes the 
+    right hand side into out and returns it. Returns y.
+
+    '''
+    u, k = registers['u'], registers['k']
+    np.copyto(u,y)
+    func(t,u,k)
+    k *= dt
+    u += k
+    func(t+dt,u,k)
+    k *= dt
+    u += k
+    y += u
+    y *= 0.5
+    return y
+
+def sspRK3(t,y,dt,func,registers):
+    '''
+    Strong stability preserving RK3 (Shu-Osher) for dy/dt = func, updating
+    y in place using registers from makeRKRegisters (see sspRK2). Returns y.
+
+    '''
+    u, k = registers['u'], registers['k']
+    np.copyto(u,y)
+    func(t,u,k)
+    k *= dt
+    u += k
+    func(t+dt,u,k)
+    k *= dt
+    u += k
+    u *= 0.25
+    np.multiply(y,0.75,out=k)
+    u += k
+    func(t+dt/2.,u,k)
+    k *= dt
+    u += k
+    y *= 1./3.
+    u *= 2./3.
+    y += u
+    return y
+
+def lowStorageRK4(t,y,dt,func,registers):
+    '''
+    Fourth order 2N-storage Runge-Kutta (see lowStorageRK4Coeffs) for 
+    dy/dt = func, updating y in place using registers from makeRKRegisters 
+    (see sspRK2). Returns y.
+
+    It takes five evaluations of func per step to the four of explicitRK4,
+    and func dominates the cost, so it is no faster than explicitRK4 (5-15%
+    fewer steps per second on 256x256 to 1024x1024 grids); what it buys is
+    memory: two grid sized registers and no allocation per step, where an
+    explicitRK4 step allocates six grid arrays. The register updates are
+    fused (BLAS axpy) into two passes over the grid per stage.
+
+    '''
+    dq, k = registers['u'], registers['k']
+    c = lowStorageRK4Coeffs
+    if y.dtype != np.float64 or not (y.flags.c_contiguous and dq.flags.c_contiguous and k.flags.c_contiguous):
+        return _lowStorageRK4NumPy(t,y,dt,func,dq,k)
+    from scipy.linalg.blas import daxpy
+    # flat views, which daxpy updates in place; dq is kept divided by dt and
+    # dt goes into the axpy weight of the update of y
+    yf, dqf, kf = y.ravel(), dq.ravel(), k.ravel()
+    for stage,(a,b,ct) in enumerate(zip(c['A'],c['B'],c['C'])):
+        if stage == 0:
+            func(t,y,dq)
+        else:
+            func(t+ct*dt,y,k)
+            # the new dq is k + a*dq, formed in k, so the registers swap
+            daxpy(dqf,kf,a=a)
+            dq, k, dqf, kf = k, dq, kf, dqf
+        daxpy(dqf,yf,a=b*dt)
+    return y
+
+def _lowStorageRK4NumPy(t,y,dt,func,dq,k):
+    # lowStorageRK4 for arrays that daxpy cannot update in place
+    c = lowStorageRK4Coeffs
+    for stage,(a,b,ct) in enumerate(zip(c['A'],c['B'],c['C'])):
+        if stage == 0:
+            func(t,y,dq)
+        else:
+            func(t+ct*dt,y,k)
+            dq *= a
+            dq += k
+        np.multiply(dq,b*dt,out=k)
+        y += k
+    return y
+
 def upwindScheme(U,V,environ):
     CO2 = environ.CO2
     # add ghost cells to velocity arrays
     uxm = np.vstack([environ.leftedge,U[:-1,:]])
     uxp = np.vstack([U[1:,:],environ.rightedge])
-    vxm = np.hstack([environ.bottomedge,V[:,:-1]])
-    vxp = np.hstack([V[:,1:],environ.topedge])
+    vxm = np.hstack([environ.bottomedge[:,np.newaxis],V[:,:-1]])
+    vxp = np.hstack([V[:,1:],environ.topedge[:,np.newaxis]])
     # find values at cell edges
     um = 0.5*(U+uxm)
     up = 0.5*(U+uxp)
@@ -127,4 +364,133 @@ def upwindScheme(U,V,environ):
     Flxx=(CO2*bool_upp + Cxp*bool_upm)*up - (Cxm*bool_ump + CO2*bool_umm)*um
     Flxy=(CO2*bool_vpp + Cyp*bool_vpm)*vp - (Cym*bool_vmp + CO2*bool_vmm)*vm
     return (Flxx+Flxy)/environ.simsParams['h']
- 
+
+def upwindFaceFluxes(Upad,Vpad,Cpad):
+    '''
+    Upwinded CO2 flux through every cell edge of an n x m block of cells, 
+    as in upwindScheme. Upad (n+2,m) and Vpad (n,m+2) are the velocities 
+    with one ghost cell before and after the block in their own direction, 
+    and Cpad (n+2,m+2) is the CO2 with a ring of ghost cells (corners unused).
+    Returns Fx (n+1,m), the flux through the left edge of every cell and the
+    right edge of the last, and Fy (n,m+1) likewise in y. The flux 
+    divergence is (Fx[1:,:]-Fx[:-1,:] + Fy[:,1:]-Fy[:,:-1])/h.
+
+    '''
+    uface = 0.5*(Upad[1:,:] + Upad[:-1,:])
+    vface = 0.5*(Vpad[:,1:] + Vpad[:,:-1])
+    Fx = np.maximum(uface,0.0)*Cpad[:-1,1:-1] + np.minimum(uface,0.0)*Cpad[1:,1:-1]
+    Fy = np.maximum(vface,0.0)*Cpad[1:-1,:-1] + np.minimum(vface,0.0)*Cpad[1:-1,1:]
+    return Fx, Fy
+
+def makeFaceFluxWork(Upad,Vpad):
+    '''
+    Returns the work dictionary of upwindFaceFluxesInPlace for a block with
+    the padded velocities Upad and Vpad of upwindFaceFluxes: the positive
+    and negative parts of the edge velocities, which hold until the
+    velocities change, and buffers for the fluxes and the flux divergence.
+
+    '''
+    uface = 0.5*(Upad[1:,:] + Upad[:-1,:])
+    vface = 0.5*(Vpad[:,1:] + Vpad[:,:-1])
+    n, m = Vpad.shape[0], Upad.shape[1]
+    return {'up':np.maximum(uface,0.0),'um':np.minimum(uface,0.0),
+            'vp':np.maximum(vface,0.0),'vm':np.minimum(vface,0.0),
+            'Fx':np.empty(uface.shape),'Fy':np.empty(vface.shape),
+            'tmpx':np.empty(uface.shape),'tmpy':np.empty(vface.shape),
+            'div':np.empty((n,m)),'tmp':np.empty((n,m))}
+
+def upwindFaceFluxesInPlace(Cpad,work):
+    '''
+    Same fluxes as upwindFaceFluxes, from the edge velocities in work (see
+    makeFaceFluxWork), without allocating. Returns Fx and Fy, which live in
+    work and are overwritten by the next call.
+
+    '''
+    Fx, Fy, tmpx, tmpy = work['Fx'], work['Fy'], work['tmpx'], work['tmpy']
+    np.multiply(work['up'],Cpad[:-1,1:-1],out=Fx)
+    np.multiply(work['um'],Cpad[1:,1:-1],out=tmpx)
+    Fx += tmpx
+    np.multiply(work['vp'],Cpad[1:-1,:-1],out=Fy)
+    np.multiply(work['vm'],Cpad[1:-1,1:],out=tmpy)
+    Fy += tmpy
+    return Fx, Fy
+
+def faceFluxDivergence(Fx,Fy,h,work):
+    '''
+    Returns the flux divergence of the edge fluxes Fx and Fy (see
+    upwindFaceFluxes) in work['div'], which is overwritten by the next call.
+
+    '''
+    div = work['div']
+    np.subtract(Fx[1:,:],Fx[:-1,:],out=div)
+    np.subtract(Fy[:,1:],Fy[:,:-1],out=work['tmp'])
+    div += work['tmp']
+    div /= h
+    return div
+
+def makeUpwindBuffers(N,numRealizations=None):
+    '''
+    Preallocates the padded work arrays used by upwindSchemeInPlace on an
+    N x N grid, or on numRealizations stacked N x N grids. The ghost cells 
+    of the CO2 arrays are zero (no inflow of CO2) and are never written to, 
+    so they stay zero.
+
+    '''
+    R = () if numRealizations is None else (numRealizations,)
+    return {'Upad':np.zeros(R+(N+2,N)),'Vpad':np.zeros(R+(N,N+2)),
+            'Cxpad':np.zeros(R+(N+2,N)),'Cypad':np.zeros(R+(N,N+2)),
+            'uface':np.empty(R+(N+1,N)),'vface':np.empty(R+(N,N+1)),
+            'Fx':np.empty(R+(N+1,N)),'Fy':np.empty(R+(N,N+1)),
+            'tmpx':np.empty(R+(N+1,N)),'tmpy':np.empty(R+(N,N+1)),
+            'tmp':np.empty(R+(N,N))}
+
+def upwindSchemeInPlace(U,V,environ,out,CO2=None):
+    '''
+    Same flux as upwindScheme, but written into the array out using the
+    persistent buffers in environ.fluxBuffers (see makeUpwindBuffers), so 
+    that no arrays are allocated. The flux is of CO2 if given (e.g. a 
+    Runge-Kutta stage value), otherwise of environ.CO2. Each cell edge flux
+    is computed once and shared by the two cells on either side of the 
+    edge. Upwinding uses max(u,0)*C_left + min(u,0)*C_right, which gives 
+    the same numbers as the boolean masks in upwindScheme. U, V, 
+    environ.CO2 and out may carry a leading realization axis (R,N,N), in 
+    which case all realizations are advanced together.
+
+    '''
+    b = environ.fluxBuffers
+    Upad, Vpad, Cxpad, Cypad = b['Upad'], b['Vpad'], b['Cxpad'], b['Cypad']
+    uface, vface, Fx, Fy = b['uface'], b['vface'], b['Fx'], b['Fy']
+    tmpx, tmpy = b['tmpx'], b['tmpy']
+    # fill the interiors of the padded arrays (edges may be time dependent)
+    Upad[...,0,:] = environ.leftedge
+    Upad[...,1:-1,:] = U
+    Upad[...,-1,:] = environ.rightedge
+    Vpad[...,:,0] = environ.bottomedge
+    Vpad[...,:,1:-1] = V
+    Vpad[...,:,-1] = environ.topedge
+    if CO2 is None:
+        CO2 = environ.CO2
+    Cxpad[...,1:-1,:] = CO2
+    Cypad[...,:,1:-1] = CO2
+    # find velocities at cell edges
+    np.add(Upad[...,1:,:],Upad[...,:-1,:],out=uface)
+    uface *= 0.5
+    np.add(Vpad[...,:,1:],Vpad[...,:,:-1],out=vface)
+    vface *= 0.5
+    # upwinded flux through every cell edge
+    np.maximum(uface,0.0,out=tmpx)
+    np.multiply(tmpx,Cxpad[...,:-1,:],out=Fx)
+    np.minimum(uface,0.0,out=tmpx)
+    tmpx *= Cxpad[...,1:,:]
+    Fx += tmpx
+    np.maximum(vface,0.0,out=tmpy)
+    np.multiply(tmpy,Cypad[...,:,:-1],out=Fy)
+    np.minimum(vface,0.0,out=tmpy)
+    tmpy *= Cypad[...,:,1:]
+    Fy += tmpy
+    # flux out minus flux in
+    np.subtract(Fx[...,1:,:],Fx[...,:-1,:],out=out)
+    np.subtract(Fy[...,:,1:],Fy[...,:,:-1],out=b['tmp'])
+    out += b['tmp']
+    out /= environ.simsParams['h']
+    return out
@@ -0,0 +1,250 @@
+import numpy as np
+import environment
+import lib_numericalMethods as nMeth
+import hostSources
+
+def refinementBoxes(environ,refineRadius,refineDownwind=0.0):
+    '''
+    Returns a list of boxes (i0,i1,j0,j1) of coarse cells of environ to refine:
+    every cell within refineRadius (in x and y) of a host, or of the point
+    refineDownwind downstream of it along the bulk flow, is covered. Boxes
+    are merged until no two are closer than one coarse cell, and are kept one
+    coarse cell away from the domain edges. Needs scipy.
+
+    '''
+    from scipy import ndimage
+    N = environ.simsParams['numGridPoints']
+    h = environ.simsParams['h']
+    flag = np.zeros((N,N),dtype=bool)
+    hx, hy = np.asarray(environ.hostPositionx,dtype=float), np.asarray(environ.hostPositiony,dtype=float)
+    u, v = environ.velfunc(hx,hy)
+    speed = np.sqrt(u**2 + v**2)
+    speed[speed == 0] = 1.0
+    ex, ey = hx + refineDownwind*u/speed, hy + refineDownwind*v/speed
+    i0 = np.clip(np.floor((np.minimum(hx,ex) - refineRadius)/h).astype(int),1,N-1)
+    i1 = np.clip(np.ceil((np.maximum(hx,ex) + refineRadius)/h).astype(int),1,N-1)
+    j0 = np.clip(np.floor((np.minimum(hy,ey) - refineRadius)/h).astype(int),1,N-1)
+    j1 = np.clip(np.ceil((np.maximum(hy,ey) + refineRadius)/h).astype(int),1,N-1)
+    for k in range(len(hx)):
+        flag[i0[k]:i1[k],j0[k]:j1[k]] = True
+    labels, _ = ndimage.label(flag)
+    boxes = [[sl[0].start,sl[0].stop,sl[1].start,sl[1].stop] for sl in ndimage.find_objects(labels)]
+    # bounding boxes of separate clusters may overlap or touch; merge them
+    merged = True
+    while merged:
+        merged = False
+        for a in range(len(boxes)):
+            for b in range(a+1,len(boxes)):
+                A, B = boxes[a], boxes[b]
+                if A[0] <= B[1] and B[0] <= A[1] and A[2] <= B[3] and B[2] <= A[3]:
+                    boxes[a] = [min(A[0],B[0]),max(A[1],B[1]),min(A[2],B[2]),max(A[3],B[3])]
+                    del boxes[b]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [tuple(box) for box in boxes]
+
+
+class finePatch(object):
+    '''
+    A block of the coarse grid of an environment, coarse cells i0:i1, j0:j1,
+    refined by refinementRatio in each direction. Holds the fine CO2, host
+    source, and the velocities at the fine cell centers and at one ring of
+    ghost cells around the patch. The random velocity is interpolated from
+    the coarse random velocity fields.
+
+    '''
+
+    def __init__(self,environ,box,refinementRatio):
+        self.i0, self.i1, self.j0, self.j1 = box
+        self.ratio = refinementRatio
+        hc = environ.simsParams['h']
+        self.h = hc/refinementRatio
+        self.x0, self.y0 = self.i0*hc, self.j0*hc
+        self.shape = (refinementRatio*(self.i1-self.i0),refinementRatio*(self.j1-self.j0))
+        n, m = self.shape
+        # fine cell centers with a ring of ghost cells
+        self.xe, self.ye = np.meshgrid(self.x0 + (np.arange(-1,n+1)+0.5)*self.h,self.y0 + (np.arange(-1,m+1)+0.5)*self.h,indexing='ij')
+        self.constantUe, self.constantVe = environ.velfunc(self.xe,self.ye)
+        ghost = np.ones((n+2,m+2),dtype=bool)
+        ghost[1:-1,1:-1] = False
+        self.ghost = np.nonzero(ghost)
+        # the ghost cells never move, so keep their coarse stencils and weights
+        i,j,self.ghostWeights = nMeth._getIndicesNodes(self.xe[self.ghost],self.ye[self.ghost],hc)
+        N = environ.simsParams['numGridPoints']
+        self.ghostStencil = np.array([i*N+j,i*N+j+1,(i+1)*N+j,(i+1)*N+j+1])
+        # hosts inside the patch put their CO2 on the fine grid; a fine cell
+        # is ratio**2 times smaller, so the same mass needs ratio**2 the rate
+        hx, hy = np.asarray(environ.hostPositionx,dtype=float), np.asarray(environ.hostPositiony,dtype=float)
+        inside = self.contains(hx,hy)
+        schedule = environ.hostSource.schedule
+        if schedule is None:
+            strength = refinementRatio**2*environ.hostSourceStrength[inside]
+        else:
+            strength = lambda t: refinementRatio**2*np.asarray(schedule(t))[inside]
+        self.source = hostSources.hostSource(hx[inside]-self.x0,hy[inside]-self.y0,strength,self.h,self.shape,environ.simsParams['initialTime'])
+        # the fine CO2 is the interior of its ghost padded array, so the
+        # fluxes read it in place
+        self.Cpad = np.zeros((n+2,m+2))
+        self.CO2 = self.Cpad[1:-1,1:-1]
+        self.CO2[...] = self.coarseValues(environ.CO2,environ)[1:-1,1:-1]
+        self.setVelocity(environ)
+
+    def coarseValues(self,field,environ):
+        '''
+        Bilinear interpolation of a coarse grid field to the fine cell
+        centers (with ghost ring).
+
+        '''
+        return nMeth.interpFromGrid(self.xe,self.ye,environ.simsParams['h'],field,field,field)[0]
+
+    def setVelocity(self,environ):
+        h = environ.simsParams['h']
+        rv1, rv2, _ = nMeth.interpFromGrid(self.xe,self.ye,h,environ.randVel1,environ.randVel2,environ.randVel1)
+        self.randVel1, self.randVel2 = rv1[1:-1,1:-1], rv2[1:-1,1:-1]
+        self.Upad = (self.constantUe + rv1)[:,1:-1]
+        self.Vpad = (self.constantVe + rv2)[1:-1,:]
+        self.fluxWork = nMeth.makeFaceFluxWork(self.Upad,self.Vpad)
+
+    def fluxes(self,environ):
+        '''
+        Returns the fine edge fluxes, with the ghost CO2 interpolated from
+        the coarse grid. They live in fluxWork and are overwritten by the
+        next call.
+
+        '''
+        self.Cpad[self.ghost] = np.einsum('km,km->m',self.ghostWeights,environ.CO2.ravel()[self.ghostStencil])
+        return nMeth.upwindFaceFluxesInPlace(self.Cpad,self.fluxWork)
+
+    def contains(self,x,y):
+        '''
+        Returns the indices of the points (x,y) that can be interpolated on
+        the fine grid (inside the outermost fine cell centers).
+
+        '''
+        n, m = self.shape
+        return np.nonzero((x > self.x0 + self.h/2.) & (x < self.x0 + (n-0.5)*self.h) & (y > self.y0 + self.h/2.) & (y < self.y0 + (m-0.5)*self.h))[0]
+
+
+class refinedEnvironment(environment.environment):
+    '''
+    An environment whose CO2 grid is refined by refinementRatio in fine
+    patches around the hosts (see refinementBoxes), a two-level block
+    structured grid. Both levels take the same forward Euler step. At the
+    edges of each patch the coarse flux is replaced by the mean of the fine
+    fluxes through the same edge (refluxing), and coarse cells under a patch
+    are set to the mean of their fine cells, so CO2 is conserved across the
+    levels. querySignal uses the finest level covering each position.
+    boxes, if given, are the coarse cell boxes (i0,i1,j0,j1) to refine in
+    place of those of refinementBoxes.
+
+    Only the plain forward Euler integrator is supported (no adaptive time
+    stepping or steady state freezing) with a wind that does not change in
+    time, and dt must satisfy the CFL condition on the fine grid.
+
+    '''
+
+    def __init__(self,hostPositionx,hostPositiony,refinementRatio=2,refineRadius=10.0,refineDownwind=0.0,boxes=None,**kwargs):
+        environment.environment.__init__(self,hostPositionx,hostPositiony,**kwargs)
+        if self.simsParams['adaptiveTimeStep'] or self.simsParams['integrator'] != 'forwardEuler' or self.simsParams['steadyStateTol'] is not None:
+            raise ValueError('refinedEnvironment only supports fixed step forward Euler.')
+        if self.windProvider is not None:
+            raise ValueError('refinedEnvironment needs a wind that does not change in time.')
+        self.refinementRatio = refinementRatio
+        if boxes is None:
+            boxes = refinementBoxes(self,refineRadius,refineDownwind)
+        self.patches = [finePatch(self,box,refinementRatio) for box in boxes]
+        N = self.simsParams['numGridPoints']
+        self.Upad = np.zeros((N+2,N))
+        self.Vpad = np.zeros((N,N+2))
+        # no CO2 comes in, so the ghost ring stays zero
+        self.Cpad = np.zeros((N+2,N+2))
+        self.fluxWork = None
+
+    def _switchRandVel(self,ind):
+        environment.environment._switchRandVel(self,ind)
+        self._setLevelVelocities()
+
+    def _setLevelVelocities(self):
+        # coarse edge velocities, with the ghost cells of environment
+        self.Upad[0,:], self.Upad[1:-1,:], self.Upad[-1,:] = self.leftedge, self.constantU + self.randVel1, self.rightedge
+        self.Vpad[:,0], self.Vpad[:,1:-1], self.Vpad[:,-1] = self.bottomedge, self.constantV + self.randVel2, self.topedge
+        self.fluxWork = nMeth.makeFaceFluxWork(self.Upad,self.Vpad)
+        for patch in self.patches:
+            patch.setVelocity(self)
+
+    def updateEnvironment(self,currentTime):
+        prof = self.profiler
+        if prof is not None:
+            token = prof.start()
+        dt = self.simsParams['dt']
+        self._updateRandVel(currentTime)
+        self._stepLevels(currentTime,dt)
+        self.plumeVersion += 1
+        if prof is not None:
+            prof.stop('plumeStep',token,self.CO2.size + sum(p.CO2.size for p in self.patches))
+
+    def _stepLevels(self,currentTime,dt):
+        h = self.simsParams['h']
+        self.Cpad[1:-1,1:-1] = self.CO2
+        Fx, Fy = nMeth.upwindFaceFluxesInPlace(self.Cpad,self.fluxWork)
+        fineFluxes = [patch.fluxes(self) for patch in self.patches]
+        # reflux: the coarse flux through a patch edge is the mean fine flux
+        for patch,(fx,fy) in zip(self.patches,fineFluxes):
+            r = patch.ratio
+            nc, mc = patch.i1 - patch.i0, patch.j1 - patch.j0
+            Fx[patch.i0,patch.j0:patch.j1] = fx[0,:].reshape(mc,r).sum(axis=1)/r
+            Fx[patch.i1,patch.j0:patch.j1] = fx[-1,:].reshape(mc,r).sum(axis=1)/r
+            Fy[patch.i0:patch.i1,patch.j0] = fy[:,0].reshape(nc,r).sum(axis=1)/r
+            Fy[patch.i0:patch.i1,patch.j1] = fy[:,-1].reshape(nc,r).sum(axis=1)/r
+        self.hostSource.setTime(currentTime)
+        self._advance(self.CO2,nMeth.faceFluxDivergence(Fx,Fy,h,self.fluxWork),self.hostSource,dt)
+        for patch,(fx,fy) in zip(self.patches,fineFluxes):
+            patch.source.setTime(currentTime)
+            self._advance(patch.CO2,nMeth.faceFluxDivergence(fx,fy,patch.h,patch.fluxWork),patch.source,dt)
+            # coarse cells under the patch hold the mean of their fine cells
+            r = patch.ratio
+            self.CO2[patch.i0:patch.i1,patch.j0:patch.j1] = patch.CO2.reshape(patch.i1-patch.i0,r,patch.j1-patch.j0,r).sum(axis=(1,3))/r**2
+
+    def _advance(self,CO2,div,source,dt):
+        # forward Euler in place; div becomes dt times the right hand side
+        np.negative(div,out=div)
+        source.inject(div)
+        div *= dt
+        CO2 += div
+
+    def querySignal(self,x,y,realization=None):
+        u,v,c = environment.environment.querySignal(self,x,y)
+        for patch in self.patches:
+            inside = patch.contains(x,y)
+            if len(inside) == 0:
+                continue
+            xi, yi = x[inside], y[inside]
+            ub, vb = self.velfunc(xi,yi)
+            ur, vr, cr = nMeth.interpFromGrid(xi-patch.x0,yi-patch.y0,patch.h,patch.randVel1,patch.randVel2,patch.CO2)
+            u[inside], v[inside], c[inside] = ub + ur, vb + vr, cr
+        return u,v,c
+
+    def totalCO2(self):
+        '''
+        Returns the total mass of CO2: the coarse cells not under a patch
+        and the fine cells, each times its area.
+
+        '''
+        covered = np.zeros(self.CO2.shape,dtype=bool)
+        for patch in self.patches:
+            covered[patch.i0:patch.i1,patch.j0:patch.j1] = True
+        return self.simsParams['h']**2*np.sum(self.CO2[~covered]) + sum(patch.h**2*np.sum(patch.CO2) for patch in self.patches)
+
+    def checkpointState(self):
+        state = environment.environment.checkpointState(self)
+        for k,patch in enumerate(self.patches):
+            state['patchCO2_{}'.format(k)] = patch.CO2
+        return state
+
+    def restoreState(self,state):
+        environment.environment.restoreState(self,state)
+        for k,patch in enumerate(self.patches):
+            patch.CO2[...] = state['patchCO2_{}'.format(k)]
+        self._setLevelVelocities()
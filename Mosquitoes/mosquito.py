@@ -1,4 +1,38 @@
 import numpy as np
+import resultsWriter
+
+def _stateField(name):
+    '''
+    Property giving the active part of one row of the population state array,
+    so that e.g. self.currentPosx is a view that can be read, indexed and 
+    assigned to in place.
+
+    '''
+    def getField(self):
+        return self.state[self.stateFields.index(name),:self.numActive]
+    def setField(self,value):
+        self.state[self.stateFields.index(name),:self.numActive] = value
+    return property(getField,setField)
+
+def _mix64(z):
+    # splitmix64 finalizer
+    z = (z ^ (z >> np.uint64(30)))*np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27)))*np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+def counterUniform(seed,ids,counter):
+    '''
+    Counter-based uniform random numbers on [0,1): one for each integer id in
+    ids, a hash of (seed, id, counter), so the number drawn for an id does not
+    depend on which other ids are drawn with it or in what order.
+
+    '''
+    golden = np.uint64(0x9E3779B97F4A7C15)
+    with np.errstate(over='ignore'):
+        z = _mix64(np.uint64(seed) + np.asarray(ids,dtype=np.uint64)*golden)
+        z = _mix64(z + np.uint64(counter)*golden)
+    return (z >> np.uint64(11))*2.0**-53
+
 
 class mosquitoPopulation(object):
 
@@ -8,8 +42,21 @@ class mosquitoPopulation(object):
     tropotaxis and klinotaxis) and subclassed again to choose a plume finding 
     strategy (upwind, downwind, and crosswind).
 
+    The per-mosquito quantities named in stateFields are rows of one 
+    preallocated array self.state, and the mosquitoes still in the simulation
+    are its first numActive columns. Mosquitoes that find a host are retired
+    by moving the last active mosquitoes into their columns, so removal costs
+    O(captured) and every field stays contiguous.
+
     '''
 
+    stateFields = ['currentPosx','currentPosy','agentId']
+    currentPosx = _stateField('currentPosx')
+    currentPosy = _stateField('currentPosy')
+    agentId = _stateField('agentId')
+    # set to a profiling.phaseProfiler to time the phases of each decision
+    profiler = None
+
     def __init__(self,initPosx,**kwargs):
         '''
         initPosx is a numpy array of initial x positions of the mosquito population. 
@@ -19,35 +66,70 @@ class mosquitoPopulation(object):
 
         '''
         self.initPosx = initPosx
+        self.state = np.zeros((len(self.stateFields),len(initPosx)))
+        self.numActive = len(initPosx)
         self.currentPosx = initPosx
-        self.results = {'whichhost':[],'finalPosx':[],'finalPosy':[],'flightTime':[]}
-        # placeholder for subclass assignment
-        self.currentPosy = None
+        self._responseTables = {}
         # construct parameter dictionary
-        self.mosqParams = {'startTime':350.0,'decisionInterval':1.0,'hostRadius':5,'CO2Thresh':0.01,'CO2Sat':1.0,'CO2Kappa':0.0,'CO2WindowMin':0.4,'CO2WindowMax':1.5,'windThresh':0.0,'windSat':0.5,'windKappa':0.0,'windWindowMin':np.pi/6,'windWindowMax':np.pi/2}
+        # If seed is not None every mosquito draws its own random numbers (see
+        # _uniform), so a mosquito flies the same whatever population it is in.
+        # firstAgentId is the agentId of the first mosquito.
+        self.mosqParams = {'startTime':350.0,'decisionInterval':1.0,'hostRadius':5,'CO2Thresh':0.01,'CO2Sat':1.0,'CO2Kappa':0.0,'CO2WindowMin':0.4,'CO2WindowMax':1.5,'windThresh':0.0,'windSat':0.5,'windKappa':0.0,'windWindowMin':np.pi/6,'windWindowMax':np.pi/2,'spdMax':1.0,'responseTablePoints':0,'resultsPath':None,'recordTrajectories':False,'trajectoryPath':None,'trajectoryDecimation':1,'trajectoryAgentStride':1,'trajectoryBufferSize':65536,'seed':None,'firstAgentId':0}
         self.mosqParams.update(kwargs)
+        # original index of each mosquito, since retiring reorders them
+        self.firstAgentId = self.mosqParams['firstAgentId']
+        self.agentId = self.firstAgentId + np.arange(len(initPosx))
+        # decision number the random numbers are drawn for
+        self.decision = -1
         self.mosqParams['windScaledThresh'] = self.mosqParams['windThresh']/self.mosqParams['windSat']
         self.mosqParams['CO2ScaledThresh'] = self.mosqParams['CO2Thresh']/self.mosqParams['CO2Sat']
         if self.mosqParams['windScaledThresh'] != 0 and self.mosqParams['windKappa'] <= -1.0/self.mosqParams['windScaledThresh']:
             raise ValueError('windKappa must be > -1.0 / %0.3f' %self.mosqParams['windScaledThresh'])
         if self.mosqParams['CO2ScaledThresh'] != 0 and self.mosqParams['CO2Kappa'] <= -1.0/self.mosqParams['CO2ScaledThresh']:
             raise ValueError('CO2Kappa must be > -1.0 / %0.3f' %self.mosqParams['CO2ScaledThresh'])
+        self._checkResponseTable(['CO2','wind'])
+        # capture events; streamed to disk in chunks if resultsPath is set
+        self.results = resultsWriter.captureBuffer(self.mosqParams['resultsPath'])
+        # optional flight paths, see resultsWriter.trajectoryRecorder
+        self.trajectory = None
+        if self.mosqParams['recordTrajectories']:
+            self.trajectory = resultsWriter.trajectoryRecorder(self.mosqParams['trajectoryPath'],self.mosqParams['trajectoryDecimation'],self.mosqParams['trajectoryAgentStride'],self.mosqParams['trajectoryBufferSize'])
 
     def updatePosition(self,environ,currentTime):
         '''
         environ is an object containing odor plume information, an instance of
-        class environment
+        class environment. Nothing happens before mosqParams['startTime'], 
+        when the mosquitoes are released.
         
         '''
+        if currentTime < self.mosqParams['startTime'] - self.mosqParams['decisionInterval']/2.0:
+            return
+        prof = self.profiler
+        if prof is not None:
+            token = prof.start()
+            numMosqs = self.numActive
         self.currentU,self.currentV,self.currentCO2 = environ.querySignal(self.currentPosx,self.currentPosy)
-        mosqsinplume = self.currentCO2 >= self.mosqParams['CO2Thresh']
-        dx,dy = self._respondInPlume(mosqsinplume)
-        self.currentPosx[mosqsinplume] = self.currentPosx[mosqsinplume] + dx
-        self.currentPosy[mosqsinplume] = self.currentPosy[mosqsinplume] + dy
-        dxw,dyw = self._respondWindOnly(~mosqsinplume) 
-        self.currentPosx[~mosqsinplume] = self.currentPosx[~mosqsinplume] + dxw
-        self.currentPosy[~mosqsinplume] = self.currentPosy[~mosqsinplume] + dyw
+        if prof is not None:
+            responseToken = prof.start()
+        self.decision = int(round(currentTime/self.mosqParams['decisionInterval']))
+        inplume = self.currentCO2 >= self.mosqParams['CO2Thresh']
+        mosqsinplume = np.nonzero(inplume)[0]
+        mosqswindonly = np.nonzero(~inplume)[0]
+        dx = np.empty(self.numActive)
+        dy = np.empty(self.numActive)
+        dx[mosqsinplume],dy[mosqsinplume] = self._respondInPlume(mosqsinplume)
+        dx[mosqswindonly],dy[mosqswindonly] = self._respondWindOnly(mosqswindonly) 
+        self.currentPosx += dx
+        self.currentPosy += dy
+        if self.trajectory is not None:
+            self.trajectory.record(currentTime,self.agentId.astype(np.int64),self.currentPosx,self.currentPosy)
+        if prof is not None:
+            prof.stop('responses',responseToken,numMosqs)
+            captureToken = prof.start()
         self._atHost(environ,currentTime)
+        if prof is not None:
+            prof.stop('hostCapture',captureToken,numMosqs)
+            prof.stop('updatePosition',token,numMosqs)
 
     def _respondInPlume(self,boolarray):
         '''
@@ -63,31 +145,74 @@ class mosquitoPopulation(object):
         '''
         return None
 
+    # purposes of the random numbers drawn in a decision
+    randomPurposes = {'CO2Dir':0,'windDir':1,'crosswindDuration':2,'crosswindDirection':3}
+
+    def _uniform(self,purpose,index):
+        '''
+        Uniform random numbers on [0,1) for the active mosquitoes index (an 
+        index or boolean array). If mosqParams['seed'] is None they come from
+        np.random; otherwise from counterUniform keyed by the agentId, the 
+        decision number and the purpose, so they do not depend on the other
+        mosquitoes in the population.
+
+        '''
+        if self.mosqParams['seed'] is None:
+            return np.random.rand(np.count_nonzero(index) if index.dtype == bool else len(index))
+        counter = 4*(self.decision + 1) + self.randomPurposes[purpose]
+        return counterUniform(self.mosqParams['seed'],self.agentId[index],counter)
+
     def _atHost(self,environ,currentTime):
         '''
         Remove mosquitoes who found a host.
 
         '''
-        xm = self.currentPosx
-        ym = self.currentPosy
-        stillinsim = []
-        for k in range(len(xm)):
-            dist = np.sqrt( (environ.hostPositionx - xm[k])**2 + (environ.hostPositiony - ym[k])**2 )
-            if np.all(dist >= self.hostRadius):
-                stillinsim.append(k)
-            else:
-                self.results['whichchicken'].append(np.nonzero(dist == np.min(dist)))
-                self.results['finalPosx'].append(xm[k])
-                self.results['finalPosy'].append(ym[k])
-                self.results['flightTime'].append(currentTime - self.mosqParams['startTime'])
-        self._removeMosquitoes(stillinsim)
+        captured,whichhost = environ.hostIndex.nearestWithin(self.currentPosx,self.currentPosy,self.mosqParams['hostRadius'])
+        if len(captured) == 0:
+            return
+        self.results.append(whichhost=whichhost,finalPosx=self.currentPosx[captured],finalPosy=self.currentPosy[captured],
+                            flightTime=np.full(len(captured),currentTime - self.mosqParams['startTime']),agentId=self.agentId[captured])
+        self._removeMosquitoes(captured)
+
+    def _removeMosquitoes(self,captured):
+        '''
+        Retire the mosquitoes at the (sorted, unique) indices captured by 
+        moving the last active mosquitoes that are staying into their 
+        columns of the state array.
 
-    def _removeMosquitoes(self,stillinsim):
         '''
-        Stub for subclass function.
+        newNumActive = self.numActive - len(captured)
+        holes = captured[captured < newNumActive]
+        tail = np.ones(self.numActive - newNumActive,dtype=bool)
+        tail[captured[captured >= newNumActive] - newNumActive] = False
+        self.state[:,holes] = self.state[:,newNumActive + np.nonzero(tail)[0]]
+        self.numActive = newNumActive
+
+    def checkpointState(self):
+        '''
+        Returns a dictionary of arrays holding the state of every active 
+        mosquito and the capture results, for checkpoints (see checkpoint.py).
 
         '''
-        return None
+        state = {'state':self.state[:,:self.numActive]}
+        for name,value in self.results.checkpointState().items():
+            state['results_'+name] = value
+        if self.trajectory is not None:
+            for name,value in self.trajectory.checkpointState().items():
+                state['trajectory_'+name] = value
+        return state
+
+    def restoreState(self,state):
+        '''
+        Puts the population back in a state returned by checkpointState. The
+        population must have been constructed with the same arguments.
+
+        '''
+        self.numActive = state['state'].shape[1]
+        self.state[:,:self.numActive] = state['state']
+        self.results.restoreState(dict((name[len('results_'):],value) for name,value in state.items() if name.startswith('results_')))
+        if self.trajectory is not None:
+            self.trajectory.restoreState(dict((name[len('trajectory_'):],value) for name,value in state.items() if name.startswith('trajectory_')))
 
     def _responseCurve(self,responseStr,currentVal):
         '''
@@ -96,6 +221,76 @@ class mosquitoPopulation(object):
         parameter set to use. Examples: 'CO2' or 'wind' or 'diffCO2'.
         currentVal is an array of the numerical values of the wind or CO2 etc. 
         at the location of each mosquito.
+        Vectorized version of _responseCurveScalar. If 
+        mosqParams['responseTablePoints'] is nonzero, the response is 
+        linearly interpolated from a table with that many points between 
+        threshold and saturation instead of being evaluated.
+
+        '''
+        val = np.asarray(currentVal,dtype=float)/self.mosqParams[responseStr+'Sat']
+        thresh = self.mosqParams[responseStr+'ScaledThresh']
+        fMax = self.mosqParams[responseStr+'WindowMax']
+        fMin = self.mosqParams[responseStr+'WindowMin']
+        # clip so that the curve is only evaluated where it is used
+        v = np.clip(val,thresh,1.0)
+        if self.mosqParams['responseTablePoints']:
+            table,invSpacing = self._responseTable(responseStr)
+            # the table is evenly spaced, so no search is needed
+            pos = (v - thresh)*invSpacing
+            k = np.minimum(pos.astype(int),len(table)-2)
+            pos -= k
+            f = table[k] + pos*(table[k+1] - table[k])
+        else:
+            f = self._responseFormula(responseStr,v)
+        # saturation scaled to 1.0
+        f = np.where(val >= 1.0,fMax - (fMax-fMin)*1.0,f)
+        return np.where(val <= thresh,fMax - (fMax-fMin)*0.0,f)
+
+    def _responseFormula(self,responseStr,v):
+        '''
+        The response curve between threshold and saturation for scaled 
+        signal values v.
+
+        '''
+        kappa = self.mosqParams[responseStr+'Kappa']
+        thresh = self.mosqParams[responseStr+'ScaledThresh']
+        fMax = self.mosqParams[responseStr+'WindowMax']
+        fMin = self.mosqParams[responseStr+'WindowMin']
+        return fMax - (fMax-fMin)*((1.0+kappa*thresh)*(v - thresh)/(1.0+kappa*thresh*v*(1.0-thresh)))
+
+    def _checkResponseTable(self,responseStrs):
+        '''
+        Raises ValueError if the response curves of responseStrs cannot be
+        tabulated (see _responseTable): a table needs at least two points
+        and a threshold below saturation.
+
+        '''
+        n = self.mosqParams['responseTablePoints']
+        if not n:
+            return
+        if n < 2:
+            raise ValueError('responseTablePoints must be 0 (no table) or at least 2, not %d' %n)
+        for responseStr in responseStrs:
+            if self.mosqParams[responseStr+'ScaledThresh'] >= 1.0:
+                raise ValueError('%sThresh must be below %sSat to tabulate the response (responseTablePoints = %d)' %(responseStr,responseStr,n))
+
+    def _responseTable(self,responseStr):
+        '''
+        Returns (and caches) the response at evenly spaced scaled signal 
+        values from threshold to saturation, and the inverse of the spacing.
+
+        '''
+        if responseStr not in self._responseTables:
+            thresh = self.mosqParams[responseStr+'ScaledThresh']
+            n = self.mosqParams['responseTablePoints']
+            grid = np.linspace(thresh,1.0,n)
+            self._responseTables[responseStr] = (self._responseFormula(responseStr,grid),(n-1)/(1.0-thresh))
+        return self._responseTables[responseStr]
+
+    def _responseCurveScalar(self,responseStr,currentVal):
+        '''
+        Reference version of _responseCurve that evaluates the response one
+        mosquito at a time. Kept for regression tests.
 
         '''
         unscaledSat = self.mosqParams[responseStr+'Sat']
@@ -121,24 +316,27 @@ class klinotaxis(mosquitoPopulation):
     Plume tracking using memory.
 
     '''
+    stateFields = mosquitoPopulation.stateFields + ['previousMotionDir','previousCO2']
+    previousMotionDir = _stateField('previousMotionDir')
+    previousCO2 = _stateField('previousCO2')
+
     def __init__(self,initPosx,**kwargs):
-        mosquitoPopulation.__init__(initPosx,**kwargs)
-        self.previousCO2 = np.zeros(size(initPosx))
-        #stub for subclass assignment
-        self.previousMotionDir = None 
+        mosquitoPopulation.__init__(self,initPosx,**kwargs)
         # extra params for klinotaxis
         klinParams = {'diffCO2Thresh':(0.01/10)*0.0042/0.0833,'diffCO2Sat':(1.0 - 0.01)/50.,'diffCO2Kappa':0.0,'diffCO2WindowMin':np.pi/36,'diffCO2WindowMax':np.pi} 
         self.mosqParams.update(klinParams)
         self.mosqParams.update(kwargs)
+        self.mosqParams['diffCO2ScaledThresh'] = self.mosqParams['diffCO2Thresh']/self.mosqParams['diffCO2Sat']
+        self._checkResponseTable(['diffCO2'])
 
     def _respondInPlume(self,boolarray):
         # calculate mosquito speed
         CO2 = self.currentCO2[boolarray]
-        mosqSpeed = self._responseStrength('CO2',CO2)
+        mosqSpeed = self._responseCurve('CO2',CO2)
         # calculate direction influenced by CO2
         diffCO2 = CO2 - self.previousCO2[boolarray]
-        mosqCO2Window = self._responseStrength('diffCO2',np.abs(diffCO2))
-        mosqCO2dir = self.previousMotionDir + mosqCO2Window*(-1.0 + 2.0*np.random.rand(len(CO2))
+        mosqCO2Window = self._responseCurve('diffCO2',np.abs(diffCO2))
+        mosqCO2dir = self.previousMotionDir[boolarray] + mosqCO2Window*(-1.0 + 2.0*self._uniform('CO2Dir',boolarray))
         # correct direction if CO2 decreased
         lowerCO2 = diffCO2 < 0.0
         mosqCO2dir[lowerCO2] -= np.pi
@@ -148,8 +346,8 @@ class klinotaxis(mosquitoPopulation):
         U = self.currentU[boolarray]
         V = self.currentV[boolarray]
         velMag = np.sqrt(U**2 + V**2)
-        mosqWindWindow = self._responseStrength('wind',velMag)
-        mosqWindDir = np.pi + np.arctan2(V,U) + mosqWindWindow*(-1.0 + 2.0*np.random.rand(len(U)) # the pi term gives upwind flight
+        mosqWindWindow = self._responseCurve('wind',velMag)
+        mosqWindDir = np.pi + np.arctan2(V,U) + mosqWindWindow*(-1.0 + 2.0*self._uniform('windDir',boolarray)) # the pi term gives upwind flight
         # Advection plus average CO2 and wind responses. 
         dx = self.mosqParams['decisionInterval'] * (U + 0.5 * mosqSpeed * (np.cos(mosqCO2dir) + np.cos(mosqWindDir)))
         dy = self.mosqParams['decisionInterval'] * (V + 0.5 * mosqSpeed * (np.sin(mosqCO2dir) + np.sin(mosqWindDir)))
@@ -165,7 +363,7 @@ class upwind(klinotaxis):
         environ is an instance of class environment
 
         '''
-        klinotaxis.__init__(initPosx,**kwargs)
+        klinotaxis.__init__(self,initPosx,**kwargs)
         self.initPosy = environ.simsParams['domainLength'] - environ.simsParams['h']
         self.currentPosy = self.initPosy*np.ones(initPosx.shape)
         self.previousMotionDir = -np.pi/2 * np.ones(initPosx.shape)   
@@ -178,8 +376,8 @@ class upwind(klinotaxis):
         U = self.currentU[boolarray]
         V = self.currentV[boolarray]
         velMag = np.sqrt(U**2 + V**2)
-        mosqWindWindow = self._responseStrength('wind',velMag)
-        mosqWindDir = np.pi + np.arctan2(V,U) + mosqWindWindow*(-1.0 + 2.0*np.random.rand(len(U)) # the pi term gives upwind flight
+        mosqWindWindow = self._responseCurve('wind',velMag)
+        mosqWindDir = np.pi + np.arctan2(V,U) + mosqWindWindow*(-1.0 + 2.0*self._uniform('windDir',boolarray)) # the pi term gives upwind flight
         # Advection plus wind response. 
         dx = self.mosqParams['decisionInterval'] * (U + mosqSpeed*np.cos(mosqWindDir))
         dy = self.mosqParams['decisionInterval'] * (V + mosqSpeed*np.sin(mosqWindDir))
@@ -187,12 +385,6 @@ class upwind(klinotaxis):
         self.previousMotionDir[boolarray] = np.arctan2(dy,dx)
         return dx, dy
 
-    def _removeMosquitoes(self,stillinsim):
-        self.currentPosx = self.currentPosx[stillinsim]
-        self.currentPosy = self.currentPosy[stillinsim]
-        self.previousMotionDir = self.previousMotionDir[stillinsim]
-        self.previousCO2 = self.previousCO2[stillinsim]
-
     def stopSimulation(self,environ):
         # argument environ is here for consistent API
         if np.any(self.currentPosy > 0.0):
@@ -208,7 +400,7 @@ class downwind(klinotaxis):
        environ is an instance of class environment
 
         '''
-        klinotaxis.__init__(initPosx,**kwargs)
+        klinotaxis.__init__(self,initPosx,**kwargs)
         self.initPosy = 0.0
         self.currentPosy = np.zeros(initPosx.shape)
         self.previousMotionDir = np.pi/2 * np.ones(initPosx.shape)   
@@ -221,8 +413,8 @@ class downwind(klinotaxis):
         U = self.currentU[boolarray]
         V = self.currentV[boolarray]
         velMag = np.sqrt(U**2 + V**2)
-        mosqWindWindow = self._responseStrength('wind',velMag)
-        mosqWindDir = np.arctan2(V,U) + mosqWindWindow*(-1.0 + 2.0*np.random.rand(len(U)) 
+        mosqWindWindow = self._responseCurve('wind',velMag)
+        mosqWindDir = np.arctan2(V,U) + mosqWindWindow*(-1.0 + 2.0*self._uniform('windDir',boolarray)) 
         # Advection plus wind response. 
         dx = self.mosqParams['decisionInterval'] * (U + mosqSpeed*np.cos(mosqWindDir))
         dy = self.mosqParams['decisionInterval'] * (V + mosqSpeed*np.sin(mosqWindDir))
@@ -230,13 +422,6 @@ class downwind(klinotaxis):
         self.previousMotionDir[boolarray] = np.arctan2(dy,dx)
         return dx, dy
 
-    def _removeMosquitoes(self,stillinsim):
-        self.currentPosx = self.currentPosx[stillinsim]
-        self.currentPosy = self.currentPosy[stillinsim]
-        self.previousMotionDir = self.previousMotionDir[stillinsim]
-        self.previousCO2 = self.previousCO2[stillinsim]
-
-
     def stopSimulation(self,environ):
         if np.any(self.currentPosy < environ.simsParams['domainLength']+5*environ.simsParams['h']):
             return False
@@ -245,23 +430,31 @@ class downwind(klinotaxis):
 
 
 class crosswind(klinotaxis):
+    stateFields = klinotaxis.stateFields + ['crosswindDuration','crosswindDirection']
+    crosswindDuration = _stateField('crosswindDuration')
+    crosswindDirection = _stateField('crosswindDirection')
+
     def __init__(self,environ,initPosx,**kwargs):
         '''
        environ is an instance of class environment
 
         '''
-        klinotaxis.__init__(initPosx,**kwargs)
+        klinotaxis.__init__(self,initPosx,**kwargs)
         self.initPosy = 0.0
         self.currentPosy = np.zeros(initPosx.shape)
         self.currentU,self.currentV,self.currentCO2 = environ.querySignal(self.currentPosx,self.currentPosy)
         #CW specific parameters
-        self.crosswindDuration = 5 + 4.999 * np.random.rand(len(initPosx)).astype(int)
-        self.crosswindDirection = np.array([-1.0 if np.random.rand() < 0.5 else 1.0 for _ in range(len(initPosx))])
+        allMosqs = np.arange(len(initPosx))
+        self.crosswindDuration = (5 + 4.999 * self._uniform('crosswindDuration',allMosqs)).astype(int)
+        if self.mosqParams['seed'] is None:
+            self.crosswindDirection = np.array([-1.0 if np.random.rand() < 0.5 else 1.0 for _ in range(len(initPosx))])
+        else:
+            self.crosswindDirection = np.where(self._uniform('crosswindDirection',allMosqs) < 0.5,-1.0,1.0)
         self.previousMotionDir = np.pi/2 * self.crosswindDirection  
 
     def _setDurationDirection(self):
         boolarray = self.crosswindDuration == 0
-        self.crosswindDuration[boolarray] = 5 + 4.999 * np.random.rand(len(boolarray)).astype(int)
+        self.crosswindDuration[boolarray] = (5 + 4.999 * self._uniform('crosswindDuration',boolarray)).astype(int)
         self.crosswindDirection[boolarray] = -1.0*self.crosswindDirection[boolarray]
 
 
@@ -272,8 +465,8 @@ class crosswind(klinotaxis):
         U = self.currentU[boolarray]
         V = self.currentV[boolarray]
         velMag = np.sqrt(U**2 + V**2)
-        mosqWindWindow = self._responseStrength('wind',velMag)
-        mosqWindDir = self.crosswindDirection*np.pi/2 + np.arctan2(V,U) + mosqWindWindow*(-1.0 + 2.0*np.random.rand(len(U)) 
+        mosqWindWindow = self._responseCurve('wind',velMag)
+        mosqWindDir = self.crosswindDirection[boolarray]*np.pi/2 + np.arctan2(V,U) + mosqWindWindow*(-1.0 + 2.0*self._uniform('windDir',boolarray)) 
         # Advection plus wind response. 
         dx = self.mosqParams['decisionInterval'] * (U + mosqSpeed*np.cos(mosqWindDir))
         dy = self.mosqParams['decisionInterval'] * (V + mosqSpeed*np.sin(mosqWindDir))
@@ -283,14 +476,6 @@ class crosswind(klinotaxis):
         self._setDurationDirection()
         return dx, dy
 
-    def _removeMosquitoes(self,stillinsim):
-        self.currentPosx = self.currentPosx[stillinsim]
-        self.currentPosy = self.currentPosy[stillinsim]
-        self.previousMotionDir = self.previousMotionDir[stillinsim]
-        self.previousCO2 = self.previousCO2[stillinsim]
-        self.crosswindDuration = self.crosswindDuration[stillinsim]
-        self.crosswindDirection = self.crosswindDirection[stillinsim]
-
     def stopSimulation(self,environ):
         if np.any(self.currentPosy < environ.simsParams['domainLength']+5*environ.simsParams['h']):
             return False
@@ -299,6 +484,84 @@ class crosswind(klinotaxis):
 
 
 
+class mixedStrategies(klinotaxis):
+    '''
+    Klinotaxis mosquitoes with any mix of plume finding strategies (upwind,
+    downwind and crosswind) in one population. The strategy is a per-mosquito
+    column of the state, so each decision needs one signal query, one 
+    interpolation and one host capture test however many strategies are in
+    the experiment, and the wind-only responses of all strategies are made 
+    together with masked array operations. The strategy of each captured 
+    mosquito is self.strategies[results['agentId'] - self.firstAgentId]
+    (self.strategy is that of the active mosquitoes, in their current
+    order).
+
+    '''
+    strategyCodes = {'upwind':0,'downwind':1,'crosswind':2}
+    stateFields = klinotaxis.stateFields + ['strategy','crosswindDuration','crosswindDirection']
+    strategy = _stateField('strategy')
+    crosswindDuration = _stateField('crosswindDuration')
+    crosswindDirection = _stateField('crosswindDirection')
+
+    def __init__(self,environ,initPosx,strategies,**kwargs):
+        '''
+        environ is an instance of class environment
+        strategies is an array the length of initPosx of strategy names 
+        ('upwind', 'downwind' or 'crosswind').
+
+        '''
+        klinotaxis.__init__(self,initPosx,**kwargs)
+        codes = np.array([self.strategyCodes[name] for name in strategies])
+        self.strategy = codes
+        self.strategies = codes.copy() # by agentId, for results
+        up = codes == self.strategyCodes['upwind']
+        cw = codes == self.strategyCodes['crosswind']
+        # upwind mosquitoes start at the top of the domain, the others at the bottom
+        self.initPosy = np.where(up,environ.simsParams['domainLength'] - environ.simsParams['h'],0.0)
+        self.currentPosy = self.initPosy
+        allMosqs = np.arange(len(initPosx))
+        self.crosswindDuration = (5 + 4.999 * self._uniform('crosswindDuration',allMosqs)).astype(int)
+        self.crosswindDirection = np.where(self._uniform('crosswindDirection',allMosqs) < 0.5,-1.0,1.0)
+        self.previousMotionDir = np.where(up,-np.pi/2,np.where(cw,np.pi/2*self.crosswindDirection,np.pi/2))
+        self.currentU,self.currentV,self.currentCO2 = environ.querySignal(self.currentPosx,self.currentPosy)
+
+    def _respondWindOnly(self,boolarray):
+        # calculate speed
+        mosqSpeed = self.mosqParams['spdMax']
+        # calculate direction relative to the wind for each strategy
+        strategy = self.strategy[boolarray]
+        cw = strategy == self.strategyCodes['crosswind']
+        offset = np.where(strategy == self.strategyCodes['upwind'],np.pi,0.0) # the pi term gives upwind flight
+        offset[cw] = self.crosswindDirection[boolarray][cw]*np.pi/2
+        U = self.currentU[boolarray]
+        V = self.currentV[boolarray]
+        velMag = np.sqrt(U**2 + V**2)
+        mosqWindWindow = self._responseCurve('wind',velMag)
+        mosqWindDir = offset + np.arctan2(V,U) + mosqWindWindow*(-1.0 + 2.0*self._uniform('windDir',boolarray)) 
+        # Advection plus wind response. 
+        dx = self.mosqParams['decisionInterval'] * (U + mosqSpeed*np.cos(mosqWindDir))
+        dy = self.mosqParams['decisionInterval'] * (V + mosqSpeed*np.sin(mosqWindDir))
+        # update memory
+        self.previousMotionDir[boolarray] = np.arctan2(dy,dx)
+        cwinds = boolarray[cw]
+        self.crosswindDuration[cwinds] = self.crosswindDuration[cwinds] - 1
+        self._setDurationDirection()
+        return dx, dy
+
+    def _setDurationDirection(self):
+        boolarray = (self.crosswindDuration == 0) & (self.strategy == self.strategyCodes['crosswind'])
+        self.crosswindDuration[boolarray] = (5 + 4.999 * self._uniform('crosswindDuration',boolarray)).astype(int)
+        self.crosswindDirection[boolarray] = -1.0*self.crosswindDirection[boolarray]
+
+    def stopSimulation(self,environ):
+        up = self.strategy == self.strategyCodes['upwind']
+        if np.any(self.currentPosy[up] > 0.0) or np.any(self.currentPosy[~up] < environ.simsParams['domainLength']+5*environ.simsParams['h']):
+            return False
+        else:
+            return True
+
+
+
 if __name__ == '__main__':
     
     mymosqs = mosquitoPopulation([1.0,2.0,3.0],windKappa=1.0,windThresh=0.01)
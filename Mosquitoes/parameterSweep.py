@@ -0,0 +1,123 @@
+import numpy as np
+import environment
+import mosquito
+import itertools
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+class archivedPlumeEnvironment(environment.replayEnvironment):
+    '''
+    A replay environment serving the plume archive in the directory 
+    archivePath (written by environment.writePlume or recordPlume), whatever
+    its parameters. The frames are memory-mapped, so the worker processes
+    of a sweep share one copy of them in the page cache and only the frames
+    that are flown through are ever read.
+
+    '''
+
+    def __init__(self,archivePath,hostPositionx,hostPositiony,**kwargs):
+        environment.environment.__init__(self,hostPositionx,hostPositiony,**kwargs)
+        self.archivePath = archivePath
+        self.playFrames(*environment.loadPlume(archivePath))
+
+_workerEnviron = None
+
+def _initWorker(archivePath,hostPositionx,hostPositiony,velfunc,simsParams):
+    global _workerEnviron
+    _workerEnviron = archivedPlumeEnvironment(archivePath,hostPositionx,hostPositiony,velocityFunctionHandle=velfunc,**simsParams)
+
+def runMixedPopulation(environ,initPosx,strategies,seed,**mosqParams):
+    '''
+    Releases one mixedStrategies population at mosqParams['startTime'] into
+    environ and flies it until every mosquito is done or the simulation ends.
+    Returns the population.
+
+    '''
+    np.random.seed(seed)
+    pop = mosquito.mixedStrategies(environ,initPosx,strategies,**mosqParams)
+    for t in np.arange(pop.mosqParams['startTime'],environ.simsParams['finalTime'],pop.mosqParams['decisionInterval']):
+        environ.updateEnvironment(t)
+        pop.updatePosition(environ,t)
+        if pop.numActive == 0 or pop.stopSimulation(environ):
+            break
+    return pop
+
+def _runCombination(args):
+    k, mosqParams, initPosx, strategies, seed = args
+    pop = runMixedPopulation(_workerEnviron,initPosx,strategies,seed,**mosqParams)
+    rows = []
+    captured = pop.strategies[pop.results['agentId'] - pop.firstAgentId]
+    flightTime = pop.results['flightTime']
+    for name,code in sorted(pop.strategyCodes.items(),key=lambda a:a[1]):
+        mine = captured == code
+        rows.append((k,name,np.sum(pop.strategies == code),np.sum(mine),np.mean(flightTime[mine]) if np.any(mine) else np.nan))
+    return rows
+
+def sweep(environ,paramGrid,initPosx,strategies=('upwind','downwind','crosswind'),numProcesses=None,seed=0,archiveRoot=None):
+    '''
+    Flies one mixedStrategies population for every combination of the
+    mosquito parameters in paramGrid (a dictionary of parameter name to list
+    of values, e.g. {'CO2Thresh':[0.005,0.01],'windKappa':[0.0,1.0]}) through
+    the plume of environ, which must not have been advanced yet (or may be a 
+    replayEnvironment). The plume is solved once into a plume archive (in
+    archiveRoot with recordPlume, which needs the environment seed, or 
+    else in a temporary directory that is removed afterwards) unless environ
+    replays one already, and a pool of numProcesses worker processes 
+    memory-map it. A wind loaded with windFields.loadGriddedWind is passed
+    to the workers by path.
+    Each strategy starts from every position in initPosx.
+    Returns a structured array with one row per combination and strategy:
+    the parameter values, strategy, number released, number that found a
+    host and their mean flight time.
+
+    '''
+    names = sorted(paramGrid)
+    combinations = [dict(zip(names,values)) for values in itertools.product(*[paramGrid[name] for name in names])]
+    tmpRoot = None
+    if isinstance(environ,environment.replayEnvironment):
+        archivePath = environ.archivePath
+    elif archiveRoot is not None:
+        archivePath = environment.recordPlume(environ,archiveRoot)
+    else:
+        tmpRoot = tempfile.mkdtemp()
+        archivePath = os.path.join(tmpRoot,'plume')
+        environment.writePlume(environ,archivePath)
+    allPosx = np.tile(initPosx,len(strategies))
+    allStrategies = np.repeat(strategies,len(initPosx))
+    seeds = np.random.SeedSequence(seed).generate_state(len(combinations))
+    jobs = [(k,c,allPosx,allStrategies,seeds[k]) for k,c in enumerate(combinations)]
+    try:
+        pool = multiprocessing.Pool(numProcesses,_initWorker,(archivePath,environ.hostPositionx,environ.hostPositiony,environ.velfunc,environ.simsParams))
+        try:
+            rows = [row for result in pool.imap(_runCombination,jobs) for row in result]
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        if tmpRoot is not None:
+            shutil.rmtree(tmpRoot)
+    # each parameter column keeps the type of its values (e.g. integer counts)
+    dtype = [(name,np.asarray(paramGrid[name]).dtype) for name in names] + [('strategy','U9'),('numReleased',int),('numCaptured',int),('meanFlightTime',float)]
+    table = np.zeros(len(rows),dtype=dtype)
+    for n,(k,strategy,released,numCaptured,meanTime) in enumerate(rows):
+        for name in names:
+            table[name][n] = combinations[k][name]
+        table['strategy'][n] = strategy
+        table['numReleased'][n] = released
+        table['numCaptured'][n] = numCaptured
+        table['meanFlightTime'][n] = meanTime
+    return table
+
+
+if __name__ == '__main__':
+    import time
+    initPosx = 100*np.random.rand(500)
+    paramGrid = {'CO2Thresh':[0.005,0.01,0.02,0.04],'windKappa':[0.0,1.0]}
+    for numProcesses in [1,2,4]:
+        environ = environment.environment(np.array([30.0,70.0]),np.array([40.0,60.0]),numGridPoints=64,finalTime=600.0,dt=1.0,adaptiveTimeStep=True,seed=1)
+        start = time.time()
+        table = sweep(environ,paramGrid,initPosx,numProcesses=numProcesses)
+        print('{} processes: {:.2f} s'.format(numProcesses,time.time()-start))
+    print(table)
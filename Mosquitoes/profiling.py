@@ -0,0 +1,114 @@
+import json
+import time
+import tracemalloc
+
+class phaseProfiler(object):
+    '''
+    This class accumulates wall time, call counts and array sizes for the
+    phases of a simulation step. Assign one instance to the profiler
+    attribute of an environment and of each mosquito population (see
+    attach); they time their phases when it is set and cost one attribute
+    check per phase when it is None, the default.
+
+    Phases are 'plumeStep' (environment.updateEnvironment, including the
+    nested 'randomFields' regeneration), 'querySignal', 'responses' and
+    'hostCapture' (mosquitoPopulation.updatePosition), and 'updatePosition'
+    (the whole of it, including the nested ones). Sizes are grid cells for
+    the plume phases and mosquitoes for the others.
+
+    If traceAllocations is True, tracemalloc also records for every call the
+    peak memory allocated above what was allocated when the phase started,
+    so allocation regressions in the numeric kernels show up. This slows the
+    run down considerably, so leave it off for timings.
+
+    '''
+
+    def __init__(self,traceAllocations=False):
+        self.traceAllocations = traceAllocations
+        self.phases = {}
+        # base allocation and peak so far of every phase in progress
+        self._allocStack = []
+        if traceAllocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def start(self):
+        '''
+        Returns a token to pass to stop at the end of the phase.
+
+        '''
+        if self.traceAllocations:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._allocStack:
+                self._allocStack[-1][1] = max(self._allocStack[-1][1],peak)
+            tracemalloc.reset_peak()
+            self._allocStack.append([current,current])
+        return time.perf_counter()
+
+    def stop(self,phase,token,size=0):
+        '''
+        Adds one call of phase that started at token and handled size items.
+
+        '''
+        elapsed = time.perf_counter() - token
+        if phase not in self.phases:
+            self.phases[phase] = {'calls':0,'seconds':0.0,'totalSize':0,'maxSize':0,'maxAllocatedBytes':0,'totalAllocatedBytes':0}
+        record = self.phases[phase]
+        if self.traceAllocations:
+            base, peak = self._allocStack.pop()
+            peak = max(peak,tracemalloc.get_traced_memory()[1])
+            if self._allocStack:
+                self._allocStack[-1][1] = max(self._allocStack[-1][1],peak)
+            record['maxAllocatedBytes'] = max(record['maxAllocatedBytes'],peak - base)
+            record['totalAllocatedBytes'] += peak - base
+        record['calls'] += 1
+        record['seconds'] += elapsed
+        record['totalSize'] += size
+        record['maxSize'] = max(record['maxSize'],size)
+
+    def summary(self):
+        '''
+        Returns a dictionary holding, for every phase, the number of calls,
+        total and mean seconds, mean and largest size, and (if allocations
+        were traced) mean and largest peak allocation per call in bytes.
+
+        '''
+        summary = {}
+        for phase,record in self.phases.items():
+            calls = record['calls']
+            summary[phase] = {'calls':calls,'seconds':record['seconds'],'meanSeconds':record['seconds']/calls,
+                              'meanSize':record['totalSize']/float(calls),'maxSize':record['maxSize']}
+            if self.traceAllocations:
+                summary[phase]['meanAllocatedBytes'] = record['totalAllocatedBytes']/float(calls)
+                summary[phase]['maxAllocatedBytes'] = record['maxAllocatedBytes']
+        return summary
+
+    def report(self):
+        '''
+        Prints the summary as a table, slowest phase first.
+
+        '''
+        summary = self.summary()
+        for phase in sorted(summary,key=lambda p: -summary[p]['seconds']):
+            s = summary[phase]
+            line = '{:15s} {:>8d} calls  {:9.3f} s  {:.3e} s/call  mean size {:.0f}'.format(phase,s['calls'],s['seconds'],s['meanSeconds'],s['meanSize'])
+            if self.traceAllocations:
+                line += '  mean peak alloc {:.2f} MB'.format(s['meanAllocatedBytes']/2.**20)
+            print(line)
+
+    def save(self,path):
+        '''
+        Writes the summary to path as JSON.
+
+        '''
+        with open(path,'w') as f:
+            json.dump(self.summary(),f,indent=1)
+
+def attach(profiler,environ,populations=()):
+    '''
+    Makes environ and every population in populations report to profiler.
+    Pass None as profiler to switch profiling off again.
+
+    '''
+    environ.profiler = profiler
+    for pop in populations:
+        pop.profiler = profiler
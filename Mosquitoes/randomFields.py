@@ -0,0 +1,149 @@
+import numpy as np
+
+def spectralAmplitude(shape,h,correlationLength,spectrum='gaussian'):
+    '''
+    Returns the Fourier amplitude filter (square root of the power spectrum)
+    that turns unit variance white noise on a periodic grid into a unit 
+    variance random field with the given correlation length (same units as h).
+    The filter is laid out for np.fft.rfft2, shape (shape[0], shape[1]//2+1).
+    spectrum is 'gaussian' (covariance exp(-r**2/(2 l**2))) or 'exponential'
+    (covariance exp(-r/l)).
+
+    '''
+    kx = 2*np.pi*np.fft.fftfreq(shape[0],d=h)
+    ky = 2*np.pi*np.fft.rfftfreq(shape[1],d=h)
+    kl2 = (kx[:,np.newaxis]**2 + ky[np.newaxis,:]**2)*correlationLength**2
+    if spectrum == 'gaussian':
+        power = np.exp(-kl2/2.0)
+    elif spectrum == 'exponential':
+        power = (1.0 + kl2)**(-1.5)
+    else:
+        raise ValueError('Unknown spectrum %s. Use gaussian or exponential.' %spectrum)
+    # normalize so that the field has unit variance; the columns of the 
+    # half spectrum stand for one or two columns of the full spectrum
+    weights = 2.0*np.ones(ky.shape)
+    weights[0] = 1.0
+    if shape[1]%2 == 0:
+        weights[-1] = 1.0
+    variance = np.sum(power*weights)/(shape[0]*shape[1])
+    return np.sqrt(power/variance)
+
+def filterNoise(noise,amplitude):
+    '''
+    Returns the unit variance Gaussian random field made from the white
+    noise array noise by the Fourier filter amplitude from
+    spectralAmplitude, at O(N**2 log N) cost. The transform is done in
+    stages, a real FFT along the rows, then along the columns an FFT, the
+    filter and an inverse FFT, then an inverse real FFT along the rows, so
+    that it can be split between processes by rows and columns with the
+    same numbers (see domainDecomposition).
+
+    '''
+    spectrum = np.fft.rfft(noise,axis=1)
+    spectrum = np.fft.fft(spectrum,axis=0)
+    spectrum *= amplitude
+    spectrum = np.fft.ifft(spectrum,axis=0)
+    return np.fft.irfft(spectrum,n=noise.shape[1],axis=1)
+
+class randomVelocityFields(object):
+    '''
+    This class provides the random velocity fields (randVel1, randVel2) that
+    are switched in every randVelSwitch time units. The field with switch
+    index ind is drawn from its own counter-based generator (Philox keyed by
+    the seed and ind), so fields are made only when they are asked for, any
+    process with the same seed gets the same sequence of fields, and the
+    global numpy random state is never touched. Every row of the white noise
+    behind a field has its own stream of that generator (see noiseRows), so
+    a process can draw just some rows of a field. The two most recently used
+    fields are cached, so the continuous-in-time random velocity, which needs
+    fields ind and ind+1, never draws a field twice. 
+    
+    By default the fields are white noise in every grid cell. If 
+    correlationLength is given, they are Gaussian random fields with that 
+    correlation length (periodic on the grid), which do not depend on the 
+    grid resolution.
+
+    '''
+
+    def __init__(self,seed,shape,randVelMag,h=1.0,correlationLength=None,spectrum='gaussian',cacheSize=2):
+        '''
+        seed is a nonnegative integer smaller than 2**64, or None for a
+        random seed (stored in self.seed so that the run can be repeated).
+        shape is the shape of the computational grid (tuple).
+        randVelMag is the standard deviation of the random velocity.
+        h is the grid spacing, and correlationLength and spectrum are passed
+        to spectralAmplitude.
+
+        '''
+        if seed is None:
+            seed = int(np.random.SeedSequence().generate_state(1,np.uint64)[0])
+        self.seed = int(seed)
+        self.shape = shape
+        self.randVelMag = randVelMag
+        self.cacheSize = cacheSize
+        self._cache = [] # list of (ind,(randVel1,randVel2)), most recent last
+        self.numFieldsMade = 0
+        if correlationLength is None:
+            self.amplitude = None
+        else:
+            self.amplitude = spectralAmplitude(shape,h,correlationLength,spectrum)
+
+    def noiseRows(self,ind,component,r0,r1):
+        '''
+        Returns rows r0:r1 of the white noise behind component (0 for
+        randVel1, 1 for randVel2) of the field with switch index ind. Each
+        row is drawn from its own counter range of the Philox generator of
+        ind, so
+        the rows are the same whichever process draws them and whatever
+        rows it draws with them.
+
+        '''
+        noise = np.empty((r1-r0,self.shape[1]))
+        bitGenerator = np.random.Philox(key=self.seed*2**64 + int(ind))
+        rng = np.random.Generator(bitGenerator)
+        # restarting one generator is cheaper than making one per row
+        state = bitGenerator.state
+        for r in range(r0,r1):
+            state['state']['counter'] = np.array([0,0,r,component],dtype=np.uint64)
+            bitGenerator.state = state
+            rng.standard_normal(out=noise[r-r0])
+        return noise
+
+    def _makeFields(self,ind):
+        fields = []
+        for component in [0,1]:
+            noise = self.noiseRows(ind,component,0,self.shape[0])
+            if self.amplitude is not None:
+                noise = filterNoise(noise,self.amplitude)
+            noise *= self.randVelMag
+            fields.append(noise)
+        self.numFieldsMade += 1
+        return tuple(fields)
+
+    def reset(self,seed=None):
+        '''
+        Drops the cached fields, and sets a new seed if one is given; the
+        cache must be dropped whenever the seed changes.
+
+        '''
+        if seed is not None:
+            self.seed = int(seed)
+        self._cache = []
+
+    def fields(self,ind):
+        '''
+        Returns the arrays randVel1, randVel2 for switch index ind. The arrays
+        are shared with the cache and must not be modified in place.
+
+        '''
+        ind = int(ind)
+        for k,(cachedInd,cachedFields) in enumerate(self._cache):
+            if cachedInd == ind:
+                self._cache.append(self._cache.pop(k))
+                return cachedFields
+        newFields = self._makeFields(ind)
+        self._cache.append((ind,newFields))
+        if len(self._cache) > self.cacheSize:
+            self._cache.pop(0)
+        return newFields
+
@@ -0,0 +1,249 @@
+import numpy as np
+import json
+import os
+
+captureColumns = [('whichhost',np.int64),('finalPosx',np.float64),('finalPosy',np.float64),('flightTime',np.float64),('agentId',np.int64)]
+
+def loadResults(path):
+    '''
+    Memory-maps the capture results written by a captureBuffer to the
+    directory path. Returns a dictionary of read-only arrays, one per column.
+
+    '''
+    with open(os.path.join(path,'index.json')) as f:
+        index = json.load(f)
+    results = {}
+    for name,dtype in index['columns']:
+        if index['numRows'] == 0:
+            results[name] = np.zeros(0,dtype=dtype)
+        else:
+            results[name] = np.memmap(os.path.join(path,name+'.bin'),dtype=dtype,mode='r',shape=(index['numRows'],))
+    return results
+
+
+class captureBuffer(object):
+    '''
+    This class collects capture events (one row per mosquito that found a
+    host) in typed numpy buffers. Without a path the buffers simply grow.
+    With a path, every chunkSize rows are appended to one raw binary file per
+    column in that directory and the row count is recorded in index.json, so
+    memory stays bounded however many captures there are, and the columns
+    can be memory-mapped with loadResults. The index is only updated after
+    the data is written, so a run killed mid-write leaves a readable file.
+    Writing to a directory that already holds results appends to them (call
+    clear to start afresh). results[name] returns the whole column (flushed and buffered rows).
+
+    '''
+
+    def __init__(self,path=None,chunkSize=65536,columns=captureColumns):
+        self.path = path
+        self.columns = [(name,np.dtype(dtype)) for name,dtype in columns]
+        self.buffers = dict((name,np.empty(chunkSize,dtype=dtype)) for name,dtype in self.columns)
+        self.numBuffered = 0
+        self.numFlushed = 0
+        if path is not None:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            if os.path.exists(os.path.join(path,'index.json')):
+                with open(os.path.join(path,'index.json')) as f:
+                    self.numFlushed = json.load(f)['numRows']
+            # drop anything written after the last index update
+            for name,dtype in self.columns:
+                with open(os.path.join(path,name+'.bin'),'ab') as f:
+                    f.truncate(self.numFlushed*dtype.itemsize)
+            self._writeIndex()
+
+    def __len__(self):
+        return self.numFlushed + self.numBuffered
+
+    def __getitem__(self,name):
+        buffered = self.buffers[name][:self.numBuffered]
+        if self.numFlushed == 0:
+            return buffered.copy()
+        return np.concatenate([loadResults(self.path)[name],buffered])
+
+    def append(self,**values):
+        '''
+        Appends rows. Keyword arguments are column names, and all values are
+        arrays (or lists) of the same length.
+
+        '''
+        values = dict((name,np.asarray(values[name])) for name,_ in self.columns)
+        numRows = len(values[self.columns[0][0]])
+        start = 0
+        while start < numRows:
+            capacity = len(self.buffers[self.columns[0][0]])
+            if self.numBuffered == capacity:
+                if self.path is None:
+                    for name,_ in self.columns:
+                        self.buffers[name] = np.concatenate([self.buffers[name],np.empty_like(self.buffers[name])])
+                    capacity *= 2
+                else:
+                    self.flush()
+            take = min(capacity - self.numBuffered,numRows - start)
+            for name,_ in self.columns:
+                self.buffers[name][self.numBuffered:self.numBuffered+take] = values[name][start:start+take]
+            self.numBuffered += take
+            start += take
+
+    def flush(self):
+        '''
+        Writes the buffered rows to disk (if there is a path).
+
+        '''
+        if self.path is None or self.numBuffered == 0:
+            return
+        for name,_ in self.columns:
+            with open(os.path.join(self.path,name+'.bin'),'ab') as f:
+                self.buffers[name][:self.numBuffered].tofile(f)
+        self.numFlushed += self.numBuffered
+        self.numBuffered = 0
+        self._writeIndex()
+
+    close = flush
+
+    def clear(self):
+        '''
+        Discards every row, including those already on disk.
+
+        '''
+        self.restoreState(dict([('numFlushed',0)] + [(name,np.zeros(0,dtype=dtype)) for name,dtype in self.columns]))
+
+    def checkpointState(self):
+        '''
+        Returns the number of rows on disk and the buffered rows, for 
+        checkpoints (see checkpoint.py).
+
+        '''
+        state = {'numFlushed':np.array(self.numFlushed)}
+        for name,_ in self.columns:
+            state[name] = self.buffers[name][:self.numBuffered]
+        return state
+
+    def restoreState(self,state):
+        '''
+        Goes back to a state returned by checkpointState, dropping any rows
+        written to disk since.
+
+        '''
+        self.numFlushed = int(state['numFlushed'])
+        if self.path is not None:
+            for name,dtype in self.columns:
+                with open(os.path.join(self.path,name+'.bin'),'ab') as f:
+                    f.truncate(self.numFlushed*dtype.itemsize)
+            self._writeIndex()
+        self.numBuffered = 0
+        self.append(**dict((name,state[name]) for name,_ in self.columns))
+
+    def _writeIndex(self):
+        tmp = os.path.join(self.path,'index.json.tmp')
+        with open(tmp,'w') as f:
+            json.dump({'columns':[(name,dtype.str) for name,dtype in self.columns],'numRows':self.numFlushed},f)
+        os.replace(tmp,os.path.join(self.path,'index.json'))
+
+
+trajectoryColumns = [('time',np.float64),('agentId',np.int64),('posx',np.float64),('posy',np.float64)]
+
+class trajectoryRecorder(object):
+    '''
+    This class records flight paths: the position of every agentStride-th
+    mosquito (by agent id) at every decimation-th decision. Rows go into 
+    preallocated buffers of bufferSize rows. Without a path the buffers are
+    a ring that keeps the most recent bufferSize rows. With a path, full 
+    buffers are spilled to disk through a captureBuffer, so memory stays 
+    bounded and the paths can be memory-mapped with loadResults. 
+    recorder[name] returns a whole column in the order recorded.
+
+    '''
+
+    def __init__(self,path=None,decimation=1,agentStride=1,bufferSize=65536,columns=trajectoryColumns):
+        self.decimation = int(decimation)
+        self.agentStride = int(agentStride)
+        self.numCalls = 0
+        if path is not None:
+            self.ring = None
+            self.spill = captureBuffer(path,chunkSize=bufferSize,columns=columns)
+        else:
+            self.ring = captureBuffer(None,chunkSize=bufferSize,columns=columns)
+            self.numRecorded = 0
+
+    def __len__(self):
+        if self.ring is None:
+            return len(self.spill)
+        return min(self.numRecorded,len(self.ring.buffers[self.ring.columns[0][0]]))
+
+    def __getitem__(self,name):
+        if self.ring is None:
+            return self.spill[name]
+        buf = self.ring.buffers[name]
+        if self.numRecorded <= len(buf):
+            return buf[:self.numRecorded].copy()
+        start = self.numRecorded % len(buf)
+        return np.concatenate([buf[start:],buf[:start]])
+
+    def record(self,currentTime,agentId,posx,posy):
+        '''
+        Called by the population at every decision with the active mosquitoes' 
+        agent ids and positions; keeps the rows selected by decimation and
+        agentStride.
+
+        '''
+        self.numCalls += 1
+        if (self.numCalls - 1) % self.decimation != 0:
+            return
+        if self.agentStride > 1:
+            keep = np.nonzero(agentId % self.agentStride == 0)[0]
+            agentId, posx, posy = agentId[keep], posx[keep], posy[keep]
+        values = {'time':np.full(len(agentId),currentTime),'agentId':agentId,'posx':posx,'posy':posy}
+        if self.ring is None:
+            self.spill.append(**values)
+            return
+        # write around the ring; only the last capacity rows can survive
+        capacity = len(self.ring.buffers['time'])
+        numRows = len(agentId)
+        skip = max(0,numRows - capacity)
+        where = (self.numRecorded + skip + np.arange(numRows - skip)) % capacity
+        for name,_ in self.ring.columns:
+            self.ring.buffers[name][where] = values[name][skip:]
+        self.numRecorded += numRows
+
+    def close(self):
+        if self.ring is None:
+            self.spill.close()
+
+    def clear(self):
+        '''
+        Discards every recorded row, including those already on disk.
+
+        '''
+        self.numCalls = 0
+        if self.ring is None:
+            self.spill.clear()
+        else:
+            self.numRecorded = 0
+
+    def checkpointState(self):
+        '''
+        Returns the recorded (and, with a path, not yet spilled) rows and the
+        decimation counter, for checkpoints (see checkpoint.py).
+
+        '''
+        if self.ring is None:
+            state = self.spill.checkpointState()
+        else:
+            state = dict((name,self[name]) for name,_ in self.ring.columns)
+            state['numRecorded'] = np.array(self.numRecorded)
+        state['numCalls'] = np.array(self.numCalls)
+        return state
+
+    def restoreState(self,state):
+        self.numCalls = int(state['numCalls'])
+        if self.ring is None:
+            self.spill.restoreState(state)
+            return
+        capacity = len(self.ring.buffers['time'])
+        self.numRecorded = int(state['numRecorded'])
+        numRows = len(state['time'])
+        where = (self.numRecorded - numRows + np.arange(numRows)) % capacity
+        for name,_ in self.ring.columns:
+            self.ring.buffers[name][where] = state[name]
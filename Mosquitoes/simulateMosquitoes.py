@@ -3,6 +3,10 @@
 import numpy as np
 import environment
 import mosquito
+import checkpoint
+import profiling
+import windFields
+import os
 
 def setHosts():
     pass
@@ -10,35 +14,114 @@ def setHosts():
 def setMosqs():
     pass
 
-def saveResults():
+# Directory the capture events are streamed to (see resultsWriter). A fresh 
+# run replaces any results already there; a run resumed from a checkpoint
+# appends to them. Analysis code can memory-map it with 
+# resultsWriter.loadResults.
+resultsPath = 'results'
+
+def saveResults(mosqPop):
     # save AND print results
-    pass
+    mosqPop.results.close()
+    captured = mosqPop.strategies[mosqPop.results['agentId'] - mosqPop.firstAgentId]
+    for name,code in sorted(mosqPop.strategyCodes.items(),key=lambda a:a[1]):
+        print('{}: {} of {} mosquitoes found a host'.format(name,np.sum(captured == code),np.sum(mosqPop.strategies == code)))
+    print('Results written to {}'.format(resultsPath))
+
+# Grid and seed of the random wind of the environment. The seed makes runs
+# repeatable, and the plume archive and spin-up cache below need it.
+simsParams = {'domainLength':100.0,'numGridPoints':128,'seed':1}
+
+# Directory of recorded CO2 plumes (see environment.recordPlume). If None, the
+# plume is solved during the run. Otherwise the plume is solved and recorded 
+# once and replayed for every later run with the same environment parameters.
+plumeArchive = None
+
+# File the run is checkpointed to every checkpointInterval time units (see 
+# checkpoint.py). If the file exists when the run starts and was written by 
+# a run with the same parameters, hosts and wind, the run resumes from it and
+# gives exactly the results of an uninterrupted run; otherwise it is ignored
+# (and overwritten). The file is removed when the run completes. Set 
+# checkpointPath to None to turn checkpointing off.
+checkpointPath = 'checkpoint.npz'
+checkpointInterval = 500.0
+
+# If True, time the phases of every step (see profiling.phaseProfiler) and 
+# print and save a summary at the end; traceAllocations adds tracemalloc 
+# peak allocations per phase (slow).
+profile = False
+traceAllocations = False
+profilePath = 'profile.json'
+
+# Directory of CO2 snapshots at the mosquito release time (see 
+# environment.warmStart). If set, the plume spin-up before release is solved
+# once and loaded by later runs with the same seed (see simsParams).
+spinUpCache = None
+
+# Directory of a time dependent bulk wind written by 
+# windFields.saveGriddedWind, on the grid of the environment. If None, the 
+# constant bulk wind environment.constantVel is used.
+windPath = None
 
 xc,yc = setHosts()
-environ = environment.environment(x,y)
+if windPath is None:
+    wind = environment.constantVel
+else:
+    wind = windFields.loadGriddedWind(windPath,simsParams['domainLength']/simsParams['numGridPoints'])
+if plumeArchive is None:
+    environ = environment.environment(x,y,velocityFunctionHandle=wind,**simsParams)
+else:
+    environment.recordPlume(environment.environment(x,y,velocityFunctionHandle=wind,**simsParams),plumeArchive)
+    environ = environment.replayEnvironment(plumeArchive,x,y,velocityFunctionHandle=wind,**simsParams)
 initPosx = setMosqs()
-mosqUpwindPop = mosquito.upwind(environ,initPosx)
-mosqDownwindPop = mosquito.downwind(environ,initPosx)
-mosqCrosswindPop = mosquito.crosswind(environ,initPosx)
+# one population holding every plume finding strategy, each starting from initPosx
+strategies = ['upwind','downwind','crosswind']
+mosqPop = mosquito.mixedStrategies(environ,np.tile(initPosx,len(strategies)),np.repeat(strategies,len(initPosx)),resultsPath=resultsPath)
 dt = environ.simsParams['dt']
+# times are indexed by step so that a resumed run sees exactly the same t
+times = np.arange(environ.simsParams['initialTime'],environ.simsParams['finalTime'],dt)
+checkpointSteps = max(1,int(round(checkpointInterval/dt)))
+startStep = 0
+if profile:
+    profiler = profiling.phaseProfiler(traceAllocations)
+    profiling.attach(profiler,environ,[mosqPop])
+resume = checkpointPath is not None and os.path.exists(checkpointPath)
+if resume and not checkpoint.checkpointMatches(checkpointPath,environ,[mosqPop]):
+    print('Ignoring {}, which is from a run with other parameters.'.format(checkpointPath))
+    resume = False
+if resume:
+    startStep = checkpoint.loadCheckpoint(checkpointPath,environ,[mosqPop]) + 1
+else:
+    # a fresh run replaces the results of any earlier run
+    mosqPop.results.clear()
+    if spinUpCache is not None and plumeArchive is None:
+        startStep = environment.warmStart(environ,spinUpCache,mosqPop.mosqParams['startTime'])
+stopsim = False
 
-for t in np.arange(environ.simsParams['initialTime'],environ.simsParams['finalTime'],dt):
+for k in range(startStep,len(times)):
+    t = times[k]
 
     environ.updateEnvironment(t)
     if t%1.0 < dt/2.0:
-        mosqUpwindPop.updatePosition(environ,t)
-        mosqDownwindPop.updatePosition(environ,t)
-        mosqCrosswindPop.updatePosition(environ,t)
-        if mosqUpwindPop.stopSimulation and mosqDownwindPop.stopSimulation and mosqCrosswindPop.stopSimulation:
-            saveResults()
+        mosqPop.updatePosition(environ,t)
+        if mosqPop.stopSimulation(environ):
+            saveResults(mosqPop)
             stopsim = True
             break
-        else:
-            stopsim = False
+    if checkpointPath is not None and (k+1)%checkpointSteps == 0:
+        checkpoint.saveCheckpoint(checkpointPath,k,environ,[mosqPop])
 
 if not stopsim:
     print('Not all mosquitoes are out of the domain.')
-    saveResults()
+    saveResults(mosqPop)
 
+# the run is complete, so the next one must not resume from it
+if checkpointPath is not None and os.path.exists(checkpointPath):
+    os.remove(checkpointPath)
 
+if environ.simsParams['steadyStateTol'] is not None:
+    print('CO2 at steady state (not solved) for {} of {} time steps.'.format(environ.numSkippedSteps,len(times)-startStep))
 
+if profile:
+    profiler.report()
+    profiler.save(profilePath)
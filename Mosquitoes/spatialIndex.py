@@ -0,0 +1,85 @@
+import numpy as np
+
+class hostBuckets(object):
+    '''
+    This class is a uniform bucket grid over the host positions, built once
+    so that finding the hosts near every mosquito is a single vectorized
+    query instead of a loop over mosquitoes and hosts. Hosts are sorted into
+    square buckets of side bucketSize and stored in compressed (CSR) form:
+    hostOrder holds the host ids sorted by bucket, and the hosts of flat 
+    bucket b are hostOrder[offsets[b]:offsets[b+1]]. Memory is linear in
+    the number of hosts however they are clustered.
+
+    '''
+
+    def __init__(self,hostPositionx,hostPositiony,bucketSize):
+        self.hostPositionx = np.asarray(hostPositionx,dtype=float)
+        self.hostPositiony = np.asarray(hostPositiony,dtype=float)
+        self.bucketSize = float(bucketSize)
+        bi = np.floor(self.hostPositionx/self.bucketSize).astype(int)
+        bj = np.floor(self.hostPositiony/self.bucketSize).astype(int)
+        if len(bi) == 0:
+            self.imin, self.jmin = 0, 0
+            self.numBuckets = (1,1)
+            self.hostOrder = np.zeros(0,dtype=int)
+            self.offsets = np.zeros(2,dtype=int)
+            return
+        # buckets are counted from the lower left host
+        self.imin, self.jmin = bi.min(), bj.min()
+        bi -= self.imin
+        bj -= self.jmin
+        self.numBuckets = (bi.max()+1, bj.max()+1)
+        flat = np.ravel_multi_index((bi,bj),self.numBuckets)
+        self.hostOrder = np.argsort(flat,kind='stable')
+        self.offsets = np.zeros(self.numBuckets[0]*self.numBuckets[1]+1,dtype=int)
+        np.cumsum(np.bincount(flat,minlength=self.numBuckets[0]*self.numBuckets[1]),out=self.offsets[1:])
+
+    def candidatePairs(self,x,y,radius):
+        '''
+        Returns two integer arrays of equal length, the index into x and the
+        host id of every (position, host) pair that could be closer than
+        radius, i.e. every host in the buckets near each (x,y).
+
+        '''
+        rings = int(np.ceil(radius/self.bucketSize))
+        offsets = np.arange(-rings,rings+1)
+        di,dj = [a.ravel() for a in np.meshgrid(offsets,offsets,indexing='ij')]
+        ci = np.floor(x/self.bucketSize).astype(int)[:,np.newaxis] - self.imin + di
+        cj = np.floor(y/self.bucketSize).astype(int)[:,np.newaxis] - self.jmin + dj
+        valid = (ci >= 0) & (ci < self.numBuckets[0]) & (cj >= 0) & (cj < self.numBuckets[1])
+        point = np.nonzero(valid)[0]
+        bucket = ci[valid]*self.numBuckets[1] + cj[valid]
+        first = self.offsets[bucket]
+        count = self.offsets[bucket+1] - first
+        # expand every (position, bucket) pair into its hosts
+        total = np.sum(count)
+        shift = np.repeat(first - (np.cumsum(count) - count),count)
+        return np.repeat(point,count), self.hostOrder[np.arange(total) + shift]
+
+    def nearestWithin(self,x,y,radius):
+        '''
+        Finds every (x,y) that is closer than radius to a host.
+        x, y are numpy arrays of positions in the x and y directions.
+        Returns the indices into x of those positions and the id (index into
+        the host position arrays) of the nearest host to each (the lowest id
+        among equally near hosts).
+
+        '''
+        x = np.asarray(x,dtype=float)
+        y = np.asarray(y,dtype=float)
+        point, host = self.candidatePairs(x,y,radius)
+        dx = self.hostPositionx[host] - x[point]
+        dy = self.hostPositiony[host] - y[point]
+        dist = dx*dx + dy*dy
+        # cheap squared distance filter, then the exact test on the few left
+        near = np.nonzero(dist < radius*radius*(1+1.e-12))[0]
+        dist = np.sqrt(dist[near])
+        keep = dist < radius
+        point, host, dist = point[near[keep]], host[near[keep]], dist[keep]
+        if len(point) == 0:
+            return point, host
+        # pairs are grouped by position; take the nearest (then lowest id) host of each group
+        starts = np.nonzero(np.r_[True,point[1:] != point[:-1]])[0]
+        group = np.cumsum(np.r_[False,point[1:] != point[:-1]])
+        nearest = dist == np.minimum.reduceat(dist,starts)[group]
+        return point[starts], np.minimum.reduceat(np.where(nearest,host,len(self.hostPositionx)),starts)
@@ -0,0 +1,151 @@
+import environment
+import mosquito
+import checkpoint
+import numpy as np
+import os
+import shutil
+import tempfile
+import time
+
+def makeRun(resultsPath,adaptive):
+    environ = environment.environment(np.array([30.0,70.0]),np.array([40.0,60.0]),numGridPoints=64,finalTime=120.0,dt=0.5,adaptiveTimeStep=adaptive,seed=77)
+    np.random.seed(4411)
+    initPosx = 100*np.random.rand(200)
+    strategies = ['upwind','downwind','crosswind']
+    pop = mosquito.mixedStrategies(environ,np.tile(initPosx,3),np.repeat(strategies,200),startTime=20.0,resultsPath=resultsPath)
+    return environ, pop
+
+def runSteps(environ,pop,times,steps,checkpointPath=None,checkpointStep=None):
+    dt = environ.simsParams['dt']
+    for k in steps:
+        t = times[k]
+        environ.updateEnvironment(t)
+        if t%1.0 < dt/2.0 and t >= pop.mosqParams['startTime']:
+            pop.updatePosition(environ,t)
+        if k == checkpointStep:
+            checkpoint.saveCheckpoint(checkpointPath,k,environ,[pop])
+
+def testresume(adaptive=False):
+    '''
+    A run checkpointed partway, continued past the checkpoint (as if it
+    were killed later) and then resumed from the checkpoint in a fresh
+    process state should give bit-identical CO2, mosquito positions and
+    capture results to a run that was never interrupted.
+
+    '''
+    path = tempfile.mkdtemp()
+    try:
+        environ, pop = makeRun(os.path.join(path,'ref'),adaptive)
+        times = np.arange(environ.simsParams['initialTime'],environ.simsParams['finalTime'],environ.simsParams['dt'])
+        runSteps(environ,pop,times,range(len(times)))
+        pop.results.close()
+        ckpt = os.path.join(path,'checkpoint.npz')
+        environ2, pop2 = makeRun(os.path.join(path,'run'),adaptive)
+        runSteps(environ2,pop2,times,range(len(times)*2//3),ckpt,len(times)//3)
+        pop2.results.flush()
+        np.random.seed(0)
+        environ3, pop3 = makeRun(os.path.join(path,'run'),adaptive)
+        start = checkpoint.loadCheckpoint(ckpt,environ3,[pop3]) + 1
+        runSteps(environ3,pop3,times,range(start,len(times)))
+        pop3.results.close()
+        same = np.array_equal(environ.CO2,environ3.CO2) and np.array_equal(pop.state[:,:pop.numActive],pop3.state[:,:pop3.numActive])
+        same = same and all(np.array_equal(pop.results[name],pop3.results[name]) for name,_ in pop.results.columns)
+        print('Adaptive time step {}: {} captures, resumed run bit-identical? (It should be.) {}'.format(adaptive,len(pop.results),same))
+        print('Checkpoint size: {:.1f} kB'.format(os.path.getsize(ckpt)/1024.))
+    finally:
+        shutil.rmtree(path)
+
+def testmismatch():
+    '''
+    A checkpoint should only be accepted by the run that wrote it: a run
+    with other parameters, hosts or wind should refuse it, even with a time
+    dependent gridded wind whose current fields have moved on.
+
+    '''
+    import windFields
+    path = tempfile.mkdtemp()
+    try:
+        ckpt = os.path.join(path,'checkpoint.npz')
+        windFields.saveGriddedWind(os.path.join(path,'wind'),[0.0,120.0],np.zeros((2,64,64)),np.stack([0.1*np.ones((64,64)),0.3*np.ones((64,64))]))
+        wind = lambda: windFields.loadGriddedWind(os.path.join(path,'wind'),100.0/64)
+        makeEnviron = lambda **kwargs: environment.environment(np.array([30.0,70.0]),np.array([40.0,60.0]),numGridPoints=64,finalTime=120.0,dt=0.5,seed=77,**kwargs)
+        makePop = lambda environ,**kwargs: mosquito.mixedStrategies(environ,np.tile(np.linspace(10,90,20),3),np.repeat(['upwind','downwind','crosswind'],20),startTime=20.0,**kwargs)
+        environ = makeEnviron(velocityFunctionHandle=wind())
+        pop = makePop(environ)
+        times = np.arange(0.0,60.0,0.5)
+        runSteps(environ,pop,times,range(len(times)),ckpt,len(times)-1)
+        others = [('same run',makeEnviron(velocityFunctionHandle=wind()),{}),
+                  ('other wind',makeEnviron(),{}),
+                  ('other seed',environment.environment(np.array([30.0,70.0]),np.array([40.0,60.0]),numGridPoints=64,finalTime=120.0,dt=0.5,seed=78,velocityFunctionHandle=wind()),{}),
+                  ('other mosquito parameters',makeEnviron(velocityFunctionHandle=wind()),{'CO2Thresh':0.02})]
+        for name,environ2,kwargs in others:
+            pop2 = makePop(environ2,**kwargs)
+            try:
+                checkpoint.loadCheckpoint(ckpt,environ2,[pop2])
+                loaded = True
+            except ValueError:
+                loaded = False
+            print('{}: checkpoint matches? {}; loaded? {} (Both should be {}.)'.format(name,checkpoint.checkpointMatches(ckpt,environ2,[pop2]),loaded,name == 'same run'))
+    finally:
+        shutil.rmtree(path)
+
+def testcoldwarm():
+    '''
+    As in simulateMosquitoes, a cold run calls updatePosition at every whole
+    time from the initial time and a warm run only from the spin-up 
+    snapshot at the release time on. Both should give exactly the same 
+    captures, since the mosquitoes do nothing before their start time.
+
+    '''
+    path = tempfile.mkdtemp()
+    try:
+        runs = []
+        for warm in [False,True]:
+            environ, pop = makeRun(None,False)
+            dt = environ.simsParams['dt']
+            times = np.arange(environ.simsParams['initialTime'],environ.simsParams['finalTime'],dt)
+            startStep = environment.warmStart(environ,path,pop.mosqParams['startTime']) if warm else 0
+            for t in times[startStep:]:
+                environ.updateEnvironment(t)
+                if t%1.0 < dt/2.0:
+                    pop.updatePosition(environ,t)
+            runs.append(pop)
+        cold, warm = runs
+        same = all(np.array_equal(cold.results[name],warm.results[name]) for name,_ in cold.results.columns)
+        print('Cold and warm runs: {} and {} captures; the same? (They should be.) {}'.format(len(cold.results),len(warm.results),same))
+    finally:
+        shutil.rmtree(path)
+
+def testwarmstart(spinUpTime=350.0):
+    '''
+    Starting from the cached spin-up snapshot should give exactly the CO2 of
+    an environment advanced from the initial time, whatever the final time,
+    and should be much faster than the spin-up itself.
+
+    '''
+    path = tempfile.mkdtemp()
+    try:
+        makeEnviron = lambda finalTime: environment.environment(np.array([30.0,70.0]),np.array([40.0,60.0]),finalTime=finalTime,seed=31)
+        environ = makeEnviron(400.0)
+        start = time.time()
+        numSteps = environment.warmStart(environ,path,spinUpTime)
+        cold = time.time() - start
+        environ2 = makeEnviron(1000.0)
+        start = time.time()
+        environment.warmStart(environ2,path,spinUpTime)
+        warm = time.time() - start
+        times = np.arange(0.0,400.0,environ.simsParams['dt'])
+        for t in times[numSteps:numSteps+20]:
+            environ.updateEnvironment(t)
+            environ2.updateEnvironment(t)
+        print('Spin-up to t = {} ({} steps): {:.2f} s, from cache {:.3f} s; same CO2 afterwards? (It should be.) {}'.format(spinUpTime,numSteps,cold,warm,np.array_equal(environ.CO2,environ2.CO2)))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    testresume(False)
+    testresume(True)
+    testmismatch()
+    testcoldwarm()
+    testwarmstart()
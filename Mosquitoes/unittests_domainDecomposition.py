@@ -0,0 +1,97 @@
+import environment
+import domainDecomposition as dD
+import numpy as np
+import os
+import signal
+import time
+
+def testidentical(N=96,numSteps=250,processCounts=(1,2,3,5)):
+    '''
+    The decomposed solve should give bit-identical CO2 to the single
+    process solve for any number of strips (including through random 
+    velocity switches, with white noise and with correlated fields drawn
+    row by row in the workers), and querySignal should read it unchanged.
+
+    '''
+    hostx, hosty = np.array([30.0,70.0,50.0]), np.array([40.0,60.0,20.0])
+    np.random.seed(77)
+    x, y = 100*np.random.rand(1000), 100*np.random.rand(1000)
+    for correlationLength in [None,5.0]:
+        serial = environment.environment(hostx,hosty,numGridPoints=N,seed=4,randVelSwitch=10.0,randVelCorrelationLength=correlationLength)
+        dt = serial.simsParams['dt']
+        for k in range(numSteps):
+            serial.updateEnvironment(k*dt)
+        for numProcesses in processCounts:
+            environ = dD.decomposedEnvironment(hostx,hosty,numProcesses,numGridPoints=N,seed=4,randVelSwitch=10.0,randVelCorrelationLength=correlationLength)
+            try:
+                for k in range(numSteps):
+                    environ.updateEnvironment(k*dt)
+                same = np.array_equal(serial.randVel1,environ.randVel1) and np.array_equal(serial.CO2,environ.CO2) and all(np.array_equal(a,b) for a,b in zip(serial.querySignal(x,y),environ.querySignal(x,y)))
+            finally:
+                environ.close()
+            print('Correlation length {}, {} processes: same CO2 and signal as one process? (It should be.) {}'.format(correlationLength,numProcesses,same))
+
+def testdeadworker(N=64,timeout=2.0):
+    '''
+    A worker that is killed, or that stops responding, should make the next
+    step raise RuntimeError (the first at once, the second after timeout
+    seconds) rather than hang, with the workers stopped and the CO2 kept.
+
+    '''
+    hostx, hosty = np.array([30.0,70.0]), np.array([40.0,60.0])
+    for name,signum in [('killed',signal.SIGKILL),('stopped',signal.SIGSTOP)]:
+        environ = dD.decomposedEnvironment(hostx,hosty,3,timeout=timeout,numGridPoints=N,seed=4)
+        try:
+            for k in range(10):
+                environ.updateEnvironment(k*environ.simsParams['dt'])
+            before = environ.CO2.copy()
+            os.kill(environ.workers[1].pid,signum)
+            time.sleep(0.1)
+            start = time.time()
+            try:
+                environ.updateEnvironment(10*environ.simsParams['dt'])
+                message = None
+            except RuntimeError as e:
+                message = str(e)
+            print('Worker {}: raised after {:.1f} s: {}; workers stopped and CO2 kept? (It should be.) {}'.format(name,time.time()-start,message,len(environ.workers) == 0 and np.array_equal(before,environ.CO2)))
+        finally:
+            environ.close()
+
+def testcleanup(N=32,timeout=1.0):
+    '''
+    The shared memory should be freed at the end of a with statement and
+    when an environment is dropped without close(), and workers left
+    waiting for more than timeout seconds should exit, with the next step
+    raising RuntimeError.
+
+    '''
+    hostx, hosty = np.array([30.0,70.0]), np.array([40.0,60.0])
+    shmExists = lambda names: [os.path.exists('/dev/shm/'+name) for name in names]
+    with dD.decomposedEnvironment(hostx,hosty,2,numGridPoints=N,seed=4) as environ:
+        environ.updateEnvironment(0.0)
+        names = [shm.name for shm in environ.blocks.values()]
+    print('Shared memory freed after with? (It should be.) {}'.format(not any(shmExists(names))))
+    environ = dD.decomposedEnvironment(hostx,hosty,2,numGridPoints=N,seed=4)
+    environ.updateEnvironment(0.0)
+    names = [shm.name for shm in environ.blocks.values()]
+    workers = list(environ.workers)
+    del environ
+    print('Shared memory freed and workers stopped after del? (It should be.) {}'.format(not any(shmExists(names)) and not any(p.is_alive() for p in workers)))
+    environ = dD.decomposedEnvironment(hostx,hosty,2,timeout=timeout,numGridPoints=N,seed=4)
+    try:
+        environ.updateEnvironment(0.0)
+        time.sleep(timeout+1.0)
+        try:
+            environ.updateEnvironment(environ.simsParams['dt'])
+            message = None
+        except RuntimeError as e:
+            message = str(e)
+        print('Idle workers: {}; workers stopped? (It should be.) {}'.format(message,message is not None and len(environ.workers) == 0))
+    finally:
+        environ.close()
+
+if __name__ == '__main__':
+    testidentical()
+    testdeadworker()
+    testcleanup()
+    dD.strongScaling(N=1024,processCounts=(1,2,4),numSteps=30)
@@ -0,0 +1,228 @@
+import environment
+import numpy as np
+import os
+import shutil
+import tempfile
+import time
+
+def runPlume(finalTime,numGridPoints=64,**kwargs):
+    environ = environment.environment(np.array([30.0,70.0]),np.array([40.0,60.0]),numGridPoints=numGridPoints,finalTime=finalTime,seed=8,**kwargs)
+    start = time.time()
+    for t in np.arange(environ.simsParams['initialTime'],finalTime,environ.simsParams['dt']):
+        environ.updateEnvironment(t)
+    return environ, time.time() - start
+
+def teststeadystate(finalTime=1500.0,tol=1.e-6):
+    '''
+    Without random wind the plume converges, so the monitor should skip most
+    steps and leave the CO2 within about tol*(remaining time) (relative) of
+    the fully solved field. With random wind every switch brings new fields,
+    so the result should be identical to the full solve.
+
+    '''
+    for randVelMag in [0.0,0.375*0.2]:
+        full, tfull = runPlume(finalTime,randVelMag=randVelMag)
+        frozen, tfrozen = runPlume(finalTime,randVelMag=randVelMag,steadyStateTol=tol)
+        err = np.max(np.abs(full.CO2 - frozen.CO2))/np.max(np.abs(full.CO2))
+        print('randVelMag {}: skipped {} of {} steps, {:.2f} s instead of {:.2f} s, relative difference {:.2e}'.format(randVelMag,frozen.numSkippedSteps,int(round(finalTime/full.simsParams['dt'])),tfrozen,tfull,err))
+
+def testintegrators(N=128,finalTime=200.0,refdt=0.02):
+    '''
+    Prints the error (relative to forward Euler with a small time step) and 
+    the run time of every integrator at several time steps. Forward Euler 
+    and RK4 are only run where the CFL condition allows. The implicit 
+    integrators stay stable at any dt and factorize once per random velocity
+    field, so their cost per step stays close to one sparse solve.
+
+    '''
+    ref, tref = runPlume(finalTime,numGridPoints=N,dt=refdt)
+    environ = environment.environment(np.array([30.0,70.0]),np.array([40.0,60.0]),numGridPoints=N,seed=8)
+    environ._switchRandVel(0)
+    maxdt = environ._maxStableTimeStep()/environ.simsParams['CFL']
+    print('Reference: forward Euler dt = {} ({:.1f} s); CFL limit dt ~ {:.2f}'.format(refdt,tref,maxdt))
+    for integrator in ['forwardEuler','explicitRK4','sspRK2','sspRK3','lowStorageRK4','backwardEuler','crankNicolson']:
+        for dt in [0.1,0.5,1.0,2.0,4.0]:
+            if integrator not in ['backwardEuler','crankNicolson'] and dt > maxdt:
+                continue
+            environ, t = runPlume(finalTime,numGridPoints=N,dt=dt,integrator=integrator)
+            err = np.max(np.abs(environ.CO2 - ref.CO2))/np.max(np.abs(ref.CO2))
+            print('{:14s} dt = {}: relative error {:.2e}, {:.2f} s ({:.0f} simulated time units/s)'.format(integrator,dt,err,t,finalTime/t))
+
+def testrkmemory(N=256,numSteps=20):
+    '''
+    Prints the peak memory allocated during a time step and the steps per 
+    second of explicitRK4 and of forward Euler and the low-storage 
+    integrators, which work in place and should allocate (almost) nothing 
+    after their first step.
+
+    '''
+    import tracemalloc
+    for integrator in ['forwardEuler','explicitRK4','sspRK2','sspRK3','lowStorageRK4']:
+        environ = environment.environment(np.array([30.0,70.0]),np.array([40.0,60.0]),numGridPoints=N,seed=8,integrator=integrator)
+        environ.updateEnvironment(0.0)
+        tracemalloc.start()
+        environ.updateEnvironment(environ.simsParams['dt'])
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        start = time.time()
+        for k in range(numSteps):
+            environ.updateEnvironment((k+2)*environ.simsParams['dt'])
+        print('{:14s} {}x{} grid: peak allocation per step {:.2f} MB (grid array {:.2f} MB), {:.1f} steps/s'.format(integrator,N,N,peak/2.**20,N*N*8/2.**20,numSteps/(time.time()-start)))
+
+def testreplay(finalTime=60.0):
+    '''
+    A plume recorded with recordPlume and served by replayEnvironment should
+    give the same CO2 and signal at every decision time as the live solve,
+    across random velocity switches. An archive for other parameters should
+    be refused, and a partial archive left by a killed run should be 
+    recorded again.
+
+    '''
+    path = tempfile.mkdtemp()
+    try:
+        makeEnviron = lambda **kw: environment.environment(np.array([30.0,70.0]),np.array([40.0,60.0]),numGridPoints=64,finalTime=finalTime,seed=8,**kw)
+        archive = environment.recordPlume(makeEnviron(),path)
+        live = makeEnviron()
+        replay = environment.replayEnvironment(path,np.array([30.0,70.0]),np.array([40.0,60.0]),numGridPoints=64,finalTime=finalTime,seed=8)
+        np.random.seed(5)
+        x, y = 100*np.random.rand(500), 100*np.random.rand(500)
+        dt = live.simsParams['dt']
+        same = True
+        for t in np.arange(0.0,finalTime,dt):
+            live.updateEnvironment(t)
+            replay.updateEnvironment(t)
+            if t%1.0 < dt/2.0:
+                same = same and np.array_equal(live.CO2,replay.CO2) and all(np.array_equal(a,b) for a,b in zip(live.querySignal(x,y),replay.querySignal(x,y)))
+        print('Replayed plume same as the live solve at every decision time ({} random velocity switches)? (It should be.) {}'.format(int(finalTime//live.simsParams['randVelSwitch']),same))
+        try:
+            environment.replayEnvironment(path,np.array([30.0,70.0]),np.array([40.0,60.0]),numGridPoints=64,finalTime=finalTime,seed=9)
+            print('Archive for another seed refused? (It should be.) False')
+        except IOError:
+            print('Archive for another seed refused? (It should be.) True')
+        # a killed recording leaves only the partial directory behind
+        shutil.rmtree(archive)
+        os.makedirs(archive + '.partial')
+        open(os.path.join(archive + '.partial','CO2.npy'),'w').close()
+        environment.recordPlume(makeEnviron(),path)
+        again = np.load(os.path.join(archive,'CO2.npy'),mmap_mode='r')
+        print('Partial archive recorded again? (It should be.) {}'.format(not os.path.exists(archive + '.partial') and np.array_equal(again[-1],replay.archive['CO2'][-1])))
+    finally:
+        shutil.rmtree(path)
+
+def testensemble(numRealizations=3,finalTime=50.0):
+    '''
+    Each realization of an ensembleEnvironment should be exactly the plume of
+    a single environment seeded with its realizationSeeds entry, and 
+    querySignal should read each mosquito from its own realization.
+
+    '''
+    hostx, hosty = np.array([30.0,70.0]), np.array([40.0,60.0])
+    ensemble = environment.ensembleEnvironment(numRealizations,hostx,hosty,numGridPoints=64,seed=8)
+    serial = [environment.environment(hostx,hosty,numGridPoints=64,seed=seed) for seed in ensemble.realizationSeeds]
+    for t in np.arange(0.0,finalTime,ensemble.simsParams['dt']):
+        ensemble.updateEnvironment(t)
+        for environ in serial:
+            environ.updateEnvironment(t)
+    np.random.seed(6)
+    x, y = 100*np.random.rand(900), 100*np.random.rand(900)
+    realization = np.random.randint(numRealizations,size=900)
+    signal = ensemble.querySignal(x,y,realization)
+    for r,environ in enumerate(serial):
+        mine = realization == r
+        sameSignal = all(np.array_equal(a[mine],b) for a,b in zip(signal,environ.querySignal(x[mine],y[mine])))
+        print('Realization {}: same CO2 as the single environment? (It should be.) {}; same signal? (It should be.) {}'.format(r,np.array_equal(ensemble.CO2[r],environ.CO2),sameSignal))
+    print('Realizations differ from each other? (They should.) {}'.format(not np.array_equal(ensemble.CO2[0],ensemble.CO2[1])))
+
+def testadaptive(finalTime=200.0,dt=10.0,refdt=0.05):
+    '''
+    With adaptiveTimeStep each step of dt should take exactly as many 
+    forward Euler sub-steps as the CFL condition needs for the random 
+    velocity field in place, stay stable at a dt where fixed steps blow up,
+    and stay close to a fixed step run with a small dt.
+
+    '''
+    environ = environment.environment(np.array([30.0,70.0]),np.array([40.0,60.0]),numGridPoints=64,finalTime=finalTime,seed=8,dt=dt,adaptiveTimeStep=True)
+    matches = True
+    for t in np.arange(0.0,finalTime,dt):
+        before = environ.numSubSteps
+        environ.updateEnvironment(t)
+        # dt divides randVelSwitch, so each step sees a single field
+        matches = matches and environ.numSubSteps - before == int(np.ceil(dt/environ._maxStableTimeStep()))
+    print('dt = {}: {} sub-steps for {} steps; sub-steps per step set by the CFL condition? (It should be.) {}'.format(dt,environ.numSubSteps,int(finalTime/dt),matches))
+    fixed, _ = runPlume(finalTime,dt=dt)
+    print('Fixed steps of dt = {}: largest |CO2| {:.2e} (unstable)'.format(dt,np.max(np.abs(fixed.CO2))))
+    ref, _ = runPlume(finalTime,dt=refdt)
+    small, _ = runPlume(finalTime,dt=0.5)
+    for name,env in [('adaptive, dt = {}'.format(dt),environ),('fixed, dt = 0.5',small)]:
+        print('{}: largest |CO2| {:.3f}, relative difference from fixed dt = {}: {:.2e}'.format(name,np.max(np.abs(env.CO2)),refdt,np.max(np.abs(env.CO2 - ref.CO2))/np.max(np.abs(ref.CO2))))
+
+def testquerypacking(finalTime=50.0,integrator='sspRK3'):
+    '''
+    querySignal only refills its interleaved copy of the fields when they 
+    change, and for small queries gathers the CO2 separately. Small and large
+    queries at every decision time, across random velocity switches and with
+    an in-place integrator, should match interpolating the current fields 
+    directly, and the wind channels should be refilled once per switch.
+
+    '''
+    import lib_numericalMethods as nMeth
+    environ = environment.environment(np.array([30.0,70.0]),np.array([40.0,60.0]),numGridPoints=64,seed=8,randVelSwitch=10.0,integrator=integrator)
+    h = environ.simsParams['h']
+    np.random.seed(61)
+    points = [(h/2 + (100-h)*np.random.rand(M),h/2 + (100-h)*np.random.rand(M)) for M in [10,2000]]
+    err = 0.0
+    windFills = 0
+    for k,t in enumerate(np.arange(0.0,finalTime,environ.simsParams['dt'])):
+        environ.updateEnvironment(t)
+        if k % 10 == 9:
+            for x,y in points:
+                windKey = environ.packedKeys[0]
+                u,v,c = environ.querySignal(x,y)
+                windFills += windKey != environ.packedKeys[0]
+                ub,vb = environ.velfunc(x,y)
+                ur,vr,cr = nMeth.interpFromGrid(x,y,h,environ.randVel1,environ.randVel2,environ.CO2)
+                err = max(err,np.max(np.abs(u-ub-ur)),np.max(np.abs(v-vb-vr)),np.max(np.abs(c-cr)))
+    print('Largest difference from interpolating the current fields {:.1e} (round-off); wind channels refilled {} times for {} random velocity fields'.format(err,windFills,int(np.ceil(finalTime/environ.simsParams['randVelSwitch']))))
+    # the same points with the CO2 gathered separately and from a refill
+    x,y = points[0]
+    environ.plumeVersion += 1
+    separate = environ.querySignal(x,y)
+    environ.plumeVersion += 1
+    environ.CO2RepackFraction = 0.0
+    refilled = environ.querySignal(x,y)
+    print('Same signal with the CO2 gathered separately as from the refilled fields? (It should be.) {}'.format(all(np.array_equal(a,b) for a,b in zip(separate,refilled))))
+
+def testswitching(finalTime=200.0):
+    '''
+    The random wind should switch to field floor(t/randVelSwitch) at the 
+    first step starting at or after each switch time, also when dt does not
+    divide randVelSwitch, for every integrator, and adaptive sub-steps 
+    should stop at every switch, so each field is used exactly once.
+
+    '''
+    for kwargs in [{'dt':0.3},{'dt':0.3,'integrator':'sspRK3'},{'dt':0.3,'steadyStateTol':1.e-1},{'dt':7.0,'adaptiveTimeStep':True}]:
+        environ = environment.environment(np.array([30.0,70.0]),np.array([40.0,60.0]),numGridPoints=32,seed=8,**kwargs)
+        dt = environ.simsParams['dt']
+        switch = environ.simsParams['randVelSwitch']
+        used = []
+        inForce = True
+        for t in np.arange(0.0,finalTime,dt):
+            environ.updateEnvironment(t)
+            used.append(environ.randVelIndex)
+            # a fixed step uses the field in force at its start, an adaptive
+            # step ends with the field in force just before its end
+            end = t + dt*(1 - 1.e-9) if kwargs.get('adaptiveTimeStep') else t
+            inForce = inForce and environ.randVelIndex == int(np.floor(end/switch))
+        numFields = int(np.floor(t/switch)) + 1 if not kwargs.get('adaptiveTimeStep') else int(np.ceil((t + dt)/switch))
+        print('{}: fields 0 to {} used, {} fields in the run; the field in force at every step? (It should be.) {}'.format(kwargs,max(used),numFields,inForce and sorted(set(used)) == list(range(numFields))))
+
+
+if __name__ == '__main__':
+    teststeadystate()
+    testintegrators()
+    testrkmemory()
+    testreplay()
+    testensemble()
+    testadaptive()
+    testquerypacking()
+    testswitching()
@@ -0,0 +1,108 @@
+import environment
+import hostSources
+import lib_numericalMethods as nMeth
+import numpy as np
+import time
+
+def testsharedcells(numHosts=1000,N=128):
+    '''
+    Many hosts crowded into a few cells: extrapToGrid and the sparse source
+    should both add up every host in a cell, so the total source is the
+    total emission, and should agree with a host by host loop.
+
+    '''
+    np.random.seed(25)
+    x, y = 50 + 2*np.random.rand(numHosts), 50 + 2*np.random.rand(numHosts)
+    s = np.random.rand(numHosts)
+    h = 100.0/N
+    loop = np.zeros((N,N))
+    for k in range(numHosts):
+        i,j,nodes = nMeth._getIndicesNodes(x[k:k+1],y[k:k+1],h)
+        for (a,b),w in zip([(0,0),(0,1),(1,0),(1,1)],nodes):
+            loop[i[0]+a,j[0]+b] += w[0]*s[k]
+    source = hostSources.hostSource(x,y,s,h,(N,N))
+    for name,arr in [('extrapToGrid',nMeth.extrapToGrid(x,y,s,h,(N,N))),('hostSource',source.dense())]:
+        print('{}: total {:.6f} (emission {:.6f}), largest difference from the loop {:.1e}'.format(name,np.sum(arr),np.sum(s),np.max(np.abs(arr-loop))))
+    print('{} hosts touch {} cells'.format(numHosts,len(source.cells)))
+
+def testbreathing(finalTime=40.0):
+    '''
+    With breathing hosts the CO2 in the domain (before the plume reaches the
+    edge) should be exactly the emission summed over the time steps, and the
+    steady state monitor should never freeze the plume.
+
+    '''
+    environ = environment.environment(np.array([30.0,70.0]),np.array([40.0,60.0]),numGridPoints=64,seed=6,hostSourceHandle=environment.breathingSourceStrength(seed=1),steadyStateTol=1.e-3)
+    dt = environ.simsParams['dt']
+    emitted = 0.0
+    for t in np.arange(0.0,finalTime,dt):
+        environ.updateEnvironment(t)
+        emitted += dt*np.sum(environ.hostSource.schedule(t))
+    total = np.sum(environ.CO2)
+    print('Breathing hosts: total CO2 {:.6f}, emitted {:.6f} (relative difference {:.1e}); skipped {} steps (it should be 0)'.format(total,emitted,abs(total/emitted-1),environ.numSkippedSteps))
+
+def testnoncontiguous(N=64,numHosts=50):
+    '''
+    inject should add the source in place whatever the strides of the
+    array (a transposed grid, every other column of a wider one, stacked
+    realizations laid out realization last), on both of its paths.
+
+    '''
+    rng = np.random.RandomState(4)
+    x, y = 10 + 80*rng.rand(numHosts), 10 + 80*rng.rand(numHosts)
+    for denseFraction in [1.0,0.0]:
+        source = hostSources.hostSource(x,y,rng.rand(numHosts),100.0/N,(N,N),denseFraction=denseFraction)
+        same = True
+        for out in [np.zeros((N,N)).T,np.zeros((N,2*N))[:,::2],np.zeros((N,N,3)).transpose(2,0,1)]:
+            source.inject(out)
+            same = same and all(np.array_equal(a,source.dense()) for a in out.reshape((-1,N,N)))
+        print('{} add: source added in place to non-contiguous arrays? (It should be.) {}'.format('full grid' if source.useDense else 'scattered',same))
+
+def testscaling(sizes=(128,256,512,1024),hostCounts=(100,1000,4000,16000,64000),numSteps=50):
+    '''
+    Time per step of adding the source of constant hosts to a grid by the
+    scattered add and by adding the full grid, for growing numbers of hosts
+    on several grid sizes, and the paths inject chose by default and by
+    timing (denseFraction='auto'). The scattered cost grows with the number
+    of hosts and not the grid; the full grid should be chosen by timing
+    about where it becomes the faster.
+    Breathing hosts also pay for recomputing the sparse rates every step,
+    against rebuilding the dense grid with extrapToGrid.
+
+    '''
+    dimParams = {'mosquitoDecisionTime (s)':0.1,'CO2Sat (units CO2/unit air or 10^6 ppm)':4.e-3}
+    for N in sizes:
+        h = 100.0/N
+        out = np.zeros((N,N))
+        print('{0}x{0} grid, ms per step'.format(N))
+        for numHosts in hostCounts:
+            rng = np.random.RandomState(numHosts)
+            x, y = 10 + 80*rng.rand(numHosts), 10 + 80*rng.rand(numHosts)
+            mean = environment.constantSourceStrength(dimParams,numHosts)
+            schedule = lambda t: mean*(1 - np.cos(t + x))
+            constant = hostSources.hostSource(x,y,mean,h,(N,N))
+            timed = hostSources.hostSource(x,y,mean,h,(N,N),denseFraction='auto')
+            scattered = hostSources.hostSource(x,y,mean,h,(N,N),denseFraction=1.0)
+            full = hostSources.hostSource(x,y,mean,h,(N,N),denseFraction=0.0)
+            breathing = hostSources.hostSource(x,y,schedule,h,(N,N),denseFraction=1.0)
+            timings = []
+            for step in [lambda k: scattered.inject(out),
+                         lambda k: full.inject(out),
+                         lambda k: out.__iadd__(nMeth.extrapToGrid(x,y,schedule(0.1*k),h,(N,N))),
+                         lambda k: (breathing.setTime(0.1*k),breathing.inject(out))]:
+                best = np.inf
+                for repeat in range(3):
+                    start = time.perf_counter()
+                    for k in range(numSteps):
+                        step(k)
+                    best = min(best,1000*(time.perf_counter()-start)/numSteps)
+                timings.append(best)
+            print('{:6d} hosts ({:5.1f}% of cells): constant scattered {:.3f}, full grid {:.3f}, chose {} (by timing {}); breathing dense {:.3f}, sparse {:.3f}'.format(numHosts,100.*len(constant.cells)/N**2,timings[0],timings[1],*['full grid' if source.useDense else 'scattered' for source in (constant,timed)],*timings[2:]))
+            if len(constant.cells) > 0.3*N**2:
+                break
+
+if __name__ == '__main__':
+    testsharedcells()
+    testbreathing()
+    testnoncontiguous()
+    testscaling()
@@ -1,9 +1,9 @@
-import numericalSims as nS
+import environment
 import interpFunctions as iF
 import numpy as np
 
 def testaccuracy(xy):
-    mysim = nS.numericalSims()
+    mysim = environment.environment(np.array([30.0,70.0]),np.array([40.0,60.0]))
     # bilinear/linear/affine functions should be recovered exactly
     randVel1 = 0.03*mysim.xg + 0.1
     randVel2 = -0.02*mysim.yg
@@ -39,12 +39,13 @@ def testspeed():
     To test speed, import cProfile and testspeed from this module into a python 
     interpreter and do
     cProfile.runctx('testspeed()',globals(),locals())
+    For timings of every hot path at several sizes, run benchmarks.py instead.
 
     '''
     for k in range(10):
         x = 1+98*np.random.rand(10000)
         y = 1+98*np.random.rand(10000)
-        xy = zip(x,y)
+        xy = list(zip(x,y))
         testaccuracy(xy)
 
 def testextrap(x,y,mysim,s):
@@ -61,7 +62,7 @@ def testextrap(x,y,mysim,s):
     # call extrapolation functions and calculate error
     c=iF.extrapToGrid(x,y,s,mysim.simsParams['h'],mysim.xg.shape)
     i,j,nodes = iF.getIndicesNodesNumpyArrays(x,y,mysim.simsParams['h'])
-    checksum = c[[i,j]] + c[[i,j+1]] + c[[i+1,j]] + c[[i+1,j+1]]
+    checksum = c[i,j] + c[i,j+1] + c[i+1,j] + c[i+1,j+1]
     # check that max extrap val occurs at min dist
     match = []
     mismatch = []
@@ -97,13 +98,13 @@ def testextrap(x,y,mysim,s):
 
 if __name__ == '__main__':
     xy = [(48.32,5.02),(16.94,34.43),(69.50,90.98)]
-    # testaccuracy(xy)
+    testaccuracy(xy)
     # testspeed()
     np.random.seed(4736829)
     x = 1+98*np.random.rand(100)
     np.random.seed(48758)
     y = 1+98*np.random.rand(100)
-    mysim = nS.numericalSims(numGridPoints=512)
+    mysim = environment.environment(np.array([30.0,70.0]),np.array([40.0,60.0]),numGridPoints=512)
     s = np.random.rand(len(x))  
     # x = np.array([x for (x,y) in xy])
     # y = np.array([y for (x,y) in xy])
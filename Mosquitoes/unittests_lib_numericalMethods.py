@@ -0,0 +1,142 @@
+import environment
+import interpFunctions as iF
+import lib_numericalMethods as nMeth
+import numpy as np
+import time
+
+def makeEnviron(N):
+    environ = environment.environment(np.array([30.0,70.0]),np.array([40.0,60.0]),numGridPoints=N)
+    np.random.seed(3987)
+    environ.randVel1 = environ.randVelMag*np.random.randn(N,N)
+    environ.randVel2 = environ.randVelMag*np.random.randn(N,N)
+    environ.CO2 = np.random.rand(N,N)
+    return environ
+
+def testupwindaccuracy(N=128):
+    '''
+    The in-place flux should reproduce the original upwind scheme exactly,
+    also when its buffers are reused; the rest of the solver relies on this.
+
+    '''
+    environ = makeEnviron(N)
+    U = environ.constantU + environ.randVel1
+    V = environ.constantV + environ.randVel2
+    flux = nMeth.upwindScheme(U,V,environ)
+    out = np.empty(U.shape)
+    nMeth.upwindSchemeInPlace(U,V,environ,out)
+    print('Max difference between upwindScheme and upwindSchemeInPlace: {}'.format(np.max(np.abs(flux-out))))
+    print('Bit-identical? (It should be.) {}'.format(np.array_equal(flux,out)))
+    # a second call reuses the persistent buffers, which must not leak state
+    environ.CO2 = np.random.rand(N,N)
+    flux = nMeth.upwindScheme(U,V,environ)
+    nMeth.upwindSchemeInPlace(U,V,environ,out)
+    print('Bit-identical on reusing the buffers? (It should be.) {}'.format(np.array_equal(flux,out)))
+
+def testupwindspeed(sizes=(128,512,1024),numSteps=50):
+    '''
+    Prints steps per second of the original and the in-place upwind scheme.
+
+    '''
+    for N in sizes:
+        environ = makeEnviron(N)
+        U = environ.constantU + environ.randVel1
+        V = environ.constantV + environ.randVel2
+        out = np.empty(U.shape)
+        start = time.time()
+        for _ in range(numSteps):
+            nMeth.upwindScheme(U,V,environ)
+        orig = numSteps/(time.time()-start)
+        start = time.time()
+        for _ in range(numSteps):
+            nMeth.upwindSchemeInPlace(U,V,environ,out)
+        inplace = numSteps/(time.time()-start)
+        print('{0}x{0} grid: upwindScheme {1:.1f} steps/s, upwindSchemeInPlace {2:.1f} steps/s'.format(N,orig,inplace))
+
+def testinterpspeed(N=128,sizes=(100,1000,10000,100000,1000000),maxPythonSize=10000):
+    '''
+    Prints the time to interpolate the random velocities and CO2 to M points
+    with the variants in interpFunctions, interpFromGrid and the fused 
+    interpFromInterleavedGrid, and the largest difference from interpFromGrid.
+    The interleaved time is given with the fields already packed, with the
+    packing of the CO2 included (as querySignal does once per step for large
+    queries) and with the CO2 gathered separately (as it does for small 
+    ones). The pure Python variants are only timed up to maxPythonSize 
+    points.
+
+    '''
+    environ = makeEnviron(N)
+    h = environ.simsParams['h']
+    fields = np.dstack([environ.randVel1,environ.randVel2,environ.CO2])
+    work = {}
+    for M in sizes:
+        x = h/2. + (environ.simsParams['domainLength']-h)*(0.001 + 0.998*np.random.rand(M))
+        y = h/2. + (environ.simsParams['domainLength']-h)*(0.001 + 0.998*np.random.rand(M))
+        times = []
+        start = time.time()
+        ref = nMeth.interpFromGrid(x,y,h,environ.randVel1,environ.randVel2,environ.CO2)
+        times.append(('interpFromGrid',time.time()-start))
+        start = time.time()
+        iF.interpFromGridNumpyArrays(x,y,h,environ.randVel1,environ.randVel2,environ.CO2)
+        times.append(('NumpyArrays',time.time()-start))
+        if M <= maxPythonSize:
+            xy = list(zip(x,y))
+            for name,f in [('WithMaps',iF.interpFromGridWithMaps),('SingleForLoop',iF.interpFromGridSingleForLoop),('ListComp',iF.interpFromGridListComp)]:
+                start = time.time()
+                f(xy,h,environ.randVel1,environ.randVel2,environ.CO2)
+                times.append((name,time.time()-start))
+        start = time.time()
+        vals = nMeth.interpFromInterleavedGrid(x,y,h,fields,work=work)
+        times.append(('Interleaved',time.time()-start))
+        err = max(np.max(np.abs(ref[k]-vals[:,k])) for k in range(3))
+        start = time.time()
+        fields[...,2] = environ.CO2
+        nMeth.interpFromInterleavedGrid(x,y,h,fields,work=work)
+        times.append(('with CO2 packing',time.time()-start))
+        start = time.time()
+        vals = nMeth.interpFromInterleavedGrid(x,y,h,fields,work=work,fresh={2:environ.CO2})
+        times.append(('with separate CO2',time.time()-start))
+        err = max(err,np.max(np.abs(ref[2]-vals[:,2])))
+        print('{} points: '.format(M) + ', '.join('{} {:.5f} s'.format(name,t) for name,t in times) + ', max difference {}'.format(err))
+
+def testlowstorage(sizes=(256,1024),numSteps=20):
+    '''
+    lowStorageRK4 should be fourth order on dy/dt = -cos(t) y and give the
+    same steps with the fused register updates as with plain numpy. Prints
+    the cost of a step split into its five right hand sides and the register
+    updates, and the steps per second of explicitRK4.
+
+    '''
+    func = lambda t,y,out: np.multiply(y,-np.cos(t),out=out)
+    errors = []
+    for n in [20,40]:
+        y = np.ones((2,2))
+        registers = nMeth.makeRKRegisters(y.shape)
+        for k in range(n):
+            nMeth.lowStorageRK4(k*2.0/n,y,2.0/n,func,registers)
+        errors.append(abs(y[0,0]-np.exp(-np.sin(2.0))))
+    y1, y2 = np.ones((3,8,8)), np.ones((3,8,8))
+    registers = nMeth.makeRKRegisters(y1.shape)
+    nMeth.lowStorageRK4(0.0,y1,0.1,func,registers)
+    nMeth._lowStorageRK4NumPy(0.0,y2,0.1,func,registers['u'],registers['k'])
+    print('lowStorageRK4 order {:.2f} (it should be about 4); fused updates the same as numpy? (It should be.) {}'.format(np.log2(errors[0]/errors[1]),np.array_equal(y1,y2)))
+    for N in sizes:
+        environ = makeEnviron(N)
+        dt = environ.simsParams['dt']
+        registers = nMeth.makeRKRegisters(environ.CO2.shape)
+        y = environ.CO2.copy()
+        timings = []
+        for step in [lambda: nMeth.lowStorageRK4(0.0,y,dt,environ._CO2RHS,registers),
+                     lambda: environ._CO2RHS(0.0,y,registers['k']),
+                     lambda: nMeth.explicitRK4(0.0,environ.CO2,dt,environ._updateCO2HeavisideRandVel)]:
+            start = time.time()
+            for _ in range(numSteps):
+                step()
+            timings.append((time.time()-start)/numSteps)
+        print('{0}x{0} grid: lowStorageRK4 {1:.2f} ms per step, of which 5 right hand sides {2:.2f} ms; explicitRK4 {3:.2f} ms per step'.format(N,1000*timings[0],5000*timings[1],1000*timings[2]))
+
+
+if __name__ == '__main__':
+    testupwindaccuracy()
+    testupwindspeed()
+    testinterpspeed()
+    testlowstorage()
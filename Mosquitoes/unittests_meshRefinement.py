@@ -0,0 +1,120 @@
+import environment
+import lib_numericalMethods as nMeth
+import meshRefinement
+import numpy as np
+import time
+
+hostx = np.array([30.0,70.0])
+hosty = np.array([40.0,60.0])
+
+def scaledSource(ratio):
+    '''
+    Host source for a uniform grid ratio times finer than the coarse grid,
+    giving the same CO2 mass per unit time as on the coarse grid.
+
+    '''
+    return lambda dimParams,numHosts: ratio**2*environment.constantSourceStrength(dimParams,numHosts)
+
+def run(environ,finalTime):
+    start = time.time()
+    for t in np.arange(environ.simsParams['initialTime'],finalTime,environ.simsParams['dt']):
+        environ.updateEnvironment(t)
+    return time.time() - start
+
+def testconservation(N=64,finalTime=40.0):
+    '''
+    Before the plume reaches the domain edge, the total CO2 should be exactly
+    (to round-off) the mass emitted by the hosts, with the fine patches in
+    place and random wind on.
+
+    '''
+    environ = meshRefinement.refinedEnvironment(hostx,hosty,numGridPoints=N,finalTime=finalTime,seed=3)
+    run(environ,finalTime)
+    emitted = finalTime*environ.simsParams['h']**2*np.sum(environ.hostSourceStrength)
+    print('{} patches: total CO2 {}, emitted {}, relative difference {:.2e}'.format(len(environ.patches),environ.totalCO2(),emitted,abs(environ.totalCO2()/emitted-1)))
+
+def testaccuracy(N=64,ratio=4,finalTime=150.0,radius=10.0):
+    '''
+    Compares CO2 within radius of the hosts on the coarse grid, on the
+    refined grid and on a uniform grid ratio times finer (the reference),
+    without random wind so that the grids see the same velocity field.
+    The refined grid should be close to the fine one at a fraction of its
+    cost.
+
+    '''
+    np.random.seed(221)
+    angle = 2*np.pi*np.random.rand(5000)
+    dist = radius*np.sqrt(np.random.rand(5000))
+    x = np.concatenate([hx + dist*np.cos(angle) for hx in hostx])
+    y = np.concatenate([hy + dist*np.sin(angle) for hy in hosty])
+    fine = environment.environment(hostx,hosty,hostSourceHandle=scaledSource(ratio),numGridPoints=N*ratio,finalTime=finalTime,randVelMag=0.0,dt=0.05)
+    tfine = run(fine,finalTime)
+    ref = fine.querySignal(x,y)[2]
+    coarse = environment.environment(hostx,hosty,numGridPoints=N,finalTime=finalTime,randVelMag=0.0,dt=0.05)
+    tcoarse = run(coarse,finalTime)
+    refined = meshRefinement.refinedEnvironment(hostx,hosty,refinementRatio=ratio,refineRadius=radius+5.0,numGridPoints=N,finalTime=finalTime,randVelMag=0.0,dt=0.05)
+    trefined = run(refined,finalTime)
+    for name,environ,t in [('coarse',coarse,tcoarse),('refined',refined,trefined),('fine',fine,tfine)]:
+        err = np.max(np.abs(environ.querySignal(x,y)[2] - ref))/np.max(np.abs(ref))
+        print('{:8s}: relative error near hosts {:.3e}, {:.2f} s'.format(name,err,t))
+    cells = refined.CO2.size + sum(p.CO2.size for p in refined.patches)
+    print('Refined grid cells {} ({:.0f}% of the fine grid)'.format(cells,100.*cells/fine.CO2.size))
+
+class interpolatedRandVel(environment.environment):
+    '''
+    A uniform grid whose random velocity is the bilinear interpolation of
+    that of the environment coarse, as on the fine patches of
+    refinedEnvironment, so that inside a patch the two see the same wind.
+
+    '''
+
+    def __init__(self,coarse,hostPositionx,hostPositiony,**kwargs):
+        self.coarse = coarse
+        environment.environment.__init__(self,hostPositionx,hostPositiony,**kwargs)
+
+    def _switchRandVel(self,ind):
+        c = self.coarse
+        c._switchRandVel(ind)
+        hc = c.simsParams['h']
+        # keep the points strictly inside the outermost coarse grid points
+        x = np.clip(self.xg,hc/2.,np.nextafter(c.simsParams['domainLength']-hc/2.,0))
+        y = np.clip(self.yg,hc/2.,np.nextafter(c.simsParams['domainLength']-hc/2.,0))
+        self.randVel1, self.randVel2, _ = nMeth.interpFromGrid(x,y,hc,c.randVel1,c.randVel2,c.randVel1)
+        self.randVelIndex = ind
+
+def testrandomwind(N=64,ratio=4,finalTime=100.0,seed=3):
+    '''
+    One patch downwind of the first host but not around either host, with
+    random wind on, so the CO2 reaching the patch comes in through its ghost
+    cells from the coarse grid and leaves through refluxed edges. Before the
+    plumes reach the domain edge the total CO2 should be the emitted mass to
+    round-off, and inside the patch the refined grid should be closer than
+    the coarse grid to a uniform grid ratio times finer with the same wind
+    (its random velocity interpolated from the coarse fields).
+
+    '''
+    h = 100.0/N
+    hx, hy = np.array([40.0,65.0]), np.array([15.0,25.0])
+    box = (int(30/h),int(50/h),int(25/h),int(45/h))
+    refined = meshRefinement.refinedEnvironment(hx,hy,refinementRatio=ratio,boxes=[box],numGridPoints=N,finalTime=finalTime,seed=seed,dt=0.05)
+    run(refined,finalTime)
+    emitted = finalTime*h**2*np.sum(refined.hostSourceStrength)
+    print('Patch away from the hosts, random wind: total CO2 {}, emitted {}, relative difference {:.2e}'.format(refined.totalCO2(),emitted,abs(refined.totalCO2()/emitted-1)))
+    coarse = environment.environment(hx,hy,numGridPoints=N,finalTime=finalTime,seed=seed,dt=0.05)
+    run(coarse,finalTime)
+    fine = interpolatedRandVel(environment.environment(hx,hy,numGridPoints=N,seed=seed),hx,hy,hostSourceHandle=scaledSource(ratio),numGridPoints=N*ratio,finalTime=finalTime,dt=0.05)
+    run(fine,finalTime)
+    patch = refined.patches[0]
+    np.random.seed(222)
+    n, m = patch.shape
+    x = patch.x0 + patch.h*(0.5 + (n-1)*np.random.rand(10000))
+    y = patch.y0 + patch.h*(0.5 + (m-1)*np.random.rand(10000))
+    ref = fine.querySignal(x,y)[2]
+    errors = [np.max(np.abs(environ.querySignal(x,y)[2] - ref))/np.max(np.abs(ref)) for environ in [coarse,refined]]
+    print('In the patch: relative error coarse {:.3e}, refined {:.3e}; refined closer to the fine grid? (It should be.) {}'.format(errors[0],errors[1],errors[1] < errors[0]))
+
+
+if __name__ == '__main__':
+    testconservation()
+    testaccuracy()
+    testrandomwind()
@@ -0,0 +1,141 @@
+import mosquito
+import numpy as np
+import time
+
+def testresponsecurve(numVals=10000):
+    '''
+    The vectorized response curve should match the scalar reference exactly,
+    and the tabulated one to interpolation accuracy, for every response type
+    including values at and beyond threshold and saturation.
+
+    '''
+    mosqs = mosquito.klinotaxis(np.zeros(3),windKappa=1.0,windThresh=0.01,CO2Kappa=-20.0,diffCO2Kappa=3.0)
+    tabmosqs = mosquito.klinotaxis(np.zeros(3),windKappa=1.0,windThresh=0.01,CO2Kappa=-20.0,diffCO2Kappa=3.0,responseTablePoints=1024)
+    np.random.seed(3457)
+    for responseStr in ['CO2','wind','diffCO2']:
+        sat = mosqs.mosqParams[responseStr+'Sat']
+        thresh = mosqs.mosqParams[responseStr+'Thresh']
+        val = sat*np.concatenate([1.2*np.random.rand(numVals),[thresh/sat,1.0,0.0,-1.e-12,1.0+1.e-12]])
+        ref = mosqs._responseCurveScalar(responseStr,val)
+        vec = mosqs._responseCurve(responseStr,val)
+        tab = tabmosqs._responseCurve(responseStr,val)
+        print('{}: max difference vectorized {}, tabulated {}'.format(responseStr,np.max(np.abs(vec-ref)),np.max(np.abs(tab-ref))))
+
+def testresponsetablechecks():
+    '''
+    Response tables with fewer than two points, or a threshold at
+    saturation, should be refused when the population is made.
+
+    '''
+    for kwargs in [{'responseTablePoints':1},{'responseTablePoints':1024,'windThresh':0.5},{'responseTablePoints':1024,'diffCO2Thresh':0.02,'diffCO2Sat':0.02}]:
+        try:
+            mosquito.klinotaxis(np.zeros(3),**kwargs)
+            message = None
+        except ValueError as e:
+            message = str(e)
+        print('{}: {}; refused? (It should be.) {}'.format(kwargs,message,message is not None))
+    mosquito.klinotaxis(np.zeros(3),windThresh=0.5)
+    print('Threshold at saturation allowed without a table? (It should be.) True')
+
+def testremove(numMosqs=1000,numRemove=137):
+    '''
+    Retiring mosquitoes should keep exactly the others, each with its own
+    state, whichever mosquitoes are removed.
+
+    '''
+    np.random.seed(9182)
+    mosqs = mosquito.klinotaxis(np.random.rand(numMosqs))
+    mosqs.currentPosy = np.random.rand(numMosqs)
+    mosqs.previousMotionDir = np.random.rand(numMosqs)
+    before = mosqs.state[:,:mosqs.numActive].copy()
+    captured = np.sort(np.random.permutation(numMosqs)[:numRemove])
+    mosqs._removeMosquitoes(captured)
+    kept = np.setdiff1d(np.arange(numMosqs),captured)
+    order = np.argsort(mosqs.agentId)
+    same = np.array_equal(mosqs.agentId[order],kept) and np.array_equal(mosqs.state[:,:mosqs.numActive][:,order],before[:,kept])
+    print('Remaining mosquitoes and their states correct? (They should be.)', same)
+
+def testresponsespeed(sizes=(100,10000,1000000)):
+    mosqs = mosquito.klinotaxis(np.zeros(3),windKappa=1.0,windThresh=0.01)
+    tabmosqs = mosquito.klinotaxis(np.zeros(3),windKappa=1.0,windThresh=0.01,responseTablePoints=1024)
+    for M in sizes:
+        val = 0.6*np.random.rand(M)
+        times = []
+        for f in [mosqs._responseCurveScalar,mosqs._responseCurve,tabmosqs._responseCurve]:
+            start = time.time()
+            f('wind',val)
+            times.append(time.time()-start)
+        print('{} mosquitoes: scalar {:.5f} s, vectorized {:.5f} s, tabulated {:.5f} s'.format(M,*times))
+
+def testtrajectoryoverhead(numMosqs=100000,numDecisions=50):
+    '''
+    Prints the time per decision with trajectory recording off, recording
+    every mosquito and recording every 10th mosquito at every 5th decision.
+
+    '''
+    import environment
+    environ = environment.environment(np.array([30.0,70.0]),np.array([40.0,60.0]),numGridPoints=128,seed=5)
+    environ.updateEnvironment(0.0)
+    for kwargs in [{},{'recordTrajectories':True,'trajectoryBufferSize':10**6},{'recordTrajectories':True,'trajectoryDecimation':5,'trajectoryAgentStride':10}]:
+        np.random.seed(6142)
+        mosqs = mosquito.mixedStrategies(environ,100*np.random.rand(numMosqs),np.repeat(['upwind','downwind','crosswind'],numMosqs//3+1)[:numMosqs],startTime=0.0,hostRadius=0.0,**kwargs)
+        start = time.time()
+        for k in range(numDecisions):
+            mosqs.updatePosition(environ,float(k))
+        print('{}: {:.2f} ms per decision'.format(kwargs or 'recording off',1000*(time.time()-start)/numDecisions))
+
+def testmixedstrategies(numEach=200,finalTime=150):
+    '''
+    With a seed every mosquito draws its own random numbers, so a mixed
+    population should fly exactly the same paths and make exactly the same
+    captures, strategy by strategy, as separate upwind, downwind and 
+    crosswind populations holding the same mosquitoes (same agentIds).
+
+    '''
+    import environment
+    environ = environment.environment(np.array([30.0,70.0]),np.array([40.0,60.0]),numGridPoints=64,seed=5)
+    np.random.seed(7319)
+    x = 10 + 80*np.random.rand(3*numEach)
+    names = ['upwind','downwind','crosswind']
+    mixed = mosquito.mixedStrategies(environ,x,np.repeat(names,numEach),seed=11,startTime=0.0,hostRadius=3.0)
+    separate = [getattr(mosquito,name)(environ,x[k*numEach:(k+1)*numEach],seed=11,startTime=0.0,hostRadius=3.0,firstAgentId=k*numEach) for k,name in enumerate(names)]
+    samePaths = True
+    dt = environ.simsParams['dt']
+    for t in np.arange(0.0,finalTime,dt):
+        environ.updateEnvironment(t)
+        if abs(t - round(t)) < dt/10:
+            for mosqs in [mixed] + separate:
+                mosqs.updatePosition(environ,round(t))
+            order = np.argsort(mixed.agentId)
+            ids = np.concatenate([mosqs.agentId for mosqs in separate])
+            sepOrder = np.argsort(ids)
+            samePaths &= np.array_equal(mixed.agentId[order],ids[sepOrder])
+            for name in ['currentPosx','currentPosy','previousMotionDir']:
+                samePaths &= np.array_equal(getattr(mixed,name)[order],np.concatenate([getattr(mosqs,name) for mosqs in separate])[sepOrder])
+    import resultsWriter
+    mixedIds = mixed.results['agentId']
+    sameCaptures = True
+    for k,mosqs in enumerate(separate):
+        mine = np.nonzero(mixed.strategies[mixedIds - mixed.firstAgentId] == k)[0]
+        mine = mine[np.argsort(mixedIds[mine])]
+        theirs = np.argsort(mosqs.results['agentId'])
+        for name,dtype in resultsWriter.captureColumns:
+            sameCaptures &= np.array_equal(mixed.results[name][mine],mosqs.results[name][theirs])
+    print('{} of {} mosquitoes captured'.format(len(mixedIds),3*numEach))
+    print('Same paths as separate populations? (They should be.)', samePaths)
+    print('Same captures, strategy by strategy? (They should be.)', sameCaptures)
+    # a population after the first, as in a sweep or a split release
+    offset = mosquito.mixedStrategies(environ,x,np.repeat(names,numEach),seed=11,startTime=0.0,hostRadius=3.0,firstAgentId=5*numEach)
+    for t in np.arange(0.0,finalTime,1.0):
+        offset.updatePosition(environ,t)
+    ids = offset.results['agentId']
+    print('Strategies of captures with firstAgentId {} by agentId? (They should be.) {}'.format(offset.firstAgentId,np.array_equal(offset.strategies[ids - offset.firstAgentId],np.repeat(np.arange(3),numEach)[ids - offset.firstAgentId]) and len(ids) > 0))
+
+
+if __name__ == '__main__':
+    testresponsecurve()
+    testresponsetablechecks()
+    testremove()
+    testresponsespeed()
+    testtrajectoryoverhead()
+    testmixedstrategies()
@@ -0,0 +1,105 @@
+import environment
+import mosquito
+import parameterSweep
+import windFields
+import numpy as np
+import itertools
+import os
+import shutil
+import tempfile
+import time
+
+hostx = np.array([30.0,70.0])
+hosty = np.array([40.0,60.0])
+
+def serialSweep(makeEnviron,paramGrid,initPosx,strategies=('upwind','downwind','crosswind'),seed=0):
+    '''
+    The sweep done the slow way: for every combination a fresh environment
+    from makeEnviron() is solved step by step, and the population flies at
+    every decision time from its start time, as in simulateMosquitoes.
+    Returns rows like those of parameterSweep.sweep.
+
+    '''
+    names = sorted(paramGrid)
+    combinations = [dict(zip(names,values)) for values in itertools.product(*[paramGrid[name] for name in names])]
+    seeds = np.random.SeedSequence(seed).generate_state(len(combinations))
+    allPosx = np.tile(initPosx,len(strategies))
+    allStrategies = np.repeat(strategies,len(initPosx))
+    rows = []
+    for k,combination in enumerate(combinations):
+        environ = makeEnviron()
+        np.random.seed(seeds[k])
+        pop = mosquito.mixedStrategies(environ,allPosx,allStrategies,**combination)
+        for t in np.arange(environ.simsParams['initialTime'],environ.simsParams['finalTime'],environ.simsParams['dt']):
+            environ.updateEnvironment(t)
+            decision = float(round(t))
+            if abs(t - decision) < environ.simsParams['dt']/2.0 and decision >= pop.mosqParams['startTime']:
+                pop.updatePosition(environ,decision)
+                if pop.numActive == 0 or pop.stopSimulation(environ):
+                    break
+        captured = pop.strategies[pop.results['agentId'] - pop.firstAgentId]
+        for name,code in sorted(pop.strategyCodes.items(),key=lambda a:a[1]):
+            mine = captured == code
+            rows.append([combination[n] for n in names] + [name,np.sum(pop.strategies == code),np.sum(mine),np.mean(pop.results['flightTime'][mine]) if np.any(mine) else np.nan])
+    return rows
+
+def testserial(finalTime=250.0,numProcesses=2):
+    '''
+    A sweep in worker processes over the memory-mapped plume archive should
+    give exactly the table of flying every combination through its own
+    solved environment, both with a velocity function and with a gridded
+    wind passed to the workers by path, with every parameter column of
+    the type of its values.
+
+    '''
+    paramGrid = {'CO2Thresh':[0.005,0.02],'startTime':[50.0,100.0],'responseTablePoints':[64]}
+    np.random.seed(71)
+    initPosx = 10 + 80*np.random.rand(40)
+    windPath = tempfile.mkdtemp()
+    try:
+        N = 64
+        h = 100.0/N
+        windFields.saveGriddedWind(windPath,[0.0,finalTime],*environment.constantVel(np.ones((2,N,N)),np.ones((2,N,N)),0.05,0.2))
+        for name,velfunc in [('velocity function',lambda: environment.constantVel),('gridded wind',lambda: windFields.loadGriddedWind(windPath,h))]:
+            makeEnviron = lambda: environment.environment(hostx,hosty,numGridPoints=N,finalTime=finalTime,seed=4,velocityFunctionHandle=velfunc())
+            table = parameterSweep.sweep(makeEnviron(),paramGrid,initPosx,numProcesses=numProcesses,seed=3)
+            rows = serialSweep(makeEnviron,paramGrid,initPosx,seed=3)
+            same = len(rows) == len(table)
+            for row,expected in zip(table,rows):
+                same = same and all(np.array_equal(a,b,equal_nan=isinstance(b,float)) for a,b in zip(row.tolist(),expected))
+            print('{}: {} of {} mosquitoes captured; sweep the same as the serial runs? (It should be.) {}'.format(name,np.sum(table['numCaptured']),np.sum(table['numReleased']),same))
+            print('Integer parameter kept as an integer column? (It should be.) {}'.format(np.issubdtype(table.dtype['responseTablePoints'],np.integer)))
+    finally:
+        shutil.rmtree(windPath)
+
+def testscaling(N=128,finalTime=1000.0,numMosqs=2000,processCounts=(1,2,4)):
+    '''
+    Prints the sweep time for growing numbers of worker processes (the plume
+    is recorded once, outside the timing), and the size of the archive they
+    all memory-map, which is the only copy of the plume.
+
+    '''
+    archiveRoot = tempfile.mkdtemp()
+    try:
+        environ = environment.environment(hostx,hosty,numGridPoints=N,finalTime=finalTime,seed=1)
+        path = environment.recordPlume(environ,archiveRoot)
+        size = sum(os.path.getsize(os.path.join(path,name)) for name in os.listdir(path))
+        print('{0}x{0} grid to t = {1}: plume archive {2:.0f} MB, {3} CPUs'.format(N,finalTime,size/2.**20,os.cpu_count()))
+        np.random.seed(5)
+        initPosx = 100*np.random.rand(numMosqs)
+        paramGrid = {'CO2Thresh':[0.005,0.01,0.02,0.04],'windKappa':[0.0,1.0]}
+        for numProcesses in processCounts:
+            replay = environment.replayEnvironment(archiveRoot,hostx,hosty,numGridPoints=N,finalTime=finalTime,seed=1)
+            start = time.time()
+            parameterSweep.sweep(replay,paramGrid,initPosx,numProcesses=numProcesses)
+            elapsed = time.time() - start
+            if numProcesses == processCounts[0]:
+                base = elapsed
+            print('{} processes: {:.2f} s, speedup {:.2f}'.format(numProcesses,elapsed,base/elapsed))
+    finally:
+        shutil.rmtree(archiveRoot)
+
+
+if __name__ == '__main__':
+    testserial()
+    testscaling()
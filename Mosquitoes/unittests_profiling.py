@@ -0,0 +1,49 @@
+import environment
+import mosquito
+import profiling
+import numpy as np
+import time
+
+def runShort(profiler=None,numMosqs=20000,finalTime=80.0):
+    environ = environment.environment(np.array([30.0,70.0]),np.array([40.0,60.0]),numGridPoints=128,finalTime=finalTime,seed=12)
+    np.random.seed(901)
+    pop = mosquito.mixedStrategies(environ,100*np.random.rand(numMosqs),np.repeat(['upwind','downwind','crosswind'],numMosqs//3+1)[:numMosqs],startTime=20.0)
+    profiling.attach(profiler,environ,[pop])
+    dt = environ.simsParams['dt']
+    start = time.time()
+    for t in np.arange(environ.simsParams['initialTime'],finalTime,dt):
+        environ.updateEnvironment(t)
+        if t%1.0 < dt/2.0 and t >= pop.mosqParams['startTime']:
+            pop.updatePosition(environ,t)
+    return time.time() - start, environ
+
+def testoverhead():
+    '''
+    Prints the run time with profiling off and on, the per-phase summary,
+    and checks that profiling does not change the solution.
+
+    '''
+    off, environOff = runShort()
+    profiler = profiling.phaseProfiler()
+    on, environOn = runShort(profiler)
+    profiler.report()
+    print('Profiling off {:.2f} s, on {:.2f} s ({:+.1f}%); same CO2? (It should be.) {}'.format(off,on,100*(on/off-1),np.array_equal(environOff.CO2,environOn.CO2)))
+
+def testallocations():
+    '''
+    With traceAllocations the summary shows per-call peak allocations. The
+    flux and the forward Euler update are computed in place, so a plume
+    step should allocate no grid arrays, only about 0.13 MB whatever the
+    grid size (numpy's buffers).
+
+    '''
+    profiler = profiling.phaseProfiler(traceAllocations=True)
+    runShort(profiler,numMosqs=2000,finalTime=30.0)
+    profiler.report()
+    s = profiler.summary()
+    print('Mean peak allocation per plume step {:.0f} bytes (one grid array is {} bytes)'.format(s['plumeStep']['meanAllocatedBytes'],128*128*8))
+
+
+if __name__ == '__main__':
+    testoverhead()
+    testallocations()
@@ -0,0 +1,68 @@
+import randomFields as rF
+import numpy as np
+import time
+
+def testcorrelation(L=100.0,correlationLength=5.0,sizes=(128,512)):
+    '''
+    The correlated fields should have unit variance and, for the gaussian
+    spectrum, correlation exp(-1/2) at a lag of one correlation length, no
+    matter what the grid resolution is.
+
+    '''
+    for N in sizes:
+        h = L/N
+        lag = int(round(correlationLength/h))
+        randFields = rF.randomVelocityFields(1234,(N,N),1.0,h=h,correlationLength=correlationLength)
+        var = []
+        corr = []
+        for ind in range(20):
+            for f in randFields.fields(ind):
+                var.append(np.mean(f**2))
+                corr.append(np.mean(f*np.roll(f,lag,axis=0)))
+        print('{0}x{0} grid: variance {1:.3f} (should be 1), correlation at lag {2} {3:.3f} (should be {4:.3f})'.format(N,np.mean(var),lag*h,np.mean(corr),np.exp(-(lag*h/correlationLength)**2/2)))
+
+def testreproducible():
+    '''
+    Two providers with the same seed should give the same fields in any
+    order, also after one is reset to a new seed, and should not draw a
+    field twice for the continuous random velocity.
+
+    '''
+    a = rF.randomVelocityFields(42,(64,64),0.075,h=100./64,correlationLength=5.0)
+    b = rF.randomVelocityFields(42,(64,64),0.075,h=100./64,correlationLength=5.0)
+    b.fields(7)
+    same = np.array_equal(a.fields(7)[0],b.fields(7)[0]) and np.array_equal(a.fields(3)[1],b.fields(3)[1])
+    print('Same fields from the same seed? (They should be.)', same)
+    b.reset(43)
+    d = rF.randomVelocityFields(43,(64,64),0.075,h=100./64,correlationLength=5.0)
+    print('Fields of the new seed after reset? (They should be.)', np.array_equal(b.fields(7)[0],d.fields(7)[0]))
+    c = rF.randomVelocityFields(42,(64,64),0.075)
+    for ind in range(10):
+        c.fields(ind)
+        c.fields(ind+1)
+    print('Fields made for 10 continuous switches: {} (should be 11)'.format(c.numFieldsMade))
+
+def testspeed(L=100.0,correlationLength=5.0,sizes=(128,256,512,1024,2048),numFields=5):
+    '''
+    Prints the time to make one random velocity field as a function of grid
+    size, for white noise and for FFT correlated fields.
+
+    '''
+    for N in sizes:
+        white = rF.randomVelocityFields(1,(N,N),1.0)
+        corr = rF.randomVelocityFields(1,(N,N),1.0,h=L/N,correlationLength=correlationLength)
+        start = time.time()
+        for ind in range(numFields):
+            white._makeFields(ind)
+        twhite = (time.time()-start)/numFields
+        start = time.time()
+        for ind in range(numFields):
+            corr._makeFields(ind)
+        tcorr = (time.time()-start)/numFields
+        print('{0}x{0} grid: white noise {1:.4f} s/field, correlated {2:.4f} s/field'.format(N,twhite,tcorr))
+
+
+if __name__ == '__main__':
+    testcorrelation()
+    testreproducible()
+    testspeed()
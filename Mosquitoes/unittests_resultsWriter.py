@@ -0,0 +1,78 @@
+import resultsWriter as rW
+import numpy as np
+import shutil
+import tempfile
+
+def testroundtrip(numRows=100000,chunkSize=4096,numAppends=37):
+    '''
+    Rows appended in uneven pieces should read back the same from memory,
+    from the buffer and from the memory-mapped files, and reopening the
+    directory should append rather than overwrite, unless it is cleared.
+
+    '''
+    path = tempfile.mkdtemp()
+    try:
+        np.random.seed(5532)
+        cols = {'whichhost':np.random.randint(0,100,numRows),'finalPosx':np.random.rand(numRows),'finalPosy':np.random.rand(numRows),'flightTime':np.random.rand(numRows),'agentId':np.arange(numRows)}
+        cuts = np.sort(np.random.randint(0,numRows//2,numAppends))
+        inMemory = rW.captureBuffer(chunkSize=16)
+        onDisk = rW.captureBuffer(path,chunkSize=chunkSize)
+        for start,stop in zip(np.concatenate([[0],cuts]),np.concatenate([cuts,[numRows//2]])):
+            piece = dict((name,cols[name][start:stop]) for name in cols)
+            inMemory.append(**piece)
+            onDisk.append(**piece)
+        onDisk.close()
+        onDisk = rW.captureBuffer(path,chunkSize=chunkSize)
+        piece = dict((name,cols[name][numRows//2:]) for name in cols)
+        inMemory.append(**piece)
+        onDisk.append(**piece)
+        loadedBeforeClose = onDisk['finalPosx']
+        onDisk.close()
+        loaded = rW.loadResults(path)
+        same = all(np.array_equal(inMemory[name],cols[name]) and np.array_equal(loaded[name],cols[name]) for name in cols)
+        print('Results read back correctly? (They should be.)', same and np.array_equal(loadedBeforeClose,cols['finalPosx']))
+        print('Rows held in memory at the end: {} (at most {})'.format(onDisk.numBuffered,chunkSize))
+        onDisk = rW.captureBuffer(path,chunkSize=chunkSize)
+        onDisk.clear()
+        onDisk.append(**piece)
+        onDisk.close()
+        print('Cleared and refilled directory holds only the new rows? (It should.)', np.array_equal(rW.loadResults(path)['agentId'],piece['agentId']))
+    finally:
+        shutil.rmtree(path)
+
+def testtrajectory(numAgents=1000,numDecisions=200,decimation=3,agentStride=7,bufferSize=5000):
+    '''
+    The ring buffer should keep exactly the last bufferSize rows that were
+    selected, and spilling to disk should keep all of them, in order.
+
+    '''
+    path = tempfile.mkdtemp()
+    try:
+        np.random.seed(1203)
+        ring = rW.trajectoryRecorder(decimation=decimation,agentStride=agentStride,bufferSize=bufferSize)
+        spill = rW.trajectoryRecorder(path,decimation=decimation,agentStride=agentStride,bufferSize=bufferSize)
+        ids = np.arange(numAgents)
+        rows = []
+        for k in range(numDecisions):
+            # mosquitoes get retired and reordered as the run goes on
+            ids = np.random.permutation(ids)[:len(ids)-2]
+            x, y = np.random.rand(len(ids)), np.random.rand(len(ids))
+            ring.record(float(k),ids,x,y)
+            spill.record(float(k),ids,x,y)
+            if k % decimation == 0:
+                keep = ids % agentStride == 0
+                rows.append(np.column_stack([np.full(np.sum(keep),float(k)),ids[keep],x[keep],y[keep]]))
+        spill.close()
+        rows = np.concatenate(rows)
+        loaded = rW.loadResults(path)
+        names = [name for name,_ in rW.trajectoryColumns]
+        sameSpill = all(np.array_equal(loaded[name],rows[:,n]) for n,name in enumerate(names))
+        sameRing = all(np.array_equal(ring[name],rows[-bufferSize:,n]) for n,name in enumerate(names))
+        print('{} rows recorded: spilled rows correct? {} ring keeps the last {} correctly? {} (Both should be True.)'.format(len(rows),sameSpill,bufferSize,sameRing))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    testroundtrip()
+    testtrajectory()
@@ -0,0 +1,68 @@
+import spatialIndex as sI
+import numpy as np
+import time
+
+def bruteForce(x,y,hx,hy,radius):
+    captured = []
+    whichhost = []
+    for k in range(len(x)):
+        dist = np.sqrt( (hx - x[k])**2 + (hy - y[k])**2 )
+        if not np.all(dist >= radius):
+            captured.append(k)
+            whichhost.append(np.argmin(dist))
+    return np.array(captured,dtype=int), np.array(whichhost,dtype=int)
+
+def testaccuracy(numHosts=300,numMosqs=5000,radius=5.0,bucketSizes=(5.0,2.0,17.0)):
+    '''
+    The bucket grid should find exactly the mosquitoes and nearest hosts that
+    a loop over all mosquitoes and hosts finds, whatever the bucket size.
+
+    '''
+    np.random.seed(2398)
+    hx = 100*np.random.rand(numHosts)
+    hy = 100*np.random.rand(numHosts)
+    x = -10 + 120*np.random.rand(numMosqs)
+    y = -10 + 120*np.random.rand(numMosqs)
+    cb,wb = bruteForce(x,y,hx,hy,radius)
+    for bucketSize in bucketSizes:
+        index = sI.hostBuckets(hx,hy,bucketSize)
+        c,w = index.nearestWithin(x,y,radius)
+        print('Bucket size {}: same as brute force? (It should be.) {}'.format(bucketSize,np.array_equal(c,cb) and np.array_equal(w,wb)))
+
+def testspeed(numHosts=300,sizes=(1000,10000,100000),radius=5.0):
+    np.random.seed(2398)
+    hx = 100*np.random.rand(numHosts)
+    hy = 100*np.random.rand(numHosts)
+    index = sI.hostBuckets(hx,hy,radius)
+    for M in sizes:
+        x = 100*np.random.rand(M)
+        y = 100*np.random.rand(M)
+        start = time.time()
+        index.nearestWithin(x,y,radius)
+        tindex = time.time()-start
+        start = time.time()
+        bruteForce(x[:1000],y[:1000],hx,hy,radius)
+        tbrute = (time.time()-start)*M/1000.
+        print('{} mosquitoes, {} hosts: bucket grid {:.4f} s, loop (extrapolated) {:.4f} s'.format(M,numHosts,tindex,tbrute))
+
+def testclustered(numHosts=5000,numMosqs=2000,radius=5.0):
+    '''
+    Hosts crowded into one bucket: the index should still match brute force
+    and take memory linear in the number of hosts.
+
+    '''
+    np.random.seed(77)
+    hx = np.r_[50 + np.random.rand(numHosts-100), 100*np.random.rand(100)]
+    hy = np.r_[50 + np.random.rand(numHosts-100), 100*np.random.rand(100)]
+    x = 40 + 20*np.random.rand(numMosqs)
+    y = 40 + 20*np.random.rand(numMosqs)
+    index = sI.hostBuckets(hx,hy,radius)
+    c,w = index.nearestWithin(x,y,radius)
+    cb,wb = bruteForce(x,y,hx,hy,radius)
+    print('Clustered hosts: same as brute force? (It should be.) {}; index size {:.1f} kB for {} hosts'.format(np.array_equal(c,cb) and np.array_equal(w,wb),(index.hostOrder.nbytes + index.offsets.nbytes)/1024.,numHosts))
+
+
+if __name__ == '__main__':
+    testaccuracy()
+    testclustered()
+    testspeed()
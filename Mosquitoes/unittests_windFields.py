@@ -0,0 +1,106 @@
+import environment
+import windFields
+import numpy as np
+import os
+import shutil
+import tempfile
+import time
+
+hostx = np.array([30.0,70.0])
+hosty = np.array([40.0,60.0])
+
+def rotatingWind(xg,times,speed=0.2,period=400.0):
+    '''
+    Uniform wind of the given speed turning once every period, sampled on
+    the grid xg at times, as (T,N,N) arrays.
+
+    '''
+    angle = 2*np.pi*np.asarray(times)/period
+    U = speed*np.sin(angle)[:,np.newaxis,np.newaxis]*np.ones(xg.shape)
+    V = speed*np.cos(angle)[:,np.newaxis,np.newaxis]*np.ones(xg.shape)
+    return U, V
+
+def testconstant(N=64,finalTime=100.0):
+    '''
+    Memory-mapped frames of the default constant wind should give exactly
+    the CO2 of the velocity function, and its signal to round-off (the bulk
+    wind is interpolated from the grid).
+
+    '''
+    path = tempfile.mkdtemp()
+    try:
+        ref = environment.environment(hostx,hosty,numGridPoints=N,seed=5)
+        times = np.array([0.0,50.0,200.0])
+        windFields.saveGriddedWind(path,times,*environment.constantVel(np.ones((3,N,N)),np.ones((3,N,N))))
+        environ = environment.environment(hostx,hosty,numGridPoints=N,seed=5,velocityFunctionHandle=windFields.loadGriddedWind(path,ref.simsParams['h']))
+        for t in np.arange(0.0,finalTime,ref.simsParams['dt']):
+            ref.updateEnvironment(t)
+            environ.updateEnvironment(t)
+        np.random.seed(17)
+        x, y = 120*np.random.rand(1000)-10, 120*np.random.rand(1000)-10
+        diff = max(np.max(np.abs(a-b)) for a,b in zip(ref.querySignal(x,y),environ.querySignal(x,y)))
+        print('Constant gridded wind: same CO2 as the velocity function? (It should be.) {}; largest signal difference {:.1e} (round-off)'.format(np.array_equal(ref.CO2,environ.CO2),diff))
+    finally:
+        shutil.rmtree(path)
+
+def testrotating(N=64,finalTime=100.0,numMosqs=100000):
+    '''
+    A turning wind stored every 10 time units. The interpolated wind should
+    match the exact wind to within the linear interpolation error, the
+    plume should follow it, and querySignal should cost about the
+    same as with a velocity function.
+
+    '''
+    path = tempfile.mkdtemp()
+    try:
+        ref = environment.environment(hostx,hosty,numGridPoints=N)
+        times = np.arange(0.0,finalTime+10.0,10.0)
+        windFields.saveGriddedWind(path,times,*rotatingWind(ref.xg,times))
+        wind = windFields.loadGriddedWind(path,ref.simsParams['h'])
+        wind.setTime(55.0)
+        exact = rotatingWind(ref.xg,[55.0])
+        print('Wind at t = 55: largest difference from the exact wind {:.2e} (interpolation error)'.format(max(np.max(np.abs(wind.U-exact[0][0])),np.max(np.abs(wind.V-exact[1][0])))))
+        for integrator in ['forwardEuler','sspRK3']:
+            environ = environment.environment(hostx,hosty,numGridPoints=N,seed=5,integrator=integrator,velocityFunctionHandle=wind)
+            start = time.time()
+            for t in np.arange(0.0,finalTime,environ.simsParams['dt']):
+                environ.updateEnvironment(t)
+            # the wind has turned from +y to +x, so the plume of the host at 
+            # (30,40) should lie to its upper right
+            near = (environ.xg < 50)*environ.CO2
+            print('{:13s}: {:.2f} s, wind now ({:.3f},{:.3f}), CO2 centroid of the first plume at ({:+.1f},{:+.1f}) from its host'.format(integrator,time.time()-start,environ.constantU[0,0],environ.constantV[0,0],np.sum(near*environ.xg)/np.sum(near)-hostx[0],np.sum(near*environ.yg)/np.sum(near)-hosty[0]))
+        np.random.seed(3)
+        x, y = 100*np.random.rand(numMosqs), 100*np.random.rand(numMosqs)
+        for name,env in [('velocity function',ref),('gridded wind',environ)]:
+            start = time.time()
+            for k in range(20):
+                env.querySignal(x,y)
+            print('querySignal for {} mosquitoes with {}: {:.1f} ms'.format(numMosqs,name,1000*(time.time()-start)/20))
+    finally:
+        shutil.rmtree(path)
+
+def testoutside(sizes=(64,130,131)):
+    '''
+    Points past every edge of the grid, far and just outside, should get
+    the wind at the nearest point on the boundary of the grid. A wind
+    linear in x and y is interpolated exactly, so the values should match
+    to round-off. N = 130 and 131 are sizes on which the last cell center
+    nudged inward once rounded back onto the last grid point.
+
+    '''
+    for N in sizes:
+        h = 100.0/N
+        xg, yg = np.mgrid[h/2.0:100.0:h,h/2.0:100.0:h]
+        wind = windFields.griddedWind([0.0],(xg + 2*yg)[np.newaxis],(3*xg - yg)[np.newaxis],h)
+        x = np.array([500.0,100.0,50.0,50.0,-20.0,130.0,100.0-h/4,np.nextafter(100.0-h/2,100.0)])
+        y = np.array([50.0,50.0,500.0,100.0,-5.0,130.0,100.0-h/4,30.0])
+        xc, yc = np.clip(x,h/2,100.0-h/2), np.clip(y,h/2,100.0-h/2)
+        u, v = wind(x,y)
+        err = max(np.max(np.abs(u - (xc + 2*yc))),np.max(np.abs(v - (3*xc - yc))))
+        print('N = {}: wind outside the grid is the wind on its boundary? (It should be.) {}'.format(N,err < 1.e-12))
+
+
+if __name__ == '__main__':
+    testconstant()
+    testrotating()
+    testoutside()
@@ -0,0 +1,167 @@
+import numpy as np
+import lib_numericalMethods as nMeth
+import hashlib
+import os
+
+edgeNames = ['leftedge','rightedge','bottomedge','topedge']
+
+def ghostEdges(U,V):
+    '''
+    Ghost cell velocities for each frame of (T,N,N) wind fields U and V: the x
+    component to the left and right of the grid and the y component below
+    and above it, each of shape (T,N). The ghost cells take the value of the
+    boundary cell next to them (zero gradient). Only the boundary rows and
+    columns of each frame are read.
+
+    '''
+    return {'leftedge':np.array(U[:,0,:]),'rightedge':np.array(U[:,-1,:]),
+            'bottomedge':np.array(V[:,:,0]),'topedge':np.array(V[:,:,-1])}
+
+def saveGriddedWind(path,times,U,V,edges=None):
+    '''
+    Writes wind fields U and V of shape (T,N,N), given on the cell-centered
+    grid of an environment at the T increasing times in times, to .npy files
+    in the directory path, together with the ghost edge velocities of every
+    frame (edges, a dictionary as returned by ghostEdges, which is the
+    default). Load them with loadGriddedWind.
+
+    '''
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    if edges is None:
+        edges = ghostEdges(U,V)
+    np.save(os.path.join(path,'times.npy'),np.asarray(times,dtype=float))
+    for name,field in [('U',U),('V',V)]:
+        out = np.lib.format.open_memmap(os.path.join(path,name+'.npy'),mode='w+',dtype=float,shape=np.shape(field))
+        for k in range(len(out)):
+            out[k] = field[k]
+        out.flush()
+        del out
+    for name in edgeNames:
+        np.save(os.path.join(path,name+'.npy'),np.asarray(edges[name],dtype=float))
+
+def loadGriddedWind(path,h):
+    '''
+    Returns a griddedWind serving the wind written by saveGriddedWind to the
+    directory path. The (T,N,N) fields are memory-mapped, so only the frames
+    that are used are ever read, and the wind is pickled (e.g. for worker 
+    processes) as its path.
+
+    '''
+    U = np.load(os.path.join(path,'U.npy'),mmap_mode='r')
+    V = np.load(os.path.join(path,'V.npy'),mmap_mode='r')
+    edges = {}
+    for name in edgeNames:
+        if os.path.exists(os.path.join(path,name+'.npy')):
+            edges[name] = np.load(os.path.join(path,name+'.npy'))
+    wind = griddedWind(np.load(os.path.join(path,'times.npy')),U,V,h,edges if len(edges) == 4 else None)
+    wind.path = path
+    return wind
+
+
+class griddedWind(object):
+    '''
+    A time dependent bulk wind given as frames U and V of shape (T,N,N) (e.g.
+    memory-mapped measured or precomputed wind) on the cell-centered grid
+    with spacing h, at the T increasing times in times. Pass it to
+    environment as velocityFunctionHandle.
+
+    The wind is linearly interpolated in time, lazily: setTime(t) only reads
+    the two frames around t, and only when t falls at a different place
+    between frames than last time. Before the first and after the last time
+    the first and last frames are used. The interpolated fields are U, V and
+    the ghost edges leftedge, rightedge, bottomedge and topedge, which are
+    updated in place, so environment holds them as constantU, constantV and
+    its edge arrays. The ghost edges of every frame are computed once (see
+    ghostEdges) and kept in memory.
+
+    Like a velocity function, calling it with arrays x and y returns the
+    bulk wind at those positions, by bilinear interpolation of the current
+    fields (positions outside the grid get the value at the nearest point
+    on its boundary).
+
+    '''
+
+    # tells environment to move the wind along with the time steps
+    timeDependent = True
+
+    def __init__(self,times,U,V,h,edges=None):
+        self.times = np.asarray(times,dtype=float)
+        if U.shape != V.shape or U.ndim != 3 or U.shape[0] != len(self.times) or U.shape[1] != U.shape[2]:
+            raise ValueError('U and V must both have shape (T,N,N) with T the number of times.')
+        if np.any(np.diff(self.times) <= 0):
+            raise ValueError('times must be increasing.')
+        self.frames = {'U':U,'V':V}
+        self.frames.update(ghostEdges(U,V) if edges is None else edges)
+        self.h = h
+        self.shape = U.shape[1:]
+        # current (interpolated) fields
+        self.current = dict((name,np.empty(self.frames[name].shape[1:])) for name in ['U','V']+edgeNames)
+        self.U, self.V = self.current['U'], self.current['V']
+        self.leftedge, self.rightedge = self.current['leftedge'], self.current['rightedge']
+        self.bottomedge, self.topedge = self.current['bottomedge'], self.current['topedge']
+        # the frame and weight the current fields are for
+        self.frameKey = None
+        self.gridFields = np.empty(self.shape+(2,))
+        self.gridFieldsKey = None
+        self.queryBuffers = {}
+        self._fingerprint = None
+        # directory the wind was loaded from, if any (see loadGriddedWind)
+        self.path = None
+        self.setTime(self.times[0])
+
+    def __reduce__(self):
+        # a loaded wind is sent to other processes by path rather than by
+        # copying the frames
+        if self.path is not None:
+            return (loadGriddedWind,(self.path,self.h))
+        return object.__reduce__(self)
+
+    def setTime(self,t):
+        '''
+        Interpolates the wind to time t. Returns whether the fields changed.
+
+        '''
+        k = int(np.searchsorted(self.times,t,side='right')) - 1
+        if k < 0:
+            key = (0,0.0)
+        elif k >= len(self.times) - 1:
+            key = (len(self.times)-1,0.0)
+        else:
+            key = (k,(t - self.times[k])/(self.times[k+1] - self.times[k]))
+        if key == self.frameKey:
+            return False
+        k, w = key
+        for name,out in self.current.items():
+            frame = self.frames[name]
+            if w == 0.0:
+                out[...] = frame[k]
+            else:
+                np.subtract(frame[k+1],frame[k],out=out)
+                out *= w
+                out += frame[k]
+        self.frameKey = key
+        return True
+
+    def __call__(self,x,y):
+        if self.gridFieldsKey != self.frameKey:
+            self.gridFields[...,0] = self.U
+            self.gridFields[...,1] = self.V
+            self.gridFieldsKey = self.frameKey
+        vals = nMeth.interpFromInterleavedGrid(np.ravel(x),np.ravel(y),self.h,self.gridFields,None,self.queryBuffers,clamp=True)
+        # copies, since vals lives in queryBuffers
+        return np.array(vals[:,0]).reshape(np.shape(x)), np.array(vals[:,1]).reshape(np.shape(y))
+
+    def fingerprint(self):
+        '''
+        Returns a hash of the times and every frame, for the plume archive
+        and spin-up keys. It reads all of the data, so is computed once.
+
+        '''
+        if self._fingerprint is None:
+            key = hashlib.sha1(np.ascontiguousarray(self.times).tobytes())
+            for name in ['U','V']:
+                for frame in self.frames[name]:
+                    key.update(np.ascontiguousarray(frame,dtype=float).tobytes())
+            self._fingerprint = key.digest()
+        return self._fingerprint